@@ -0,0 +1,549 @@
+"""
+End-to-end throughput benchmark for main.py
+Drives process_niche/run_all_niches against a fake Instagram backend and a
+local S3-compatible server - no network, no Instagram account, no R2 bucket.
+
+Usage:
+  python bench_pipeline.py                          - Default run (10 profiles x 1000 posts, 5 new each)
+  python bench_pipeline.py --profiles=20 --new=20   - Bigger run
+  python bench_pipeline.py --compare=bench_results/bench_X.json
+                                                    - Compare against a previous result
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import string
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.sax.saxutils import escape
+
+import boto3
+from botocore.config import Config
+
+RESULTS_DIR = "bench_results"
+BUCKET = "bench-reels"
+
+
+# --- Synthetic MP4 Generation ---
+def mp4_box(box_type, payload):
+    """Build one MP4 box: 32-bit size + 4-char type + payload"""
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def make_synthetic_mp4(size_bytes, duration_seconds=15, seed=0):
+    """Build a structurally valid MP4 (ftyp, moov with one video trak, mdat).
+
+    The media data is random bytes, so players won't decode it, but the box
+    tree, duration and track layout are what a real reel looks like to any
+    code that reads headers.
+    """
+    timescale = 1000
+    ftyp = mp4_box(b"ftyp", b"isom" + struct.pack(">I", 512) + b"isomiso2avc1mp41")
+    mvhd = mp4_box(b"mvhd", struct.pack(">B3xIIII", 0, 0, 0, timescale, duration_seconds * timescale)
+                   + b"\x00\x01\x00\x00" + b"\x01\x00" + b"\x00" * 10 + b"\x00" * 36 + b"\x00" * 24
+                   + struct.pack(">I", 2))
+    tkhd = mp4_box(b"tkhd", struct.pack(">B3sIIIII", 0, b"\x00\x00\x03", 0, 0, 1, 0, duration_seconds * timescale)
+                   + b"\x00" * 52 + struct.pack(">II", 720 << 16, 1280 << 16))
+    mdhd = mp4_box(b"mdhd", struct.pack(">B3xIIIIHH", 0, 0, 0, timescale, duration_seconds * timescale, 0x55c4, 0))
+    hdlr = mp4_box(b"hdlr", b"\x00" * 8 + b"vide" + b"\x00" * 12 + b"VideoHandler\x00")
+    stbl = mp4_box(b"stbl", mp4_box(b"stco", struct.pack(">III", 0, 1, 0)))
+    moov = mp4_box(b"moov", mvhd + mp4_box(b"trak", tkhd + mp4_box(b"mdia", mdhd + hdlr + mp4_box(b"minf", stbl))))
+    # Point the single chunk offset at the start of the mdat payload
+    stbl = mp4_box(b"stbl", mp4_box(b"stco", struct.pack(">III", 0, 1, len(ftyp) + len(moov) + 8)))
+    moov = mp4_box(b"moov", mvhd + mp4_box(b"trak", tkhd + mp4_box(b"mdia", mdhd + hdlr + mp4_box(b"minf", stbl))))
+    media_size = max(size_bytes - len(ftyp) - len(moov) - 8, 0)
+    media = random.Random(seed).randbytes(media_size)
+    return ftyp + moov + mp4_box(b"mdat", media)
+
+
+def make_ffmpeg_mp4(path, duration_seconds, size_bytes):
+    """Encode a real test-pattern H.264 reel with FFmpeg (bitrate sized to hit size_bytes)"""
+    bitrate = max(int(size_bytes * 8 / duration_seconds), 100_000)
+    cmd = [
+        "ffmpeg", "-f", "lavfi", "-i", f"testsrc=duration={duration_seconds}:size=720x1280:rate=30",
+        "-f", "lavfi", "-i", f"sine=duration={duration_seconds}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-b:v", str(bitrate), "-c:a", "aac",
+        "-metadata", "comment=bench", "-y", path,
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+
+# --- Local S3 Stand-in ---
+class LocalS3Handler(BaseHTTPRequestHandler):
+    """Just enough of the S3 API for boto3: Put/Get/Head/Copy, multipart and ListObjectsV2.
+
+    Only object sizes and ETags are kept (bodies are discarded) so thousands
+    of uploads don't grow the server's memory.
+    """
+    protocol_version = "HTTP/1.1"
+    objects = {}  # (bucket, key) -> {"size", "etag", "modified"}
+    uploads = {}  # upload_id -> {part_number: (size, md5)}
+
+    def log_message(self, format, *args):
+        pass
+
+    def parse_path(self):
+        parsed = urlparse(self.path)
+        parts = parsed.path.lstrip("/").split("/", 1)
+        bucket = parts[0]
+        key = unquote(parts[1]) if len(parts) > 1 else ""
+        return bucket, key, parse_qs(parsed.query, keep_blank_values=True)
+
+    def read_body(self):
+        """Read the request body, undoing HTTP chunking and aws-chunked encoding"""
+        if "chunked" in self.headers.get("Transfer-Encoding", ""):
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    while self.rfile.readline() not in (b"\r\n", b""):
+                        pass
+                    break
+                body += self.rfile.read(size)
+                self.rfile.readline()
+            body = bytes(body)
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if "aws-chunked" in self.headers.get("Content-Encoding", ""):
+            decoded = bytearray()
+            pos = 0
+            while True:
+                line_end = body.index(b"\r\n", pos)
+                size = int(body[pos:line_end].split(b";")[0], 16)
+                pos = line_end + 2
+                if size == 0:
+                    break
+                decoded += body[pos:pos + size]
+                pos += size + 2
+            body = bytes(decoded)
+        return body
+
+    def send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_xml(self, xml):
+        self.send(200, ('<?xml version="1.0" encoding="UTF-8"?>' + xml).encode(), {"Content-Type": "application/xml"})
+
+    def not_found(self):
+        self.send(404, b'<?xml version="1.0" encoding="UTF-8"?><Error><Code>NoSuchKey</Code></Error>',
+                  {"Content-Type": "application/xml"})
+
+    def do_PUT(self):
+        bucket, key, query = self.parse_path()
+        body = self.read_body()
+        if "partNumber" in query:
+            etag = hashlib.md5(body).hexdigest()
+            self.uploads[query["uploadId"][0]][int(query["partNumber"][0])] = (len(body), etag)
+            self.send(200, headers={"ETag": f'"{etag}"'})
+            return
+        copy_source = self.headers.get("x-amz-copy-source")
+        if copy_source:
+            src_bucket, src_key = unquote(copy_source).lstrip("/").split("/", 1)
+            source = self.objects.get((src_bucket, src_key))
+            if source is None:
+                self.not_found()
+                return
+            self.objects[(bucket, key)] = dict(source, modified=time.time())
+            self.send_xml(f'<CopyObjectResult><ETag>"{source["etag"]}"</ETag>'
+                          f'<LastModified>{iso_time(time.time())}</LastModified></CopyObjectResult>')
+            return
+        checksum = self.headers.get("x-amz-checksum-sha256")
+        if checksum and checksum != base64.b64encode(hashlib.sha256(body).digest()).decode():
+            self.send(400, b'<?xml version="1.0" encoding="UTF-8"?><Error><Code>BadDigest</Code></Error>',
+                      {"Content-Type": "application/xml"})
+            return
+        etag = hashlib.md5(body).hexdigest()
+        self.objects[(bucket, key)] = {"size": len(body), "etag": etag, "modified": time.time()}
+        self.send(200, headers={"ETag": f'"{etag}"'})
+
+    def do_POST(self):
+        bucket, key, query = self.parse_path()
+        self.read_body()
+        if "uploads" in query:
+            upload_id = uuid.uuid4().hex
+            self.uploads[upload_id] = {}
+            self.send_xml(f"<InitiateMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key>"
+                          f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+        elif "uploadId" in query:
+            parts = self.uploads.pop(query["uploadId"][0])
+            size = sum(part_size for part_size, _ in parts.values())
+            etag = hashlib.md5("".join(etag for _, etag in parts.values()).encode()).hexdigest() + f"-{len(parts)}"
+            self.objects[(bucket, key)] = {"size": size, "etag": etag, "modified": time.time()}
+            self.send_xml(f"<CompleteMultipartUploadResult><Bucket>{bucket}</Bucket><Key>{escape(key)}</Key>"
+                          f'<ETag>"{etag}"</ETag></CompleteMultipartUploadResult>')
+        else:
+            self.send(400)
+
+    def do_DELETE(self):
+        bucket, key, query = self.parse_path()
+        if "uploadId" in query:
+            self.uploads.pop(query["uploadId"][0], None)
+        else:
+            self.objects.pop((bucket, key), None)
+        self.send(204)
+
+    def do_HEAD(self):
+        bucket, key, _ = self.parse_path()
+        obj = self.objects.get((bucket, key))
+        if obj is None:
+            self.not_found()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(obj["size"]))
+        self.send_header("ETag", f'"{obj["etag"]}"')
+        self.end_headers()
+
+    def do_GET(self):
+        bucket, key, query = self.parse_path()
+        if key:
+            obj = self.objects.get((bucket, key))
+            if obj is None:
+                self.not_found()
+                return
+            self.send(200, b"\x00" * obj["size"], {"ETag": f'"{obj["etag"]}"', "Content-Type": "video/mp4"})
+            return
+        # ListObjectsV2
+        prefix = query.get("prefix", [""])[0]
+        max_keys = int(query.get("max-keys", ["1000"])[0])
+        start_after = query.get("continuation-token", [""])[0]
+        keys = sorted(k for b, k in self.objects if b == bucket and k.startswith(prefix) and k > start_after)
+        page, truncated = keys[:max_keys], len(keys) > max_keys
+        contents = "".join(
+            f"<Contents><Key>{escape(k)}</Key><LastModified>{iso_time(self.objects[(bucket, k)]['modified'])}</LastModified>"
+            f'<ETag>"{self.objects[(bucket, k)]["etag"]}"</ETag><Size>{self.objects[(bucket, k)]["size"]}</Size>'
+            f"<StorageClass>STANDARD</StorageClass></Contents>"
+            for k in page
+        )
+        token = f"<NextContinuationToken>{escape(page[-1])}</NextContinuationToken>" if truncated else ""
+        self.send_xml(f'<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/"><Name>{bucket}</Name>'
+                      f"<Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>"
+                      f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>{contents}{token}</ListBucketResult>")
+
+
+def iso_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def serve_local_s3(port_queue):
+    """Run the S3 stand-in (in a child process so its memory isn't counted as ours)"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LocalS3Handler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+# --- Fake Instagram Backend ---
+class FakePost:
+    """Stands in for instaloader.Post with the attributes main.py reads"""
+
+    def __init__(self, owner, index, is_video, duration, rng):
+        self.owner_username = owner
+        self.shortcode = "".join(rng.choice(string.ascii_letters + string.digits + "_-") for _ in range(11))
+        self.is_video = is_video
+        self.video_duration = duration if is_video else None
+        self.date_utc = datetime(2026, 1, 1) - timedelta(hours=index * 7)
+        self.date_local = self.date_utc
+        self.is_pinned = False
+        self.likes = rng.randint(10, 50_000)
+        self.comments = rng.randint(0, 2_000)
+        self.video_view_count = self.likes * rng.randint(5, 40) if is_video else None
+        self.title = None
+        self.caption = (" ".join(rng.choice(["Amazing", "workout", "recipe", "🔥", "day", "routine", "vibes"])
+                                 for _ in range(rng.randint(3, 40)))
+                        + " " + " ".join(f"#tag{rng.randint(1, 500)}" for _ in range(rng.randint(0, 15))))
+        self.video_url = f"https://cdn.fake.invalid/{self.shortcode}.mp4"
+        self.url = self.video_url
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Fake CDN serving each post's MP4 over keep-alive HTTP/1.1 (server.backend holds the posts)"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        backend = self.server.backend
+        post = backend.by_url.get(backend.media_base_url + self.path)
+        if post is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = backend.media_for(post)
+        backend.simulate_transfer(len(data))
+        self.send_response(200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeBackend:
+    """Synthetic profiles with many posts and a download that writes generated MP4s"""
+
+    def __init__(self, usernames, posts_per_profile, video_ratio, media, download_latency, download_mbps, seed,
+                 media_base_url):
+        rng = random.Random(seed)
+        self.media_base_url = media_base_url
+        self.media = media  # list of MP4 byte strings, reused across posts
+        self.download_latency = download_latency
+        self.download_mbps = download_mbps
+        self.posts = {
+            username: [FakePost(username, i, rng.random() < video_ratio, rng.randint(5, 90), rng)
+                       for i in range(posts_per_profile)]
+            for username in usernames
+        }
+        for posts in self.posts.values():
+            for post in posts:
+                post.video_url = post.url = f"{media_base_url}/{post.shortcode}.mp4"
+        self.by_url = {post.video_url: post for posts in self.posts.values() for post in posts}
+
+    def profile_from_username(self, context, username):
+        profile = mock.Mock()
+        profile.username = username
+        profile.followers = 100_000
+        profile.get_posts = lambda: iter(self.posts[username])
+        return profile
+
+    def media_for(self, post):
+        return self.media[zlib.crc32(post.shortcode.encode()) % len(self.media)]
+
+    def simulate_transfer(self, nbytes):
+        delay = self.download_latency
+        if self.download_mbps:
+            delay += nbytes * 8 / (self.download_mbps * 1_000_000)
+        if delay:
+            time.sleep(delay)
+
+
+# --- Benchmark Run ---
+def peak_rss_mb():
+    """Peak resident set size of this process (ru_maxrss is KB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def build_media(args, workdir):
+    """Generate the MP4 payloads served by the fake backend"""
+    size_bytes = int(args.size_mb * 1024 * 1024)
+    if shutil.which("ffmpeg") and not args.synthetic:
+        path = os.path.join(workdir, "reel.mp4")
+        if make_ffmpeg_mp4(path, 15, size_bytes):
+            with open(path, "rb") as f:
+                return [f.read()], "ffmpeg"
+    return [make_synthetic_mp4(size_bytes, seed=i) for i in range(4)], "synthetic"
+
+
+def run_benchmark(args):
+    """Run the pipeline once against the fakes and return the result dict"""
+    import main
+
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve_local_s3, args=(port_queue,), daemon=True)
+    server.start()
+    port = port_queue.get(timeout=10)
+    # The fake CDN runs in this process: the backend's posts live here
+    media_server = ThreadingHTTPServer(("127.0.0.1", 0), MediaHandler)
+    media_server.daemon_threads = True
+    threading.Thread(target=media_server.serve_forever, daemon=True).start()
+    old_cwd = os.getcwd()
+
+    try:
+        os.chdir(workdir)
+        media, media_kind = build_media(args, workdir)
+        rng = random.Random(args.seed)
+
+        s3_client = boto3.client(
+            "s3", endpoint_url=f"http://127.0.0.1:{port}", aws_access_key_id="bench", aws_secret_access_key="bench",
+            region_name="auto", config=Config(s3={"addressing_style": "path"}, max_pool_connections=max(args.threads * 2, 10)),
+        )
+
+        niches = {}
+        backend_users = []
+        for n in range(1, args.niches + 1):
+            usernames = [f"bench_n{n}_user{i}" for i in range(args.profiles)]
+            backend_users += usernames
+            niches[f"niche{n}"] = {
+                "links_file": f"links_niche{n}.txt",
+                "output_csv": f"reels_niche{n}.csv",
+                "processed_file": f"processed_niche{n}.txt",
+                "failed_file": f"failed_niche{n}.txt",
+                "drive_folder": f"niche{n}_reels",
+            }
+            with open(f"links_niche{n}.txt", "w") as f:
+                f.write("".join(f"https://www.instagram.com/{u}/\n" for u in usernames))
+
+        backend = FakeBackend(backend_users, args.posts, args.video_ratio, media,
+                              args.download_latency_ms / 1000, args.download_mbps, args.seed,
+                              f"http://127.0.0.1:{media_server.server_address[1]}")
+        media_server.backend = backend
+
+        # Everything except the newest `--new` videos per profile is already processed
+        expected_new = 0
+        for n in range(1, args.niches + 1):
+            with open(f"processed_niche{n}.txt", "w") as f:
+                for username in (u for u in backend_users if u.startswith(f"bench_n{n}_")):
+                    videos = [p for p in backend.posts[username] if p.is_video]
+                    expected_new += min(args.new, len(videos))
+                    f.write("".join(p.shortcode + "\n" for p in videos[args.new:]))
+
+        main.METRICS = main.RunMetrics()
+        transport = main.MediaTransport()
+        with mock.patch.object(main, "MEDIA_TRANSPORT", transport), \
+             mock.patch.object(main.instaloader.Profile, "from_username", backend.profile_from_username), \
+             mock.patch.object(main, "_r2_client", s3_client), \
+             mock.patch.object(main, "R2_BUCKET_NAME", BUCKET), \
+             mock.patch.object(main, "NICHES", niches), \
+             mock.patch.object(main, "THREADS", args.threads), \
+             mock.patch.object(main, "IN_MEMORY_STAGING", args.in_memory), \
+             mock.patch.object(main, "DOWNLOAD_BYTES_PER_SECOND", args.limit_download_mbps * 125_000 or None), \
+             mock.patch.object(main, "UPLOAD_BYTES_PER_SECOND", args.limit_upload_mbps * 125_000 or None), \
+             mock.patch.object(main, "NICHE_DELAY_SECONDS", 0), \
+             mock.patch.object(main, "METRICS_DIR", os.path.join(workdir, "metrics")):
+            start = time.perf_counter()
+            if args.mode == "all":
+                main.run_all_niches(with_delay=False)
+            else:
+                main.process_niche("niche1", niches["niche1"])
+            elapsed = time.perf_counter() - start
+
+        uploaded = 0
+        for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=BUCKET):
+            uploaded += page.get("KeyCount", 0)
+        summary = main.METRICS.summary()
+        upload_bytes = sum(stage.get("upload", {}).get("bytes", 0) for stage in summary["stages"].values())
+
+        return {
+            "benchmark": "pipeline",
+            "version": git_version(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "params": {k: v for k, v in vars(args).items() if k not in ("compare", "output")},
+            "media": media_kind,
+            "posts_crawled": args.niches * args.profiles * args.posts if args.mode == "all" else args.profiles * args.posts,
+            "videos_expected": expected_new if args.mode == "all" else expected_new // args.niches,
+            "videos_uploaded": uploaded,
+            "elapsed_seconds": round(elapsed, 3),
+            "videos_per_minute": round(uploaded / elapsed * 60, 2) if elapsed else 0,
+            "mb_per_second": round(upload_bytes / elapsed / (1024 * 1024), 3) if elapsed else 0,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "stages": summary["stages"],
+            "failures": summary["failures"],
+            "media_transport": transport.snapshot(),
+        }
+    finally:
+        os.chdir(old_cwd)
+        media_server.shutdown()
+        server.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare_results(current, previous):
+    """Print the change in headline numbers against a previous result"""
+    print(f"\nComparison with {previous.get('version')} ({previous.get('timestamp')}):")
+    for metric, higher_is_better in (("videos_per_minute", True), ("mb_per_second", True),
+                                     ("peak_rss_mb", False), ("elapsed_seconds", False)):
+        old, new = previous.get(metric), current.get(metric)
+        if not old:
+            continue
+        change = (new - old) / old * 100
+        better = (change > 0) == higher_is_better
+        print(f"  {metric:<20} {old:>10} -> {new:>10}  ({change:+.1f}% {'better' if better else 'worse'})")
+
+
+def print_result(result):
+    print("\n" + "=" * 60)
+    print(f"PIPELINE BENCHMARK ({result['version']}, {result['media']} media)")
+    print("=" * 60)
+    print(f"Posts crawled:     {result['posts_crawled']}")
+    print(f"Videos uploaded:   {result['videos_uploaded']} / {result['videos_expected']}")
+    print(f"Elapsed:           {result['elapsed_seconds']} s")
+    print(f"Videos/min:        {result['videos_per_minute']}")
+    print(f"Upload MB/s:       {result['mb_per_second']}")
+    print(f"Peak RSS:          {result['peak_rss_mb']} MB")
+    transport = result.get("media_transport")
+    if transport:
+        print(f"Media connections: {transport['new_connections']} opened for {transport['downloads']} downloads "
+              f"({transport['reuse_ratio']:.0%} reused)")
+    print("\nPer-stage times:")
+    for folder, stages in sorted(result["stages"].items()):
+        for stage, entry in sorted(stages.items()):
+            print(f"  {folder + '/' + stage:<28} n={entry['count']:<6} total={entry['seconds']:>9.3f}s "
+                  f"avg={entry['avg_seconds']:>7.3f}s max={entry['max_seconds']:>7.3f}s")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Hermetic end-to-end benchmark for main.py")
+    parser.add_argument("--mode", choices=("niche", "all"), default="niche",
+                        help="process_niche on one niche, or run_all_niches on --niches niches")
+    parser.add_argument("--niches", type=int, default=1)
+    parser.add_argument("--profiles", type=int, default=10, help="profiles per niche")
+    parser.add_argument("--posts", type=int, default=1000, help="posts per profile (crawled)")
+    parser.add_argument("--new", type=int, default=5, help="new (unprocessed) videos per profile")
+    parser.add_argument("--video-ratio", type=float, default=0.8, help="fraction of posts that are videos")
+    parser.add_argument("--size-mb", type=float, default=2.0, help="size of each generated MP4")
+    parser.add_argument("--threads", type=int, default=1, help="main.THREADS for the run")
+    parser.add_argument("--download-latency-ms", type=float, default=0.0, help="simulated CDN latency per download")
+    parser.add_argument("--download-mbps", type=float, default=0.0, help="simulated CDN bandwidth (0 = unlimited)")
+    parser.add_argument("--in-memory", action="store_true", help="run with main.IN_MEMORY_STAGING enabled")
+    parser.add_argument("--limit-download-mbps", type=float, default=0.0,
+                        help="main.DOWNLOAD_BYTES_PER_SECOND in Mbit/s (0 = unlimited)")
+    parser.add_argument("--limit-upload-mbps", type=float, default=0.0,
+                        help="main.UPLOAD_BYTES_PER_SECOND in Mbit/s (0 = unlimited)")
+    parser.add_argument("--synthetic", action="store_true", help="use synthetic MP4s even if FFmpeg is available")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="result file (default: bench_results/bench_<timestamp>.json)")
+    parser.add_argument("--compare", help="previous result file to compare against")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.mode == "all" and args.niches < 2:
+        args.niches = 5
+    result = run_benchmark(args)
+    print_result(result)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResult written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare_results(result, json.load(f))
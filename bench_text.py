@@ -0,0 +1,191 @@
+"""
+Micro-benchmarks for caption formatting and text normalisation in main.py
+Times normalize_text, remove_emojis and format_for_pinterest over a realistic
+caption corpus and fails when a function goes over its budget.
+
+Usage:
+  python bench_text.py                   - Run with the default budgets
+  python bench_text.py --captions=2000   - Bigger corpus
+  python bench_text.py --no-budget       - Report only, never fail
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+RESULTS_DIR = "bench_results"
+
+# Budget per function: mean nanoseconds per caption over the whole corpus.
+# Machine dependent - roughly 1.5x what a typical dev box measures today.
+BUDGETS_NS = {
+    "normalize_text": 300_000,
+    "remove_emojis": 75_000,
+    "format_for_pinterest": 350_000,
+}
+
+
+# --- Caption Corpus ---
+WORDS = ["amazing", "workout", "recipe", "morning", "routine", "vibes", "summer", "travel", "coffee",
+         "tutorial", "easy", "healthy", "quick", "best", "ever", "today", "new", "challenge"]
+EMOJIS = ["🔥", "😍", "💪", "✨", "🙌", "😂", "❤️", "👀", "🎉", "🍕", "🌊", "👨‍👩‍👧", "🇺🇸", "☀️", "🏋️‍♀️"]
+RTL_WORDS = ["مرحبا", "بالعالم", "تمرين", "وصفة", "שלום", "עולם", "מתכון", "صباح", "الخير"]
+ZERO_WIDTH = ["\u200b", "\u200c", "\u200d", "\u200e", "\u200f", "\u2060", "\ufeff"]
+
+
+def long_caption(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(300, 400))) + "\n\n" + \
+           " ".join(f"#{rng.choice(WORDS)}" for _ in range(10))
+
+
+def emoji_caption(rng):
+    return "".join(rng.choice(EMOJIS) + (rng.choice(WORDS) + " " if rng.random() < 0.3 else "")
+                   for _ in range(rng.randint(50, 200)))
+
+
+def rtl_caption(rng):
+    return " ".join(rng.choice(RTL_WORDS + WORDS[:3]) for _ in range(rng.randint(20, 80))) + \
+           " " + " ".join(f"#{rng.choice(RTL_WORDS)}" for _ in range(5))
+
+
+def zero_width_caption(rng):
+    text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 60)))
+    return "".join(ch + "".join(rng.choice(ZERO_WIDTH) for _ in range(rng.randint(0, 3))) for ch in text)
+
+
+def hashtag_caption(rng):
+    return "Follow for more\n" + " ".join(f"#{rng.choice(WORDS)}{rng.randint(0, 999)}"
+                                          for _ in range(rng.randint(200, 400)))
+
+
+def short_caption(rng):
+    return f"{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)} {rng.choice(EMOJIS)}"
+
+
+CAPTION_KINDS = {
+    "long": long_caption,
+    "emoji": emoji_caption,
+    "rtl": rtl_caption,
+    "zero_width": zero_width_caption,
+    "hashtags": hashtag_caption,
+    "short": short_caption,
+}
+
+
+def build_corpus(count, seed=1):
+    """Build `count` captions spread evenly over every kind (plus a few empty ones)"""
+    rng = random.Random(seed)
+    kinds = list(CAPTION_KINDS.values())
+    corpus = [kinds[i % len(kinds)](rng) for i in range(count)]
+    corpus[::50] = [""] * len(corpus[::50])
+    return corpus
+
+
+# --- Measurement ---
+def time_function(func, corpus, repeats):
+    """Best-of-`repeats` mean nanoseconds per caption"""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter_ns()
+        for caption in corpus:
+            func(caption)
+        elapsed = time.perf_counter_ns() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(corpus)
+
+
+def measure_allocations(func, corpus):
+    """Mean and max peak traced memory (bytes) allocated by a single call"""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for caption in corpus:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            func(caption)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return sum(peaks) / len(peaks), max(peaks)
+
+
+def run_benchmarks(captions, repeats, seed):
+    import main
+
+    corpus = build_corpus(captions, seed)
+    functions = {
+        "normalize_text": main.normalize_text,
+        "remove_emojis": main.remove_emojis,
+        "format_for_pinterest": lambda caption: main.format_for_pinterest(caption, "https://pub-x.r2.dev/a.mp4"),
+    }
+
+    results = {}
+    for name, func in functions.items():
+        ns_per_caption = time_function(func, corpus, repeats)
+        mean_alloc, max_alloc = measure_allocations(func, corpus)
+        per_kind = {
+            kind: round(time_function(func, [c for i, c in enumerate(corpus) if i % len(CAPTION_KINDS) == k and c],
+                                      repeats))
+            for k, kind in enumerate(CAPTION_KINDS)
+        }
+        results[name] = {
+            "ns_per_caption": round(ns_per_caption),
+            "ns_per_caption_by_kind": per_kind,
+            "mean_peak_alloc_bytes": round(mean_alloc),
+            "max_peak_alloc_bytes": max_alloc,
+            "budget_ns": BUDGETS_NS.get(name),
+        }
+    return results
+
+
+def check_budgets(results):
+    """Return the names of functions that went over their budget"""
+    return [name for name, result in results.items()
+            if result["budget_ns"] is not None and result["ns_per_caption"] > result["budget_ns"]]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Caption formatting micro-benchmarks")
+    parser.add_argument("--captions", type=int, default=600, help="corpus size")
+    parser.add_argument("--repeats", type=int, default=5, help="timing repeats (best is kept)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--budget-file", help="JSON file of {function: ns_per_caption} overriding the defaults")
+    parser.add_argument("--no-budget", action="store_true", help="report only, never fail")
+    parser.add_argument("--output", help="result file (default: bench_results/text_<timestamp>.json)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.budget_file:
+        with open(args.budget_file, encoding="utf-8") as f:
+            BUDGETS_NS.update(json.load(f))
+
+    results = run_benchmarks(args.captions, args.repeats, args.seed)
+
+    print("=" * 72)
+    print(f"TEXT BENCHMARKS ({args.captions} captions, best of {args.repeats})")
+    print("=" * 72)
+    print(f"{'Function':<24}{'ns/caption':>12}{'budget':>12}{'mean alloc B':>14}{'max alloc B':>12}")
+    for name, result in results.items():
+        budget = result["budget_ns"] if result["budget_ns"] is not None else "-"
+        print(f"{name:<24}{result['ns_per_caption']:>12}{budget:>12}"
+              f"{result['mean_peak_alloc_bytes']:>14}{result['max_peak_alloc_bytes']:>12}")
+        for kind, ns in result["ns_per_caption_by_kind"].items():
+            print(f"  {kind:<22}{ns:>12}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"text_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"benchmark": "text", "timestamp": datetime.now().isoformat(timespec="seconds"),
+                   "captions": args.captions, "results": results}, f, indent=2)
+    print(f"\nResult written to {output}")
+
+    over_budget = [] if args.no_budget else check_budgets(results)
+    if over_budget:
+        print(f"\nFAILED: over budget: {', '.join(over_budget)}")
+        sys.exit(1)
@@ -1,5 +1,9 @@
 import instaloader
+from instaloader.instaloadercontext import default_user_agent
+import requests
+from requests.adapters import HTTPAdapter
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import NoCredentialsError
 import os
 import csv
@@ -10,15 +14,28 @@ import re
 import unicodedata
 import subprocess
 import shutil
-from datetime import datetime, timedelta
+import sqlite3
+import threading
+import heapq
+import socket
+import json
+import cProfile
+import pstats
+import io
+import struct
+import weakref
+import math
+import hashlib
+import base64
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
-# Simple counter for video numbering (sequential processing)
-video_counter = 0
-
-def get_next_video_number():
-    global video_counter
-    video_counter += 1
-    return video_counter
+try:
+    import fcntl  # POSIX only - cross-process locking of the tracking files
+except ImportError:
+    fcntl = None
 
 # --- Cloudflare R2 Configuration ---
 R2_ACCOUNT_ID = "your_account_id"
@@ -27,6 +44,19 @@ R2_SECRET_KEY = "your_secret_key"
 R2_BUCKET_NAME = "pinterest-reels"
 R2_PUBLIC_DOMAIN = "https://pub-xxxxxxxx.r2.dev"  # Found in Bucket Settings -> Public Access
 
+# Object keys: "numbered" -> niche1_reels/001_username_shortcode.mp4
+#              "content"  -> niche1_reels/<16 hex chars of SHA-256>_username_shortcode.mp4
+# Content keys never point at different bytes, so the CDN may cache them forever.
+R2_KEY_SCHEME = "numbered"
+# Headers sent with every upload (None = don't send)
+R2_CACHE_CONTROL = "public, max-age=86400"
+R2_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"  # Used for content keys
+R2_CONTENT_DISPOSITION = "inline"   # The object's filename is appended
+R2_CHECKSUM_ALGORITHM = "SHA256"    # R2 rejects a body that doesn't match
+# Uploads below this go out as one PUT carrying our own full-object SHA-256;
+# larger ones are multipart with a checksum per part
+R2_MULTIPART_THRESHOLD = TransferConfig().multipart_threshold
+
 # --- Instaloader Setup ---
 # Login recommended for better rate limits and smoother pipeline
 # Use a burner Instagram account with no posting activity
@@ -34,21 +64,204 @@ USE_LOGIN = True
 USERNAME = "your_username"  # Fill with your burner account
 PASSWORD = "your_password"  # Fill with your burner account password
 
-L = instaloader.Instaloader(
-    download_comments=False,
-    download_geotags=False,
-    save_metadata=False,
-    post_metadata_txt_pattern=""
-)
+# --- Instagram Session Pool ---
+# One "username:password" per line; every account gets its own rate budget.
+# Without this file the single USERNAME/PASSWORD account above is used.
+ACCOUNTS_FILE = "instagram_accounts.txt"
+SESSION_DIR = "sessions"  # Saved Instaloader sessions (avoids logging in every run)
+SESSION_REQUESTS_PER_MINUTE = 20  # Instagram queries per account
+SESSION_BURST = 5
+SESSION_429_COOLDOWN_SECONDS = 15 * 60
+SESSION_CHECKPOINT_COOLDOWN_SECONDS = 6 * 3600
+# Profiles crawled at once within a niche; all their queries share one
+# machine-wide budget on top of each account's own
+PROFILE_CONCURRENCY = 4
+CRAWL_REQUESTS_PER_MINUTE = 60
+CRAWL_BURST = 10
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens/second, holding at most `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens=1):
+        """Seconds until `tokens` could be consumed"""
+        with self.lock:
+            self._refill()
+            return max(min(tokens, self.capacity) - self.tokens, 0) / self.rate
+
+    def consume(self, tokens=1):
+        """Take tokens, sleeping until they are available.
+
+        Requests larger than the capacity go through once the bucket is
+        full and leave it in debt, so big chunks are still paced correctly.
+        """
+        while True:
+            with self.lock:
+                self._refill()
+                needed = min(tokens, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Shared by every session, so concurrent crawls can't exceed the machine-wide rate
+CRAWL_RATE_LIMITER = TokenBucket(CRAWL_REQUESTS_PER_MINUTE / 60, CRAWL_BURST)
+
+class SessionRateController(instaloader.RateController):
+    """Instaloader rate controller that charges every query to the shared crawl
+    budget and to one session's budget"""
+
+    def __init__(self, context, session):
+        super().__init__(context)
+        self.session = session
+
+    def wait_before_query(self, query_type):
+        CRAWL_RATE_LIMITER.consume()
+        self.session.bucket.consume()
+        super().wait_before_query(query_type)
+
+    def handle_429(self, query_type):
+        """Cool this session down and fail fast so work moves to another session"""
+        self.session.cool_down(SESSION_429_COOLDOWN_SECONDS, "429 Too Many Requests")
+        raise instaloader.exceptions.TooManyRequestsException(
+            f"429 Too Many Requests on session {self.session.username or 'anonymous'}")
+
+class InstagramSession:
+    """One Instagram account: its Instaloader, rate budget and health"""
+
+    def __init__(self, username=None, password=None):
+        self.username = username
+        self.password = password
+        self.bucket = TokenBucket(SESSION_REQUESTS_PER_MINUTE / 60, SESSION_BURST)
+        self.cooldown_until = 0.0
+        self.last_used = 0.0
+        self.loader = instaloader.Instaloader(
+            download_comments=False,
+            download_geotags=False,
+            save_metadata=False,
+            post_metadata_txt_pattern="",
+            rate_controller=lambda context: SessionRateController(context, self)
+        )
+
+    @property
+    def healthy(self):
+        return time.monotonic() >= self.cooldown_until
+
+    def cool_down(self, seconds, reason):
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + seconds)
+        print(f"⚠ Session {self.username or 'anonymous'} cooling down for {seconds // 60} min: {reason}")
+
+    def login(self):
+        """Reuse a saved session file if there is one, otherwise log in and save it"""
+        session_file = os.path.join(SESSION_DIR, f"session-{self.username}")
+        if os.path.exists(session_file):
+            self.loader.load_session_from_file(self.username, session_file)
+            if self.loader.test_login() == self.username:
+                print(f"Logged in to Instagram as {self.username} (saved session)")
+                return
+        self.loader.login(self.username, self.password)
+        os.makedirs(SESSION_DIR, exist_ok=True)
+        self.loader.save_session_to_file(session_file)
+        print(f"Logged in to Instagram as {self.username}")
+
+def classify_session_error(error):
+    """Return "rate_limited", "checkpoint" or None for an Instagram error"""
+    text = str(error).lower()
+    if isinstance(error, instaloader.exceptions.TooManyRequestsException) or "429" in text:
+        return "rate_limited"
+    if isinstance(error, instaloader.exceptions.LoginRequiredException) or \
+       "checkpoint" in text or "challenge" in text:
+        return "checkpoint"
+    return None
+
+class SessionPool:
+    """Spreads Instagram queries over every healthy session"""
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Pick the healthy session with the most rate budget left (then least recently used).
 
-if USE_LOGIN:
-    L.login(USERNAME, PASSWORD)
-    print("Logged in to Instagram")
-else:
-    print("Running without Instagram login (public profiles only)")
+        If every session is cooling down, waits for the first one to recover.
+        """
+        while True:
+            with self.lock:
+                healthy = [session for session in self.sessions if session.healthy]
+                if healthy:
+                    session = min(healthy, key=lambda s: (s.bucket.wait_time(), s.last_used))
+                    session.last_used = time.monotonic()
+                    return session
+                wait = min(session.cooldown_until for session in self.sessions) - time.monotonic()
+            print(f"All Instagram sessions cooling down, waiting {max(wait, 1) / 60:.1f} min...")
+            time.sleep(max(wait, 1))
+
+    def report_error(self, session, error):
+        """Cool a session down if the error says Instagram is limiting it"""
+        reason = classify_session_error(error)
+        if reason == "rate_limited":
+            session.cool_down(SESSION_429_COOLDOWN_SECONDS, str(error))
+        elif reason == "checkpoint":
+            session.cool_down(SESSION_CHECKPOINT_COOLDOWN_SECONDS, str(error))
+
+# Anonymous session until instagram_login() runs
+SESSION_POOL = SessionPool([InstagramSession()])
+
+def load_accounts():
+    """Read (username, password) pairs from ACCOUNTS_FILE, or fall back to USERNAME/PASSWORD"""
+    if os.path.exists(ACCOUNTS_FILE):
+        accounts = []
+        with open(ACCOUNTS_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#") and ":" in line:
+                    username, password = line.split(":", 1)
+                    accounts.append((username.strip(), password.strip()))
+        return accounts
+    return [(USERNAME, PASSWORD)] if USE_LOGIN else []
+
+def instagram_login():
+    """Log in every configured account (called at startup, not on import)"""
+    global SESSION_POOL
+    sessions = []
+    for username, password in load_accounts():
+        session = InstagramSession(username, password)
+        try:
+            session.login()
+            sessions.append(session)
+        except Exception as e:
+            print(f"WARNING: Login failed for {username}: {e}")
+    
+    if not sessions:
+        print("Running without Instagram login (public profiles only)")
+        sessions = [InstagramSession()]
+    elif len(sessions) > 1:
+        print(f"Instagram session pool: {len(sessions)} accounts")
+    
+    SESSION_POOL = SessionPool(sessions)
 
 # --- Files & Niche Configuration ---
 # 5 niches with separate input/output files
+# A niche may add "filters" to skip videos before they are downloaded, using
+# only the post metadata from the listing. Any subset of:
+#   "min_duration" / "max_duration"   video length in seconds
+#   "max_age_days"                    older posts are skipped (and the crawl stops there)
+#   "min_views" / "min_likes"         posts whose counts are unknown are kept
+#   "max_estimated_bytes"             size cap, estimated from the duration
+# e.g. "filters": {"max_duration": 90, "max_age_days": 30, "min_views": 10000}
 NICHES = {
     "niche1": {
         "links_file": "links_niche1.txt",
@@ -92,10 +305,393 @@ NICHE_DELAY_HOURS = 1
 NICHE_DELAY_SECONDS = NICHE_DELAY_HOURS * 3600
 
 RETRIES = 3
-THREADS = 1  # Sequential processing - safer for Drive API
+# Videos processed at once per niche (and claim loops per --worker). Numbering,
+# CSV/processed-file appends and staging budgets are thread-safe; 1 = sequential.
+THREADS = 1
+
+# --- Prioritization & Budget ---
+# New videos are processed highest score first, so a run cut short still gets
+# the best ones. Each component is roughly 0..1; a niche may override the
+# weights with its own "score_weights"
+SCORE_WEIGHTS = {
+    "recency": 1.0,     # Halves every RECENCY_HALF_LIFE_DAYS
+    "views": 1.0,       # log scale, 1.0 at 10M views
+    "likes": 0.5,       # log scale, 1.0 at 1M likes
+    "engagement": 1.0,  # (likes + comments) / views, 1.0 at 10%
+}
+RECENCY_HALF_LIFE_DAYS = 7
+# Optional per-niche cap for a run, set with --budget=N (videos), --budget=500mb / 2gb
+# (estimated bytes) or --budget=45m (minutes of processing)
+RUN_BUDGET = None
+
+# --retry-failed: posts resolved and reprocessed at once, and the base delay
+# (doubled per attempt, with jitter) before retrying a post that won't resolve
+RETRY_FAILED_CONCURRENCY = 4
+RETRY_FAILED_BACKOFF_SECONDS = 5
+
+# --- Cross-Niche Reuse ---
+# A post already uploaded for another niche (per the uploads table in STATE_DB)
+# isn't downloaded again: "copy" copies the object server-side into this
+# niche's prefix, "link" points this niche's CSV at the existing object,
+# None always downloads.
+CROSS_NICHE_REUSE = "copy"
+
+# --- Pinterest Export ---
+# --export writes the uploads recorded in STATE_DB since the last export as
+# Pinterest bulk-upload CSVs: EXPORT_DIR/<niche>/pins_<niche>_0001.csv, ...
+# A niche may set "board" to fill the board column.
+EXPORT_DIR = "exports"
+EXPORT_SHARD_ROWS = 200          # Pinterest takes at most 200 pins per bulk CSV
+EXPORT_SETTLE_SECONDS = 3600     # Uploads still waiting for their CSV row hold the cursor this long
+
+# --- Daemon Mode ---
+# --daemon polls each profile on its own schedule: a fraction of its average
+# gap between posts (or of how long it has been silent), clamped to the
+# bounds below and doubled after every consecutive error
+DAEMON_MIN_POLL_SECONDS = 5 * 60
+DAEMON_MAX_POLL_SECONDS = 12 * 3600
+DAEMON_DEFAULT_POLL_SECONDS = 30 * 60  # Until a profile's rhythm is known
+DAEMON_POLL_FRACTION = 0.5
+DAEMON_GAP_SMOOTHING = 0.3             # Weight of the latest observed gap in the moving average
+DAEMON_RELOAD_SECONDS = 60             # How often links files are checked for changes
+
+# --- In-Memory Staging ---
+# Keep downloads in RAM from download through upload (no *_local files).
+# Videos larger than MEMORY_SPILL_BYTES, or that don't fit under the global
+# MEMORY_STAGING_CAP_BYTES shared by all workers, spill to the local folder.
+IN_MEMORY_STAGING = False
+MEMORY_SPILL_BYTES = 64 * 1024 * 1024
+MEMORY_STAGING_CAP_BYTES = 512 * 1024 * 1024
+
+# --- Output Profile ---
+# What FFmpeg writes when stripping metadata:
+#   "copy"      - stream copy, boxes left where Instagram put them
+#   "faststart" - stream copy with moov moved in front of mdat, so players
+#                 can start before the whole file has arrived
+#   "h264"      - re-encode to a capped H.264/AAC profile (always on disk,
+#                 faststart included). Much slower, but smaller files.
+OUTPUT_PROFILE = "copy"
+H264_PRESET = "veryfast"           # libx264 speed/size trade-off
+H264_CRF = 23
+H264_MAX_BITRATE = "3M"
+H264_BUFSIZE = "6M"
+H264_MAX_WIDTH = 720               # Downscale wider videos, keep aspect ratio
+H264_THREADS = 0                   # 0 = let FFmpeg pick
+H264_AUDIO_BITRATE = "128k"
+TRANSCODE_TIMEOUT_SECONDS = 600
+
+# --- Media Transport ---
+# Pooled HTTP session for CDN video downloads, separate from the Instagram API
+# sessions. Keep MEDIA_POOL_SIZE >= THREADS so concurrent downloads reuse
+# warm connections instead of opening new ones.
+MEDIA_POOL_HOSTS = 10              # CDN hosts with a connection pool kept open
+MEDIA_POOL_SIZE = 16               # Keep-alive connections per host
+MEDIA_CONNECT_TIMEOUT = 10         # Seconds
+MEDIA_READ_TIMEOUT = 60            # Seconds without receiving any data
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+MEDIA_WRITE_BUFFER_BYTES = 4 * 1024 * 1024
+
+# --- Bandwidth Limits ---
+# Token-bucket caps in bytes/second (None = unlimited), enforced as bytes
+# stream. A niche may add "download_bytes_per_second" / "upload_bytes_per_second"
+# limits of its own; both the global and the niche limit apply.
+DOWNLOAD_BYTES_PER_SECOND = None
+UPLOAD_BYTES_PER_SECOND = None
+BANDWIDTH_BURST_SECONDS = 1.0  # Bucket size, in seconds of traffic at the limit
+
+# --- Staging Disk Budget ---
+# Bytes the *_local folders may hold across all workers; downloads block
+# while the budget is used up. Reservations are STAGING_COPY_FACTOR x the
+# video size because FFmpeg writes a cleaned copy next to the original.
+STAGING_BUDGET_BYTES = 2 * 1024 * 1024 * 1024
+STAGING_COPY_FACTOR = 2
+MIN_FREE_DISK_BYTES = 1024 * 1024 * 1024  # Always leave this much disk free
+STAGING_WAIT_TIMEOUT = 600  # Give up on a download after waiting this long for space (seconds)
+STAGING_ORPHAN_AGE_SECONDS = 3600  # Staging files older than this are left over from a crash
+# Size estimate used before the real size is known (duration x bytes/sec)
+ESTIMATED_BYTES_PER_SECOND = 300 * 1024
+DEFAULT_VIDEO_ESTIMATE_BYTES = 10 * 1024 * 1024
+
+# --- Persistent State ---
+# SQLite file shared by every worker/process on this machine (or on shared storage)
+STATE_DB = "pipeline_state.db"
+# Video numbers are reserved from the state DB in blocks so workers don't
+# hit the database for every video (unused numbers in a block are skipped)
+VIDEO_NUMBER_BLOCK = 10
+
+# --- Work Queue (multi-node) ---
+# Shared queue of shortcodes for --crawl / --worker. For several machines, put
+# WORK_QUEUE_DB, STATE_DB and the niche files on storage every node mounts
+WORK_QUEUE_BACKEND = "sqlite"        # Key into WORK_QUEUE_BACKENDS
+WORK_QUEUE_DB = "work_queue.db"
+WORK_QUEUE_LEASE_SECONDS = 600       # A claimed item is re-queued if its lease isn't renewed in time
+WORK_QUEUE_HEARTBEAT_SECONDS = 60    # How often a busy worker renews its lease
+WORK_QUEUE_MAX_ATTEMPTS = 3          # Leases handed out before an item is given up as failed
+WORK_QUEUE_POLL_SECONDS = 15         # Idle workers poll the queue this often...
+WORK_QUEUE_IDLE_EXIT_SECONDS = 300   # ...and exit after this long without work (0 = run forever)
+
+# Serializes appends to the per-niche CSV/processed/failed files across worker
+# threads (locked_append adds an flock for worker processes)
+FILE_LOCK = threading.Lock()
+
+# --- Metrics ---
+# Prometheus textfile (for node_exporter's textfile collector) + JSON summary per run
+METRICS_DIR = "metrics"
+METRICS_PROM_FILE = "instatodrive.prom"
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)  # Histogram buckets (seconds)
+RUN_ID = datetime.now().strftime("%Y%m%d_%H%M%S")
+PLAN_HISTORY_RUNS = 20  # Recent run summaries --plan takes throughput from
+
+# List each niche's R2 prefix at startup and skip posts that were already
+# uploaded (recovers from a crash between upload and the processed-file append)
+R2_INDEX_ON_STARTUP = True
 
 # File initialization moved to process_niche() function
 
+# STATE_DB paths whose schema this process has already created or migrated
+_state_db_ready = set()
+_state_db_lock = threading.Lock()
+
+def get_state_db():
+    """Open a connection to the state DB, creating tables on first use"""
+    conn = sqlite3.connect(STATE_DB, timeout=30)
+    path = os.path.abspath(STATE_DB)
+    with _state_db_lock:
+        if path not in _state_db_ready:
+            create_state_tables(conn)
+            _state_db_ready.add(path)
+    return conn
+
+def create_state_tables(conn):
+    """Create the state DB tables and indexes, and migrate older state DBs"""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS video_numbers ("
+        "prefix TEXT PRIMARY KEY, next_number INTEGER NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS profile_polls ("
+        "niche TEXT NOT NULL, username TEXT NOT NULL, next_poll REAL NOT NULL, "
+        "interval REAL NOT NULL, avg_gap REAL, last_post_at REAL, failures INTEGER NOT NULL DEFAULT 0, "
+        "PRIMARY KEY (niche, username))"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS uploads ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, prefix TEXT NOT NULL, shortcode TEXT NOT NULL, "
+        "username TEXT NOT NULL, video_number INTEGER, r2_key TEXT NOT NULL, size INTEGER NOT NULL, "
+        "sha256 TEXT, uploaded_at REAL NOT NULL, caption TEXT, UNIQUE (prefix, shortcode))"
+    )
+    if "caption" not in {row[1] for row in conn.execute("PRAGMA table_info(uploads)")}:
+        try:
+            conn.execute("ALTER TABLE uploads ADD COLUMN caption TEXT")  # State DBs from before --export
+        except sqlite3.OperationalError:
+            pass  # Another process added it first
+    conn.execute("CREATE INDEX IF NOT EXISTS uploads_by_shortcode ON uploads (shortcode)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS export_cursors ("
+        "niche TEXT PRIMARY KEY, last_id INTEGER NOT NULL, next_shard INTEGER NOT NULL)"
+    )
+    conn.commit()
+
+# --- Video Numbering ---
+# prefix -> [next_number, block_end) reserved by this process
+_number_blocks = {}
+_number_lock = threading.Lock()
+
+def reserve_video_numbers(prefix, count, floor=0):
+    """Atomically reserve `count` numbers for an R2 prefix; returns (start, end).
+
+    BEGIN IMMEDIATE takes the SQLite write lock, so concurrent processes
+    always get disjoint ranges. `floor` is the highest number already in use.
+    """
+    conn = get_state_db()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT next_number FROM video_numbers WHERE prefix = ?", (prefix,)
+        ).fetchone()
+        start = max(row[0] if row else 1, floor + 1)
+        conn.execute(
+            "INSERT OR REPLACE INTO video_numbers (prefix, next_number) VALUES (?, ?)",
+            (prefix, start + count)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return start, start + count
+
+def seed_video_numbers(prefix, floor):
+    """Make sure numbering for a prefix continues after `floor` (existing uploads)"""
+    if floor > 0:
+        reserve_video_numbers(prefix, 0, floor)
+        with _number_lock:
+            block = _number_blocks.get(prefix)
+            if block is not None and block[0] <= floor:
+                del _number_blocks[prefix]  # Reserved before those uploads were seen
+
+def get_next_video_number(prefix):
+    """Return a video number that is unique within the R2 prefix across runs and workers"""
+    with _number_lock:
+        block = _number_blocks.get(prefix)
+        if block is None or block[0] >= block[1]:
+            block = list(reserve_video_numbers(prefix, VIDEO_NUMBER_BLOCK))
+            _number_blocks[prefix] = block
+        number = block[0]
+        block[0] += 1
+        return number
+
+def highest_csv_video_number(output_csv):
+    """Return the highest "No." already written to a niche CSV (0 if none)"""
+    if not os.path.exists(output_csv):
+        return 0
+    highest = 0
+    with open(output_csv, "r", newline="", encoding="utf-8") as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader, None)  # Skip header
+        for row in reader:
+            if row and row[0].isdigit():
+                highest = max(highest, int(row[0]))
+    return highest
+
+class RunMetrics:
+    """Thread-safe stage timings, byte counters, error counters and queue gauges"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}    # (folder, stage) -> {"count", "seconds", "max", "bytes", "buckets"}
+        self.counters = {}  # (name, folder, stage, error) -> count
+        self.gauges = {}    # (queue, folder) -> depth
+
+    @contextmanager
+    def time_stage(self, stage, folder):
+        """Time a stage; the caller may set info["bytes"] to count throughput
+        and info["media_seconds"] to the video duration it covered"""
+        info = {"bytes": 0, "media_seconds": 0.0}
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield info
+        finally:
+            self.observe(stage, folder, time.perf_counter() - start, info["bytes"],
+                         time.thread_time() - cpu_start, info["media_seconds"])
+
+    def observe(self, stage, folder, seconds, nbytes=0, cpu_seconds=0.0, media_seconds=0.0):
+        with self.lock:
+            entry = self.stages.setdefault((folder, stage), {
+                "count": 0, "seconds": 0.0, "cpu_seconds": 0.0, "max": 0.0, "bytes": 0, "media_seconds": 0.0,
+                "buckets": [0] * len(STAGE_BUCKETS),
+            })
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            entry["cpu_seconds"] += cpu_seconds
+            entry["max"] = max(entry["max"], seconds)
+            entry["bytes"] += nbytes
+            entry["media_seconds"] += media_seconds
+            for i, bound in enumerate(STAGE_BUCKETS):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+
+    def count_error(self, name, folder, stage, error):
+        """Increment a retry/failure counter labelled by stage and error class"""
+        key = (name, folder, stage, type(error).__name__)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def set_gauge(self, queue, folder, value):
+        with self.lock:
+            self.gauges[(queue, folder)] = value
+
+    def add_gauge(self, queue, folder, delta):
+        with self.lock:
+            self.gauges[(queue, folder)] = self.gauges.get((queue, folder), 0) + delta
+
+    def prometheus_text(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        with self.lock:
+            lines = [
+                "# HELP instatodrive_stage_seconds Time spent in each pipeline stage",
+                "# TYPE instatodrive_stage_seconds histogram",
+            ]
+            for (folder, stage), entry in sorted(self.stages.items()):
+                labels = f'folder="{folder}",stage="{stage}"'
+                for bound, count in zip(STAGE_BUCKETS, entry["buckets"]):
+                    lines.append(f'instatodrive_stage_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'instatodrive_stage_seconds_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+                lines.append(f'instatodrive_stage_seconds_sum{{{labels}}} {entry["seconds"]:.6f}')
+                lines.append(f'instatodrive_stage_seconds_count{{{labels}}} {entry["count"]}')
+            lines += [
+                "# HELP instatodrive_stage_bytes_total Bytes moved by each pipeline stage",
+                "# TYPE instatodrive_stage_bytes_total counter",
+            ]
+            for (folder, stage), entry in sorted(self.stages.items()):
+                lines.append(f'instatodrive_stage_bytes_total{{folder="{folder}",stage="{stage}"}} {entry["bytes"]}')
+            for name in ("retries", "failures"):
+                lines += [
+                    f"# HELP instatodrive_{name}_total {name.capitalize()} by stage and error class",
+                    f"# TYPE instatodrive_{name}_total counter",
+                ]
+                for (counter, folder, stage, error), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(f'instatodrive_{name}_total{{folder="{folder}",stage="{stage}",error="{error}"}} {value}')
+            lines += [
+                "# HELP instatodrive_queue_depth Items waiting or in flight",
+                "# TYPE instatodrive_queue_depth gauge",
+            ]
+            for (queue, folder), value in sorted(self.gauges.items()):
+                lines.append(f'instatodrive_queue_depth{{folder="{folder}",queue="{queue}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Return a JSON-serializable summary of this run"""
+        with self.lock:
+            stages = {}
+            for (folder, stage), entry in self.stages.items():
+                stages.setdefault(folder, {})[stage] = {
+                    "count": entry["count"],
+                    "seconds": round(entry["seconds"], 3),
+                    # Wall time not spent on this thread's CPU: network and subprocess (ffmpeg) waits
+                    "cpu_seconds": round(entry["cpu_seconds"], 3),
+                    "wait_seconds": round(max(entry["seconds"] - entry["cpu_seconds"], 0.0), 3),
+                    "avg_seconds": round(entry["seconds"] / entry["count"], 3),
+                    "max_seconds": round(entry["max"], 3),
+                    "bytes": entry["bytes"],
+                    "bytes_per_second": round(entry["bytes"] / entry["seconds"]) if entry["seconds"] else 0,
+                    "media_seconds": round(entry["media_seconds"], 1),
+                }
+            errors = {}
+            for (name, folder, stage, error), value in self.counters.items():
+                errors.setdefault(name, {}).setdefault(folder, {})[f"{stage}:{error}"] = value
+            queues = {}
+            for (queue, folder), value in self.gauges.items():
+                queues.setdefault(folder, {})[queue] = value
+        return {
+            "run_id": RUN_ID,
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+            "stages": stages,
+            "retries": errors.get("retries", {}),
+            "failures": errors.get("failures", {}),
+            "queue_depth": queues,
+        }
+
+METRICS = RunMetrics()
+
+def write_atomic(path, content):
+    """Write a text file via a temp file + rename so readers never see a partial file"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def export_metrics():
+    """Write the Prometheus textfile and this run's JSON summary"""
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        write_atomic(os.path.join(METRICS_DIR, METRICS_PROM_FILE), METRICS.prometheus_text())
+        summary = METRICS.summary()
+        summary["media_transport"] = MEDIA_TRANSPORT.snapshot()
+        write_atomic(os.path.join(METRICS_DIR, f"run_{RUN_ID}.json"), json.dumps(summary, indent=2))
+    except OSError as e:
+        print(f"WARNING: Could not write metrics: {e}")
+
 # --- Text Normalization ---
 def normalize_text(text):
     """Clean up text: remove/replace weird characters, normalize Unicode, handle emojis"""
@@ -197,11 +793,35 @@ def find_video_file(target_folder, shortcode):
     return None
 
 # --- Metadata Stripping ---
+def ffmpeg_output_args(profile=None):
+    """FFmpeg codec/muxer arguments for an OUTPUT_PROFILE"""
+    profile = profile or OUTPUT_PROFILE
+    if profile == "copy":
+        return ['-c', 'copy']
+    if profile == "faststart":
+        return ['-c', 'copy', '-movflags', '+faststart']
+    if profile == "h264":
+        return [
+            '-c:v', 'libx264',
+            '-preset', H264_PRESET,
+            '-crf', str(H264_CRF),
+            '-maxrate', H264_MAX_BITRATE,
+            '-bufsize', H264_BUFSIZE,
+            '-vf', f"scale='min({H264_MAX_WIDTH},iw)':-2",
+            '-pix_fmt', 'yuv420p',
+            '-threads', str(H264_THREADS),
+            '-c:a', 'aac',
+            '-b:a', H264_AUDIO_BITRATE,
+            '-movflags', '+faststart',
+        ]
+    raise ValueError(f"Unknown OUTPUT_PROFILE: {profile!r}")
+
 def strip_metadata(input_file):
     """Remove all metadata from video file using FFmpeg to avoid fingerprinting.
     
     Uses -map_metadata -1 to strip ALL metadata (timestamps, software info, etc.)
-    Uses -c copy to avoid re-encoding (fast, lossless quality)
+    The rest of the output depends on OUTPUT_PROFILE: stream copy (fast,
+    lossless), optionally with faststart, or a capped H.264 re-encode.
     """
     # Check if FFmpeg is available
     if not shutil.which('ffmpeg'):
@@ -216,23 +836,23 @@ def strip_metadata(input_file):
     try:
         # FFmpeg command to strip all metadata
         # -map_metadata -1: Remove all metadata
-        # -c copy: Stream copy (no re-encoding, fast)
+        # output args: stream copy / faststart / re-encode (OUTPUT_PROFILE)
         # -y: Overwrite output file if exists
         cmd = [
             'ffmpeg',
             '-i', input_file,
             '-map_metadata', '-1',  # Strip ALL metadata
-            '-c', 'copy',           # No re-encoding (fast, lossless)
+            *ffmpeg_output_args(),
             '-y',                   # Overwrite if exists
             output_file
         ]
         
-        # Run FFmpeg silently
+        # Run FFmpeg silently (re-encoding needs far longer than a copy)
         result = subprocess.run(
             cmd,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
-            timeout=60  # 60 second timeout
+            timeout=TRANSCODE_TIMEOUT_SECONDS if OUTPUT_PROFILE == "h264" else 60
         )
         
         if result.returncode == 0 and os.path.exists(output_file):
@@ -258,200 +878,1530 @@ def strip_metadata(input_file):
             os.remove(output_file)
         return input_file
 
+# --- MP4 Box Helpers ---
+# Boxes whose payload is just child boxes
+MP4_CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts", b"dinf", b"mvex"}
+# Boxes holding tags (encoder, creation software, location, ...)
+MP4_METADATA_BOXES = {b"udta", b"meta"}
+# Header boxes with creation/modification timestamps
+MP4_TIMESTAMP_BOXES = {b"mvhd", b"tkhd", b"mdhd"}
+
+def iter_mp4_boxes(data, start=0, end=None):
+    """Yield (box_type, box_start, header_size, box_end) for boxes in data[start:end]"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, pos)
+        header_size = 8
+        if size == 1:
+            if pos + 16 > end:
+                raise ValueError("truncated box header")
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos  # Box runs to the end of the file
+        if size < header_size or pos + size > end:
+            raise ValueError(f"bad size for {box_type!r} box at offset {pos}")
+        yield box_type, pos, header_size, pos + size
+        pos += size
+
+def rebuild_mp4_box(data, box_type, start, header_size, end, chunk_tables):
+    """Copy a box without metadata children and with zeroed timestamps.
+
+    chunk_tables collects (offset_in_output, entry_count, is_64bit) for every
+    stco/co64 table, relative to the start of the returned bytes.
+    """
+    if box_type in MP4_CONTAINER_BOXES:
+        body = bytearray()
+        for child_type, child_start, child_header, child_end in iter_mp4_boxes(data, start + header_size, end):
+            if child_type in MP4_METADATA_BOXES:
+                continue
+            child_tables = []
+            child = rebuild_mp4_box(data, child_type, child_start, child_header, child_end, child_tables)
+            chunk_tables.extend((8 + len(body) + offset, count, is_64) for offset, count, is_64 in child_tables)
+            body += child
+        return struct.pack(">I4s", 8 + len(body), box_type) + body
+    
+    box = bytearray(data[start:end])
+    if header_size == 16:
+        # Normalize 64-bit size headers on small boxes to the 32-bit form
+        box = bytearray(struct.pack(">I4s", len(box) - 8, box_type)) + box[16:]
+    if box_type in MP4_TIMESTAMP_BOXES:
+        # version 1 uses 64-bit creation/modification times, version 0 32-bit
+        width = 16 if box[8] == 1 else 8
+        box[12:12 + width] = bytes(width)
+    elif box_type in (b"stco", b"co64"):
+        count = struct.unpack_from(">I", box, 12)[0]
+        chunk_tables.append((16, count, box_type == b"co64"))
+    return bytes(box)
+
+def strip_metadata_in_memory(data, faststart=False, digest=None):
+    """Remove metadata from an MP4 held in memory; returns new bytes or None.
+
+    Drops udta/meta boxes, zeroes creation/modification times and fixes the
+    chunk offset tables for wherever mdat ends up. With faststart, moov is
+    moved in front of the first mdat. A hashlib object passed as digest is
+    fed the output as it is assembled. Returns None for files this can't
+    handle (fragmented MP4, malformed boxes) so the caller can fall back to
+    FFmpeg on disk.
+    """
+    try:
+        top_level = list(iter_mp4_boxes(data))
+    except ValueError:
+        return None
+    if not any(box_type == b"moov" for box_type, _, _, _ in top_level) or \
+       any(box_type == b"moof" for box_type, _, _, _ in top_level):
+        return None
+    
+    if faststart:
+        # Same as -movflags +faststart: the offset fix-up below handles the move
+        types = [box_type for box_type, _, _, _ in top_level]
+        moov_index = types.index(b"moov")
+        if b"mdat" in types[:moov_index]:
+            moov = top_level.pop(moov_index)
+            top_level.insert(types.index(b"mdat"), moov)
+    
+    # Rebuild every top-level box and remember where each one lands
+    pieces = []
+    layout = []  # (old_start, old_end, new_start)
+    new_pos = 0
+    for box_type, start, header_size, end in top_level:
+        if box_type in MP4_METADATA_BOXES:
+            continue
+        tables = []
+        piece = rebuild_mp4_box(data, box_type, start, header_size, end, tables) if box_type == b"moov" \
+            else data[start:end]
+        pieces.append((piece, new_pos, tables))
+        layout.append((start, end, new_pos))
+        new_pos += len(piece)
+    
+    # Chunk offsets point into mdat: move each one by however far its box moved
+    for index, (piece, piece_start, tables) in enumerate(pieces):
+        if not tables:
+            continue
+        piece = bytearray(piece)
+        for offset, count, is_64 in tables:
+            fmt, width = (">Q", 8) if is_64 else (">I", 4)
+            for i in range(count):
+                entry_pos = offset + i * width
+                old_offset = struct.unpack_from(fmt, piece, entry_pos)[0]
+                for old_start, old_end, new_start in layout:
+                    if old_start <= old_offset < old_end:
+                        new_offset = old_offset - old_start + new_start
+                        break
+                else:
+                    return None
+                if not is_64 and new_offset > 0xFFFFFFFF:
+                    return None
+                struct.pack_into(fmt, piece, entry_pos, new_offset)
+        pieces[index] = (bytes(piece), piece_start, tables)
+    
+    if digest is not None:
+        for piece, _, _ in pieces:
+            digest.update(piece)
+    return b"".join(piece for piece, _, _ in pieces)
+
+# --- Video Validation ---
+# Top-level boxes a real MP4 can start with; anything else (an HTML error
+# page, an empty body) was not a video download at all
+MP4_LEADING_BOXES = {b"ftyp", b"styp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pdin"}
+
+class InvalidVideoError(Exception):
+    """A downloaded video failed validation.
+
+    retryable is True when downloading again may fix it (truncated or not a
+    video at all) and False when the file itself is broken at the source.
+    """
+
+    def __init__(self, reason, retryable):
+        super().__init__(f"invalid video: {reason}")
+        self.reason = reason
+        self.retryable = retryable
+
+def read_top_level_boxes(f, file_size):
+    """List (box_type, start, header_size, end) for the top-level boxes, reading only their headers"""
+    boxes = []
+    pos = 0
+    while pos < file_size:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            raise InvalidVideoError("truncated box header", retryable=True)
+        size, box_type = struct.unpack_from(">I4s", header)
+        if pos == 0 and box_type not in MP4_LEADING_BOXES:
+            raise InvalidVideoError(f"not an MP4 (starts with {header[:8]!r})", retryable=True)
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                raise InvalidVideoError("truncated box header", retryable=True)
+            size = struct.unpack_from(">Q", header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - pos  # Box runs to the end of the file
+        if size < header_size:
+            raise InvalidVideoError(f"bad size for {box_type!r} box at offset {pos}", retryable=False)
+        if pos + size > file_size:
+            raise InvalidVideoError(f"{box_type!r} box runs past the end of the file", retryable=True)
+        boxes.append((box_type, pos, header_size, pos + size))
+        pos += size
+    return boxes
+
+def find_mp4_child(data, start, end, box_type):
+    """Return (start, header_size, end) of the first child box of a type, or None"""
+    for child_type, child_start, child_header, child_end in iter_mp4_boxes(data, start, end):
+        if child_type == box_type:
+            return child_start, child_header, child_end
+    return None
+
+def validate_mp4(local_file=None, data=None):
+    """Check an MP4's structure without reading its media data; returns the duration in seconds.
+
+    Walks the top-level box headers, then parses moov only: it must hold a
+    duration, a video track and chunk offsets inside the file. Raises
+    InvalidVideoError otherwise.
+    """
+    f = io.BytesIO(data) if data is not None else open(local_file, "rb")
+    try:
+        file_size = len(data) if data is not None else os.fstat(f.fileno()).st_size
+        if file_size == 0:
+            raise InvalidVideoError("empty file", retryable=True)
+        boxes = read_top_level_boxes(f, file_size)
+        types = {box_type for box_type, _, _, _ in boxes}
+        fragmented = b"moof" in types
+        if b"moov" not in types:
+            raise InvalidVideoError("no moov box", retryable=False)
+        if b"mdat" not in types:
+            raise InvalidVideoError("no mdat box", retryable=False)
+        _, start, header_size, end = next(box for box in boxes if box[0] == b"moov")
+        f.seek(start)
+        moov = f.read(end - start)
+    finally:
+        f.close()
+    
+    try:
+        mvhd = find_mp4_child(moov, header_size, len(moov), b"mvhd")
+        if mvhd is None:
+            raise InvalidVideoError("no mvhd box", retryable=False)
+        body = mvhd[0] + mvhd[1]
+        if moov[body] == 1:
+            timescale, duration = struct.unpack_from(">IQ", moov, body + 20)
+        else:
+            timescale, duration = struct.unpack_from(">II", moov, body + 12)
+        if not timescale or (not duration and not fragmented):
+            raise InvalidVideoError("zero duration", retryable=False)
+        
+        has_video = False
+        for box_type, trak_start, trak_header, trak_end in iter_mp4_boxes(moov, header_size, len(moov)):
+            if box_type != b"trak":
+                continue
+            mdia = find_mp4_child(moov, trak_start + trak_header, trak_end, b"mdia")
+            hdlr = mdia and find_mp4_child(moov, mdia[0] + mdia[1], mdia[2], b"hdlr")
+            if hdlr and moov[hdlr[0] + hdlr[1] + 8:hdlr[0] + hdlr[1] + 12] == b"vide":
+                has_video = True
+            minf = mdia and find_mp4_child(moov, mdia[0] + mdia[1], mdia[2], b"minf")
+            stbl = minf and find_mp4_child(moov, minf[0] + minf[1], minf[2], b"stbl")
+            if not stbl:
+                continue
+            for table_type, fmt in ((b"stco", "I"), (b"co64", "Q")):
+                table = find_mp4_child(moov, stbl[0] + stbl[1], stbl[2], table_type)
+                if not table:
+                    continue
+                count = struct.unpack_from(">I", moov, table[0] + table[1] + 4)[0]
+                offsets = struct.unpack_from(f">{count}{fmt}", moov, table[0] + table[1] + 8)
+                if offsets and max(offsets) >= file_size:
+                    raise InvalidVideoError("chunk offsets point past the end of the file", retryable=True)
+    except (ValueError, struct.error, IndexError) as e:
+        raise InvalidVideoError(f"malformed moov ({e})", retryable=False)
+    
+    if not has_video:
+        raise InvalidVideoError("no video track", retryable=False)
+    return duration / timescale
+
+# --- Media Transport ---
+class MediaTransport:
+    """Shared keep-alive HTTP session for CDN media, with connection reuse stats"""
+
+    def __init__(self):
+        self.adapter = HTTPAdapter(pool_connections=MEDIA_POOL_HOSTS, pool_maxsize=MEDIA_POOL_SIZE,
+                                   pool_block=True)  # Wait for a pooled connection rather than open extras
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.headers["User-Agent"] = default_user_agent()
+        self.lock = threading.Lock()
+        self.connections = weakref.WeakSet()  # Connections that have served a download
+        self.stats = {"downloads": 0, "bytes": 0, "seconds": 0.0, "new_connections": 0}
+
+    def iter_media(self, url, pace=None):
+        """Yield a media file in DOWNLOAD_CHUNK_BYTES chunks and record its stats.
+
+        A download counts as reused when its urllib3 connection object already
+        served an earlier download.
+        """
+        start = time.perf_counter()
+        nbytes = 0
+        complete = False
+        response = self.session.get(url, stream=True, timeout=(MEDIA_CONNECT_TIMEOUT, MEDIA_READ_TIMEOUT))
+        connection = getattr(response.raw, "connection", None) or getattr(response.raw, "_connection", None)
+        with self.lock:
+            new_connection = connection is not None and connection not in self.connections
+            if new_connection:
+                self.connections.add(connection)
+        try:
+            response.raise_for_status()
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                nbytes += len(chunk)
+                if pace:
+                    pace(len(chunk))  # Holding off reading lets TCP flow control slow the sender
+                yield chunk
+            complete = True
+        finally:
+            response.close()  # Returns the connection to the pool once the body is read
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.stats["downloads"] += 1
+                self.stats["bytes"] += nbytes
+                self.stats["seconds"] += seconds
+                self.stats["new_connections"] += new_connection
+            if complete:
+                print(f"    ✓ Downloaded {nbytes / (1024 * 1024):.1f} MB in {seconds:.1f}s "
+                      f"({'new' if new_connection else 'reused'} connection)")
+
+    def download_media(self, url, path, pace=None):
+        """Download a media URL to a file through a large write buffer; returns bytes written"""
+        with open(path, "wb", buffering=MEDIA_WRITE_BUFFER_BYTES) as f:
+            for chunk in self.iter_media(url, pace):
+                f.write(chunk)
+        return os.path.getsize(path)
+
+    def snapshot(self):
+        """Return aggregate stats for the run summary"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats["reused_connections"] = max(stats["downloads"] - stats["new_connections"], 0)
+        stats["reuse_ratio"] = round(stats["reused_connections"] / stats["downloads"], 3) if stats["downloads"] else 0.0
+        stats["seconds"] = round(stats["seconds"], 3)
+        return stats
+
+MEDIA_TRANSPORT = MediaTransport()
+
+def download_video(post, target_folder, drive_folder):
+    """Download a post's video to <target_folder>/<shortcode>.mp4 over the media transport"""
+    MEDIA_TRANSPORT.download_media(post.video_url, os.path.join(target_folder, f"{post.shortcode}.mp4"),
+                                   bandwidth_pacer("download", drive_folder))
+
+# --- Bandwidth Limits ---
+_bandwidth_buckets = {}  # (direction, scope) -> TokenBucket
+_bandwidth_lock = threading.Lock()
+
+def bandwidth_pacer(direction, drive_folder):
+    """Return a callback that blocks until n bytes fit under the global and niche
+    limits for `direction` ("download" or "upload"), or None when unlimited"""
+    niche_limit = next((niche.get(f"{direction}_bytes_per_second") for niche in NICHES.values()
+                        if niche['drive_folder'] == drive_folder), None)
+    limits = [("global", DOWNLOAD_BYTES_PER_SECOND if direction == "download" else UPLOAD_BYTES_PER_SECOND),
+              (drive_folder, niche_limit)]
+    buckets = []
+    with _bandwidth_lock:
+        for scope, rate in limits:
+            if rate:
+                bucket = _bandwidth_buckets.get((direction, scope))
+                if bucket is None or bucket.rate != rate:
+                    bucket = _bandwidth_buckets[(direction, scope)] = TokenBucket(rate, rate * BANDWIDTH_BURST_SECONDS)
+                buckets.append(bucket)
+    if not buckets:
+        return None
+    
+    def pace(nbytes):
+        if nbytes > 0:  # boto3 reports negative progress when it rewinds a retried part
+            for bucket in buckets:
+                bucket.consume(nbytes)
+    return pace
+
+# --- In-Memory Staging ---
+class ByteBudget:
+    """Byte-counting semaphore shared by every worker"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def try_acquire(self, nbytes):
+        """Reserve nbytes if they fit right now; never blocks"""
+        with self.condition:
+            if self.used + nbytes > self.limit:
+                return False
+            self.used += nbytes
+            return True
+
+    def acquire(self, nbytes, timeout=None):
+        """Reserve nbytes, waiting for other workers to release; False on timeout.
+
+        A request bigger than the whole budget is let through once nothing
+        else is reserved, so it can't wait forever.
+        """
+        with self.condition:
+            fits = lambda: self.used + nbytes <= self.limit or self.used == 0
+            if not self.condition.wait_for(fits, timeout):
+                return False
+            self.used += nbytes
+            return True
+
+    def force_acquire(self, nbytes):
+        """Account for bytes that are already in use (never blocks)"""
+        with self.condition:
+            self.used += nbytes
+
+    def release(self, nbytes):
+        with self.condition:
+            self.used = max(self.used - nbytes, 0)
+            self.condition.notify_all()
+
+MEMORY_BUDGET = ByteBudget(MEMORY_STAGING_CAP_BYTES)
+STAGING_BUDGET = ByteBudget(STAGING_BUDGET_BYTES)
+
+def estimate_video_bytes(post):
+    """Rough size of a post's video from its duration (before downloading)"""
+    duration = getattr(post, "video_duration", None)
+    if duration:
+        return int(duration * ESTIMATED_BYTES_PER_SECOND)
+    return DEFAULT_VIDEO_ESTIMATE_BYTES
+
+def post_filter_reason(post, filters, now=None):
+    """Return why a niche's "filters" reject a post, or None if it passes"""
+    duration = post.video_duration
+    if duration is not None:
+        if duration < filters.get("min_duration", 0):
+            return "too short"
+        if duration > filters.get("max_duration", float("inf")):
+            return "too long"
+    if "max_age_days" in filters:
+        age = (now or time.time()) - post.date_utc.replace(tzinfo=timezone.utc).timestamp()
+        if age > filters["max_age_days"] * 86400:
+            return "too old"
+    if post.video_view_count is not None and post.video_view_count < filters.get("min_views", 0):
+        return "too few views"
+    if post.likes is not None and post.likes < filters.get("min_likes", 0):
+        return "too few likes"
+    if estimate_video_bytes(post) > filters.get("max_estimated_bytes", float("inf")):
+        return "too large"
+    return None
+
+class StagingReservation:
+    """One worker's share of STAGING_BUDGET for the file it is staging"""
+
+    def __init__(self, target_folder):
+        self.target_folder = target_folder
+        self.held = 0
+
+    def reserve(self, nbytes, wait=True):
+        """Grow or shrink the reservation to nbytes.
+
+        With wait=True (before a download) this blocks until the staging
+        budget and the free disk space allow it; wait=False just accounts
+        for bytes that are already on disk.
+        """
+        extra = nbytes - self.held
+        if extra <= 0:
+            STAGING_BUDGET.release(-extra)
+        elif not wait:
+            STAGING_BUDGET.force_acquire(extra)
+        else:
+            deadline = time.monotonic() + STAGING_WAIT_TIMEOUT
+            if not STAGING_BUDGET.acquire(extra, timeout=STAGING_WAIT_TIMEOUT):
+                raise OSError(f"Staging budget full for {STAGING_WAIT_TIMEOUT}s")
+            while shutil.disk_usage(self.target_folder).free - extra < MIN_FREE_DISK_BYTES:
+                if time.monotonic() >= deadline:
+                    STAGING_BUDGET.release(extra)
+                    raise OSError(f"Not enough free disk space in {self.target_folder}")
+                time.sleep(5)
+        self.held = nbytes
+
+    def release(self):
+        STAGING_BUDGET.release(self.held)
+        self.held = 0
+
+def remove_staging_files(target_folder, shortcode):
+    """Delete everything staged for a post (video, cleaned copy, thumbnail)"""
+    paths = glob.glob(os.path.join(target_folder, glob.escape(shortcode) + ".*"))
+    paths.append(os.path.join(target_folder, f"{shortcode}_clean.mp4"))
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def sweep_staging_folder(target_folder):
+    """Reclaim files a crashed run left in a staging folder; returns bytes freed.
+
+    Only files older than STAGING_ORPHAN_AGE_SECONDS are removed, so another
+    process staging into the same folder right now is left alone.
+    """
+    if not os.path.isdir(target_folder):
+        return 0
+    freed = 0
+    cutoff = time.time() - STAGING_ORPHAN_AGE_SECONDS
+    for entry in os.scandir(target_folder):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                freed += size
+        except OSError:
+            pass
+    return freed
+
+class StagedVideo:
+    """Download destination that stays in RAM and spills to disk when it must"""
+
+    def __init__(self, spill_path):
+        self.spill_path = spill_path
+        self.buffer = bytearray()
+        self.file = None
+        self.size = 0
+        self.reserved = 0  # Bytes held against MEMORY_BUDGET
+
+    @property
+    def in_memory(self):
+        return self.file is None
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.file is None:
+            if len(self.buffer) + len(chunk) <= MEMORY_SPILL_BYTES and MEMORY_BUDGET.try_acquire(len(chunk)):
+                self.reserved += len(chunk)
+                self.buffer += chunk
+                return
+            self.spill()
+        self.file.write(chunk)
+
+    def spill(self):
+        """Move what we have so far to the local staging file"""
+        os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+        self.file = open(self.spill_path, "wb")
+        self.file.write(self.buffer)
+        self.buffer = bytearray()
+        self.release_memory()
+
+    def replace(self, data):
+        """Swap in new content no larger than the old (e.g. the metadata-stripped copy)"""
+        self.buffer = data
+        freed = self.reserved - len(data)
+        if freed > 0:
+            MEMORY_BUDGET.release(freed)
+            self.reserved = len(data)
+
+    def finish(self):
+        if self.file is not None:
+            self.file.close()
+
+    def release_memory(self):
+        MEMORY_BUDGET.release(self.reserved)
+        self.reserved = 0
+
+def download_to_staging(post, target_folder, drive_folder):
+    """Stream a post's video into a StagedVideo (RAM unless it has to spill)"""
+    staged = StagedVideo(os.path.join(target_folder, post.shortcode + ".mp4"))
+    try:
+        for chunk in MEDIA_TRANSPORT.iter_media(post.video_url, bandwidth_pacer("download", drive_folder)):
+            staged.write(chunk)
+    except Exception:
+        staged.finish()
+        staged.release_memory()
+        if not staged.in_memory and os.path.exists(staged.spill_path):
+            os.remove(staged.spill_path)
+        raise
+    staged.finish()
+    return staged
+
+# --- R2 Client & Existence Index ---
+_r2_client = None
+
+def get_r2_client():
+    """Return a shared S3 client for R2 (created once, reused for every call)"""
+    global _r2_client
+    if _r2_client is None:
+        _r2_client = boto3.client(
+            's3',
+            endpoint_url=f'https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com',
+            aws_access_key_id=R2_ACCESS_KEY,
+            aws_secret_access_key=R2_SECRET_KEY,
+            region_name='auto'
+        )
+    return _r2_client
+
+# Matches our key layouts: 001_username_shortcode.mp4 and 0123456789abcdef_username_shortcode.mp4
+R2_FILENAME_PATTERN = re.compile(r'^(\d+)_(.+)\.mp4$')
+R2_CONTENT_FILENAME_PATTERN = re.compile(r'^([0-9a-f]{16})_(.+)\.mp4$')
+R2_CONTENT_DIGEST_CHARS = 16
+
+def parse_r2_filename(filename):
+    """Return (video_number, "username_shortcode") for one of our object names.
+
+    video_number is None for content keys. Returns None for anything else.
+    """
+    # Checked first: an all-digit digest would also look like a video number
+    match = R2_CONTENT_FILENAME_PATTERN.match(filename)
+    if match:
+        return None, match.group(2)
+    match = R2_FILENAME_PATTERN.match(filename)
+    if match:
+        return int(match.group(1)), match.group(2)
+    return None
+
+def build_r2_key(niche_folder_name, video_number, username, shortcode, digest=None):
+    """Object key for an upload under R2_KEY_SCHEME (digest: hex SHA-256 of the body)"""
+    if R2_KEY_SCHEME == "numbered":
+        return f"{niche_folder_name}/{video_number:03d}_{username}_{shortcode}.mp4"
+    if R2_KEY_SCHEME == "content":
+        return f"{niche_folder_name}/{digest[:R2_CONTENT_DIGEST_CHARS]}_{username}_{shortcode}.mp4"
+    raise ValueError(f"Unknown R2_KEY_SCHEME: {R2_KEY_SCHEME!r}")
+
+def upload_extra_args(r2_filename):
+    """ExtraArgs for upload_file/upload_fileobj: content type plus caching headers"""
+    extra_args = {'ContentType': 'video/mp4'}  # Critical for Pinterest
+    cache_control = R2_IMMUTABLE_CACHE_CONTROL if R2_KEY_SCHEME == "content" else R2_CACHE_CONTROL
+    if cache_control:
+        extra_args['CacheControl'] = cache_control
+    if R2_CONTENT_DISPOSITION:
+        extra_args['ContentDisposition'] = f'{R2_CONTENT_DISPOSITION}; filename="{r2_filename}"'
+    if R2_CHECKSUM_ALGORITHM:
+        extra_args['ChecksumAlgorithm'] = R2_CHECKSUM_ALGORITHM
+    return extra_args
+
+class HashingReader:
+    """Read-only file wrapper that hashes the body as boto3 reads it.
+
+    s3transfer rewinds the body to retry a request: bytes that were already
+    hashed are skipped on the way back. hexdigest() returns None if the
+    reads ever jumped past unhashed bytes or stopped short of `size`.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.hashed = 0
+        self.gap = False
+
+    def read(self, size=-1):
+        position = self.fileobj.tell()
+        data = self.fileobj.read(size)
+        if position > self.hashed:
+            self.gap = True
+        elif position + len(data) > self.hashed:
+            self.sha256.update(memoryview(data)[self.hashed - position:])
+            self.hashed = position + len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.fileobj.seek(offset, whence)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self.fileobj.close()
+
+    def hexdigest(self, size):
+        if self.gap or self.hashed != size:
+            return None
+        return self.sha256.hexdigest()
+
+def record_upload(prefix, shortcode, username, video_number, r2_key, size, sha256):
+    """Remember an uploaded object and its SHA-256 in the state DB (for audits and exports)"""
+    conn = get_state_db()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO uploads "
+            "(prefix, shortcode, username, video_number, r2_key, size, sha256, uploaded_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (prefix, shortcode, username, video_number, r2_key, size, sha256, time.time())
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def record_caption(prefix, shortcode, caption):
+    """Mark a recorded upload as complete (its CSV row is written) and keep the caption for --export"""
+    conn = get_state_db()
+    try:
+        conn.execute("UPDATE uploads SET caption = ? WHERE prefix = ? AND shortcode = ?", (caption, prefix, shortcode))
+        conn.commit()
+    finally:
+        conn.close()
+
+def upload_recorded(prefix, shortcode):
+    """True if the uploads table has a row for this post under this prefix"""
+    conn = get_state_db()
+    try:
+        return conn.execute(
+            "SELECT 1 FROM uploads WHERE prefix = ? AND shortcode = ?", (prefix, shortcode)
+        ).fetchone() is not None
+    finally:
+        conn.close()
+
+def find_existing_upload(shortcode, prefix):
+    """(r2_key, size, sha256) of a completed upload of this post under another prefix, or None"""
+    conn = get_state_db()
+    try:
+        return conn.execute(
+            "SELECT r2_key, size, sha256 FROM uploads WHERE shortcode = ? AND prefix != ? "
+            "AND sha256 IS NOT NULL AND caption IS NOT NULL ORDER BY id DESC LIMIT 1",
+            (shortcode, prefix)
+        ).fetchone()
+    finally:
+        conn.close()
+
+def reuse_upload(existing, niche_folder_name, video_number, username, shortcode):
+    """Serve a post uploaded for another niche from this one, without downloading it.
+
+    Returns (direct_link, r2_filename) like upload_to_r2.
+    """
+    source_key, size, sha256 = existing
+    if CROSS_NICHE_REUSE == "link":
+        r2_key = source_key
+    else:
+        r2_key = build_r2_key(niche_folder_name, video_number, username, shortcode, sha256)
+        extra_args = upload_extra_args(os.path.basename(r2_key))
+        extra_args.pop('ChecksumAlgorithm', None)  # R2 copies the bytes as they are
+        get_r2_client().copy_object(
+            CopySource={'Bucket': R2_BUCKET_NAME, 'Key': source_key},
+            Bucket=R2_BUCKET_NAME,
+            Key=r2_key,
+            MetadataDirective='REPLACE',  # New Content-Disposition filename
+            **extra_args
+        )
+    record_upload(niche_folder_name, shortcode, username, video_number, r2_key, size, sha256)
+    print(f"  ↺ Reused {source_key} ({CROSS_NICHE_REUSE}), no download")
+    return f"{R2_PUBLIC_DOMAIN}/{r2_key}", os.path.basename(r2_key)
+
+def sha256_hex(local_file=None, data=None):
+    """Hex SHA-256 of in-memory bytes or of a file read in chunks"""
+    digest = hashlib.sha256()
+    if data is not None:
+        digest.update(data)
+    else:
+        with open(local_file, "rb") as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_BYTES), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def build_r2_index(niche_folder_name):
+    """List a niche's R2 prefix once and map "username_shortcode" -> R2 key.
+
+    Uses paginated ListObjectsV2 (one call per 1000 keys). Usernames and
+    shortcodes may both contain underscores, so the index is keyed by the
+    full "username_shortcode" tail rather than by the shortcode alone.
+    """
+    s3_client = get_r2_client()
+    paginator = s3_client.get_paginator('list_objects_v2')
+    
+    index = {}
+    for page in paginator.paginate(Bucket=R2_BUCKET_NAME, Prefix=f"{niche_folder_name}/"):
+        for obj in page.get('Contents', []):
+            parsed = parse_r2_filename(os.path.basename(obj['Key']))
+            if parsed:
+                index[parsed[1]] = obj['Key']
+    return index
+
+def load_csv_filenames(output_csv):
+    """Return the set of filenames already written to a niche CSV"""
+    if not os.path.exists(output_csv):
+        return set()
+    with open(output_csv, "r", newline="", encoding="utf-8") as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader, None)  # Skip header
+        return set(row[4] for row in reader if len(row) > 4)
+
 # Function to upload to R2 with numbered filename
-def upload_to_r2(local_file, niche_folder_name, video_number, username):
-    """Uploads to Cloudflare R2 and returns a direct public link"""
-    
-    # Initialize S3 client for R2
-    s3_client = boto3.client(
-        's3',
-        endpoint_url=f'https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com',
-        aws_access_key_id=R2_ACCESS_KEY,
-        aws_secret_access_key=R2_SECRET_KEY,
-        region_name='auto'
-    )
+def upload_to_r2(local_file, niche_folder_name, video_number, username, data=None, sha256=None):
+    """Uploads to Cloudflare R2 and returns a direct public link
+
+    If data (bytes) is given it is uploaded straight from memory and
+    local_file only supplies the shortcode for the object name. sha256 is
+    the body's hex digest if the caller already has it; otherwise it is
+    computed as the body is read for the upload, falling back to a second
+    read of the file if that read was not sequential. Content
+    keys hash a file on disk before uploading it. The digest is sent for R2
+    to check and stored in the uploads table.
+    """
+    
+    s3_client = get_r2_client()
 
-    # Create filename: niche1_reels/001_username_shortcode.mp4
+    # Create filename: niche1_reels/001_username_shortcode.mp4 (see R2_KEY_SCHEME)
     original_name = os.path.basename(local_file)
     shortcode = os.path.splitext(original_name)[0]
     
     # R2 uses "keys" (paths) instead of folder IDs
-    r2_key = f"{niche_folder_name}/{video_number:03d}_{username}_{shortcode}.mp4"
+    if sha256 is None and R2_KEY_SCHEME == "content":
+        # The key needs it before the upload starts: one extra read for files on disk
+        sha256 = sha256_hex(local_file, data)
+    r2_key = build_r2_key(niche_folder_name, video_number, username, shortcode, sha256)
     r2_filename = os.path.basename(r2_key)
+    extra_args = upload_extra_args(r2_filename)
+    size = len(data) if data is not None else os.path.getsize(local_file)
+    if sha256 and R2_CHECKSUM_ALGORITHM == "SHA256" and size < R2_MULTIPART_THRESHOLD:
+        # Single PUT: R2 checks the object against our digest, boto3 doesn't hash it again
+        del extra_args['ChecksumAlgorithm']
+        extra_args['ChecksumSHA256'] = base64.b64encode(bytes.fromhex(sha256)).decode()
+    
+    # boto3 calls this as the body is read, so waiting in it shapes the upload stream
+    pace = bandwidth_pacer("upload", niche_folder_name)
 
     try:
         # Upload
-        s3_client.upload_file(
-            local_file, 
-            R2_BUCKET_NAME, 
-            r2_key,
-            ExtraArgs={'ContentType': 'video/mp4'}  # Critical for Pinterest
-        )
+        body = io.BytesIO(data) if data is not None else open(local_file, "rb")
+        reader = body if sha256 else HashingReader(body)
+        try:
+            s3_client.upload_fileobj(
+                reader,
+                R2_BUCKET_NAME,
+                r2_key,
+                ExtraArgs=extra_args,
+                Callback=pace
+            )
+        finally:
+            body.close()
+        
+        if not sha256:
+            # Reads that skipped ahead (e.g. multipart) leave a gap: read the file once more
+            sha256 = reader.hexdigest(size) or sha256_hex(local_file, data)
+        record_upload(niche_folder_name, shortcode, username, video_number, r2_key, size, sha256)
         
         # Generate Direct Link
         direct_link = f"{R2_PUBLIC_DOMAIN}/{r2_key}"
         
-        # Small delay for propagation
-        time.sleep(1)
-        
         return direct_link, r2_filename
 
     except Exception as e:
         print(f"R2 Upload Failed: {e}")
         raise e  # Re-raise to trigger the retry logic in process_post
 
-# Function to download + upload a single post with retries
-def process_post(args, niche_config, processed_posts):
-    username, post = args
-    if post.shortcode in processed_posts:
-        return
+# --- CSV & Processed Tracking ---
+@contextmanager
+def locked_append(path, mode="a", **open_kwargs):
+    """Open a tracking file for appending under FILE_LOCK plus an exclusive
+    flock, so worker processes on other nodes don't interleave lines"""
+    with FILE_LOCK, open(path, mode, **open_kwargs) as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)  # Released when the file is closed
+        yield f
+        f.flush()
+
+# --- CSV Row Index ---
+# Each niche CSV has a sidecar (reels_niche1.csv.idx) with one
+# "shortcode<TAB>offset<TAB>length" line per row written. The last line for a
+# shortcode wins; offset -1 marks a deleted row. Rows are only ever changed in
+# place when the new bytes have the same length - otherwise the new version is
+# appended and the old one stays in the CSV until compact_csv drops it.
+CSV_HEADER = [
+    "No.", "Username", "Video Title", "Drive Folder", "Filename", "Drive Link",
+    "title", "description", "link", "board", "media_url"
+]
+CSV_INDEX_SUFFIX = ".idx"
+_csv_indexes = {}  # output_csv -> {"inode", "read", "rows": {shortcode: (offset, length)}}
+
+def csv_line(row):
+    """A row encoded exactly as csv.writer writes it to the niche CSV"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(row)
+    return buffer.getvalue().encode("utf-8")
 
-    # Get video number
-    video_number = get_next_video_number()
+def row_shortcode(row):
+    """Shortcode of a niche CSV row, from its Username and Filename columns (None if unknown)"""
+    if len(row) < 5:
+        return None
+    parsed = parse_r2_filename(row[4])
+    if parsed is None or not parsed[1].startswith(row[1] + "_"):
+        return None
+    return parsed[1][len(row[1]) + 1:]
+
+def scan_csv_rows(f):
+    """Yield (offset, length, row) for every data row of a CSV opened in binary mode"""
+    position = 0
     
-    # Use niche-based Drive folder (not username-based)
-    target_folder = f"{niche_config['drive_folder']}_local"  # Local temp folder
-    drive_folder = niche_config['drive_folder']  # Drive folder name
-    os.makedirs(target_folder, exist_ok=True)
+    def lines():
+        nonlocal position
+        for line in iter(f.readline, b""):
+            position += len(line)
+            yield line.decode("utf-8")
     
-    last_error = None  # Track last error for failure logging
+    reader = csv.reader(lines())  # Pulls one line at a time, so position is the end of the row
+    next(reader, None)  # Skip header
+    start = position
+    for row in reader:
+        yield start, position - start, row
+        start = position
 
-    for attempt in range(RETRIES):
-        try:
-            # Download video
-            L.download_post(post, target=target_folder)
+def rebuild_csv_index(output_csv):
+    """Write the sidecar index for a CSV from scratch by scanning it once"""
+    entries = []
+    if os.path.exists(output_csv):
+        with open(output_csv, "rb") as f:
+            for offset, length, row in scan_csv_rows(f):
+                shortcode = row_shortcode(row)
+                if shortcode:
+                    entries.append(f"{shortcode}\t{offset}\t{length}\n")
+    write_atomic(output_csv + CSV_INDEX_SUFFIX, "".join(entries))
 
-            # Verify file exists before upload (Instaloader may rename)
-            local_file = find_video_file(target_folder, post.shortcode)
-            if local_file is None:
-                raise FileNotFoundError(f"Video file not found for {post.shortcode}")
+def load_csv_index(output_csv):
+    """Return {shortcode: (offset, length)} for a CSV; the caller holds the CSV's lock.
 
-            # Strip metadata fingerprints before upload
-            local_file = strip_metadata(local_file)
+    The sidecar is append-only, so only lines added since the last call are
+    read. A replaced sidecar (after compaction) is read again from the start.
+    """
+    index_path = output_csv + CSV_INDEX_SUFFIX
+    if not os.path.exists(index_path):
+        rebuild_csv_index(output_csv)
+    stat = os.stat(index_path)
+    cached = _csv_indexes.get(output_csv)
+    if cached is None or cached["inode"] != stat.st_ino or cached["read"] > stat.st_size:
+        cached = {"inode": stat.st_ino, "read": 0, "rows": {}}
+        _csv_indexes[output_csv] = cached
+    if cached["read"] < stat.st_size:
+        with open(index_path, "rb") as f:
+            f.seek(cached["read"])
+            data = f.read()
+        data = data[:data.rfind(b"\n") + 1]  # Never half a line
+        for line in data.decode("utf-8").splitlines():
+            shortcode, offset, length = line.split("\t")
+            if offset == "-1":
+                cached["rows"].pop(shortcode, None)
+            else:
+                cached["rows"][shortcode] = (int(offset), int(length))
+        cached["read"] += len(data)
+    return cached["rows"]
 
-            # Upload to R2 with numbering
-            drive_link, drive_filename = upload_to_r2(local_file, drive_folder, video_number, username)
+def read_indexed_row(output_csv, offset, length):
+    """Parse the CSV row at an indexed offset, or None if the bytes there aren't one row"""
+    if offset + length > os.path.getsize(output_csv):
+        return None
+    with open(output_csv, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    try:
+        rows = list(csv.reader(io.StringIO(data.decode("utf-8"), newline="")))
+    except (UnicodeDecodeError, csv.Error):
+        return None
+    return rows[0] if len(rows) == 1 else None
 
-            # === SUCCESS CONFIRMED - NOW WRITE CSV ===
-            # Only write CSV after upload + permission success
-            full_caption = post.title if post.title else post.caption or ""
-            
-            # Normalize and clean the title
-            title = normalize_text(full_caption)
-            if len(title) > 100:
-                title = title[:100] + "..."
-            
-            # Pinterest formatted title and description
-            pin_title, pin_description = format_for_pinterest(full_caption, drive_link)
-            
-            with open(niche_config['output_csv'], "a", newline="", encoding="utf-8") as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow([
-                    # Original tracking columns
-                    video_number,           # No.
-                    username,               # Username
-                    title,                  # Video Title (single line)
-                    drive_folder,           # Drive Folder
-                    drive_filename,         # Filename in Drive
-                    drive_link,             # Drive Link
-                    # Pinterest columns
-                    pin_title,              # title (Pinterest)
-                    pin_description,        # description (Pinterest) - overflow + hashtags
-                    "",                     # link (empty)
-                    "",                     # board (empty)
-                    drive_link              # media_url (direct download link)
-                ])
-
-            # Mark as processed
-            with open(niche_config['processed_file'], "a") as f:
-                f.write(post.shortcode + "\n")
-
-            # Delete local file
-            if os.path.exists(local_file):
-                os.remove(local_file)
-
-            print(f"[{video_number:03d}] {username}/{drive_filename} -> {drive_link}")
-            return  # success, exit function
+def find_csv_row(output_csv, shortcode):
+    """Return (offset, length, row) of a post's CSV row, or None; the caller holds the CSV's lock.
 
-        except Exception as e:
-            last_error = str(e)
-            print(f"[{video_number:03d}] Attempt {attempt+1} failed for {post.shortcode}: {e}")
-            time.sleep(2)  # small delay before retry
-    
-    # === ALL RETRIES FAILED - LOG TO FAILED FILE ===
-    print(f"[{video_number:03d}] FAILED permanently: {username}/{post.shortcode}")
-    with open(niche_config['failed_file'], "a", encoding="utf-8") as f:
-        f.write(f"{username},{post.shortcode},{last_error}\n")
+    The indexed bytes must still parse as this post's row. If they don't
+    (the CSV was edited by hand), the index is rebuilt and looked up again.
+    """
+    current = load_csv_index(output_csv).get(shortcode)
+    if current is None:
+        return None
+    row = read_indexed_row(output_csv, *current)
+    if row is None or row_shortcode(row) != shortcode:
+        print(f"⚠ {output_csv}{CSV_INDEX_SUFFIX} is out of date, rebuilding it")
+        rebuild_csv_index(output_csv)
+        _csv_indexes.pop(output_csv, None)
+        current = load_csv_index(output_csv).get(shortcode)
+        if current is None:
+            return None
+        row = read_indexed_row(output_csv, *current)
+        if row is None or row_shortcode(row) != shortcode:
+            return None
+    return current[0], current[1], row
 
-def process_niche(niche_name, niche_config):
-    """Process all videos for a single niche"""
-    global video_counter
-    video_counter = 0  # Reset counter for each niche
+def append_csv_index(output_csv, shortcode, offset, length):
+    with open(output_csv + CSV_INDEX_SUFFIX, "a", encoding="utf-8") as f:
+        f.write(f"{shortcode}\t{offset}\t{length}\n")
+
+def put_csv_row(output_csv, csvfile, shortcode, data):
+    """Write a row for a shortcode through the locked CSV handle (opened "ab").
+
+    Overwrites the current row in place if the lengths match, otherwise
+    appends and points the index at the new copy.
+    """
+    current = find_csv_row(output_csv, shortcode)
+    if current is not None and current[1] == len(data):
+        with open(output_csv, "r+b") as f:
+            f.seek(current[0])
+            f.write(data)
+        return
+    offset = csvfile.seek(0, os.SEEK_END)
+    csvfile.write(data)
+    csvfile.flush()
+    append_csv_index(output_csv, shortcode, offset, len(data))
+
+def update_csv_row(niche_config, shortcode, changes):
+    """Change columns of a post's CSV row, e.g. {"Drive Link": url, "media_url": url}.
+
+    Only that row is read and written. Returns False if the post has no row.
+    """
+    output_csv = niche_config['output_csv']
+    with locked_append(output_csv, "ab") as csvfile:
+        current = find_csv_row(output_csv, shortcode)
+        if current is None:
+            return False
+        row = current[2]
+        for column, value in changes.items():
+            row[CSV_HEADER.index(column)] = value
+        put_csv_row(output_csv, csvfile, shortcode, csv_line(row))
+    return True
+
+def delete_csv_row(niche_config, shortcode):
+    """Tombstone a post's CSV row; compact_csv removes it from the file"""
+    output_csv = niche_config['output_csv']
+    with locked_append(output_csv, "ab"):
+        if shortcode not in load_csv_index(output_csv):
+            return False
+        append_csv_index(output_csv, shortcode, -1, 0)
+    return True
+
+def compact_csv(niche_config):
+    """Rewrite a niche CSV without superseded or deleted rows; returns (kept, dropped)"""
+    output_csv = niche_config['output_csv']
+    kept = dropped = 0
+    with locked_append(output_csv, "ab"):  # Hold the lock so no row is written meanwhile
+        rows = load_csv_index(output_csv)
+        entries = []
+        with open(output_csv, "rb") as src, open(output_csv + ".tmp", "wb") as dst:
+            dst.write(csv_line(CSV_HEADER))
+            for offset, length, row in scan_csv_rows(src):
+                shortcode = row_shortcode(row)
+                if shortcode is not None and rows.get(shortcode) != (offset, length):
+                    dropped += 1
+                    continue
+                if shortcode is not None:
+                    entries.append(f"{shortcode}\t{dst.tell()}\t{length}\n")
+                src_position = src.tell()
+                src.seek(offset)
+                dst.write(src.read(length))  # Copy the bytes as they are
+                src.seek(src_position)
+                kept += 1
+        os.replace(output_csv + ".tmp", output_csv)
+        write_atomic(output_csv + CSV_INDEX_SUFFIX, "".join(entries))
+    return kept, dropped
+
+def run_compact_csv(niche_names):
+    """--compact-csv: drop superseded and deleted rows from each niche CSV"""
+    for niche_name in niche_names:
+        niche_config = NICHES[niche_name]
+        if not os.path.exists(niche_config['output_csv']):
+            continue
+        kept, dropped = compact_csv(niche_config)
+        print(f"✓ {niche_name}: {kept} rows kept, {dropped} removed from {niche_config['output_csv']}")
+
+def write_csv_row(niche_config, post, video_number, username, drive_folder, drive_filename, drive_link):
+    """Write the Pinterest-ready row for an uploaded post to the niche CSV.
+
+    A post that already has a row (re-uploaded) gets that row replaced
+    rather than a second one.
+    """
+    full_caption = post.title if post.title else post.caption or ""
     
-    print("\n" + "=" * 60)
-    print(f"PROCESSING NICHE: {niche_name}")
-    print(f"Links file: {niche_config['links_file']}")
-    print(f"Drive folder: {niche_config['drive_folder']}")
-    print(f"Output CSV: {niche_config['output_csv']}")
-    print("=" * 60)
+    # Normalize and clean the title
+    title = normalize_text(full_caption)
+    if len(title) > 100:
+        title = title[:100] + "..."
     
-    # Check if links file exists
-    if not os.path.exists(niche_config['links_file']):
-        print(f"WARNING: {niche_config['links_file']} not found. Skipping niche.")
-        return 0
+    # Pinterest formatted title and description
+    pin_title, pin_description = format_for_pinterest(full_caption, drive_link)
+    
+    row = csv_line([
+        # Original tracking columns
+        video_number,           # No.
+        username,               # Username
+        title,                  # Video Title (single line)
+        drive_folder,           # Drive Folder
+        drive_filename,         # Filename in Drive
+        drive_link,             # Drive Link
+        # Pinterest columns
+        pin_title,              # title (Pinterest)
+        pin_description,        # description (Pinterest) - overflow + hashtags
+        "",                     # link (empty)
+        "",                     # board (empty)
+        drive_link              # media_url (direct download link)
+    ])
+    with locked_append(niche_config['output_csv'], "ab") as csvfile:
+        put_csv_row(niche_config['output_csv'], csvfile, post.shortcode, row)
+
+def mark_processed(niche_config, shortcode):
+    """Append a shortcode to the niche's processed file"""
+    with locked_append(niche_config['processed_file']) as f:
+        f.write(shortcode + "\n")
+
+def recover_from_r2(niche_config, username, post, r2_key, csv_filenames):
+    """Finish a post that reached R2 before the previous run crashed.
+
+    Nothing is downloaded: the CSV row is written only if it is missing,
+    the upload is completed in the uploads table (so --export and
+    cross-niche reuse see it), then the shortcode is marked as processed.
+    """
+    drive_folder = niche_config['drive_folder']
+    drive_filename = os.path.basename(r2_key)
+    drive_link = f"{R2_PUBLIC_DOMAIN}/{r2_key}"
+    video_number = parse_r2_filename(drive_filename)[0]
+    
+    if drive_filename not in csv_filenames:
+        if video_number is None:  # Content keys carry no number
+            video_number = get_next_video_number(drive_folder)
+        write_csv_row(niche_config, post, video_number, username, drive_folder, drive_filename, drive_link)
+        csv_filenames.add(drive_filename)
+    
+    if not upload_recorded(drive_folder, post.shortcode):
+        # Uploaded before the state DB tracked uploads: the digest is unknown
+        size = get_r2_client().head_object(Bucket=R2_BUCKET_NAME, Key=r2_key)['ContentLength']
+        record_upload(drive_folder, post.shortcode, username, video_number, r2_key, size, None)
+    record_caption(drive_folder, post.shortcode, post.title or post.caption or "")
+    mark_processed(niche_config, post.shortcode)
+    print(f"  ↺ Already in R2, skipping download: {username}/{drive_filename}")
+
+def process_staged_video(post, username, target_folder, drive_folder, video_number, staging,
+                         set_stage=lambda stage: None):
+    """Download, strip and upload one video through RAM (IN_MEMORY_STAGING).
+
+    Returns (drive_link, drive_filename). A video that spilled to disk takes
+    the usual FFmpeg path and its size is charged to the staging reservation.
+    set_stage is told each stage as it starts, so the caller can label errors.
+    """
+    with METRICS.time_stage("download", drive_folder) as timing:
+        staged = download_to_staging(post, target_folder, drive_folder)
+        timing["bytes"] = staged.size
+        timing["media_seconds"] = post.video_duration or 0.0
+    
+    try:
+        set_stage("validate")
+        with METRICS.time_stage("validate", drive_folder):
+            if staged.in_memory:
+                validate_mp4(data=staged.buffer)
+            else:
+                validate_mp4(staged.spill_path)
+        
+        if staged.in_memory and OUTPUT_PROFILE == "h264":
+            # Re-encoding needs FFmpeg, which needs a file
+            staged.spill()
+            staged.finish()
+        if not staged.in_memory:
+            staging.reserve(staged.size * STAGING_COPY_FACTOR, wait=False)
+        else:
+            set_stage("strip")
+            with METRICS.time_stage("strip", drive_folder):
+                digest = hashlib.sha256()
+                stripped = strip_metadata_in_memory(staged.buffer, faststart=OUTPUT_PROFILE == "faststart",
+                                                    digest=digest)
+                if stripped is not None:
+                    staged.replace(stripped)
+                    print(f"    ✓ Metadata stripped in memory")
+                else:
+                    # Not something we can edit in memory - let FFmpeg handle it on disk
+                    staged.spill()
+                    staged.finish()
+                    staging.reserve(staged.size * STAGING_COPY_FACTOR, wait=False)
+        
+        if staged.in_memory:
+            set_stage("upload")
+            with METRICS.time_stage("upload", drive_folder) as timing:
+                timing["bytes"] = len(staged.buffer)
+                drive_link, drive_filename = upload_to_r2(post.shortcode + ".mp4", drive_folder, video_number,
+                                                          username, data=staged.buffer, sha256=digest.hexdigest())
+            return drive_link, drive_filename
+        
+        set_stage("strip")
+        with METRICS.time_stage("strip", drive_folder):
+            local_file = strip_metadata(staged.spill_path)
+        set_stage("upload")
+        with METRICS.time_stage("upload", drive_folder) as timing:
+            timing["bytes"] = os.path.getsize(local_file)
+            drive_link, drive_filename = upload_to_r2(local_file, drive_folder, video_number, username)
+        return drive_link, drive_filename
+    finally:
+        staged.release_memory()
+
+# Function to download + upload a single post with retries
+def process_post(args, niche_config, processed_posts):
+    """Returns True once the post is uploaded (or already was), False if every retry failed"""
+    username, post = args
+    if post.shortcode in processed_posts:
+        return True
+
+    # Use niche-based Drive folder (not username-based)
+    target_folder = f"{niche_config['drive_folder']}_local"  # Local temp folder
+    drive_folder = niche_config['drive_folder']  # Drive folder name
+    
+    # Get video number (unique per R2 prefix, persists across runs)
+    video_number = get_next_video_number(drive_folder)
+    os.makedirs(target_folder, exist_ok=True)
     
+    last_error = None  # Track last error for failure logging
+    existing = find_existing_upload(post.shortcode, drive_folder) if CROSS_NICHE_REUSE else None
+    METRICS.add_gauge("pending", drive_folder, -1)
+    METRICS.add_gauge("in_flight", drive_folder, 1)
+
+    def set_stage(name):
+        nonlocal stage
+        stage = name
+
+    try:
+        for attempt in range(RETRIES):
+            stage = "download"  # Current stage, used to label errors
+            staging = StagingReservation(target_folder)
+            try:
+                if existing is not None:
+                    # Already uploaded for another niche - no Instagram download needed
+                    stage = "reuse"
+                    with METRICS.time_stage("reuse", drive_folder):
+                        drive_link, drive_filename = reuse_upload(existing, drive_folder, video_number,
+                                                                  username, post.shortcode)
+                elif IN_MEMORY_STAGING:
+                    drive_link, drive_filename = process_staged_video(
+                        post, username, target_folder, drive_folder, video_number, staging, set_stage)
+                else:
+                    # Wait for staging budget and free disk space before downloading
+                    with METRICS.time_stage("staging_wait", drive_folder):
+                        staging.reserve(estimate_video_bytes(post) * STAGING_COPY_FACTOR)
+                    
+                    # Download video
+                    with METRICS.time_stage("download", drive_folder) as timing:
+                        download_video(post, target_folder, drive_folder)
+
+                        # Verify file exists before upload
+                        local_file = find_video_file(target_folder, post.shortcode)
+                        if local_file is None:
+                            raise FileNotFoundError(f"Video file not found for {post.shortcode}")
+                        timing["bytes"] = os.path.getsize(local_file)
+                        timing["media_seconds"] = post.video_duration or 0.0
+                    staging.reserve(timing["bytes"] * STAGING_COPY_FACTOR, wait=False)
+
+                    # Catch truncated or broken files before FFmpeg and the upload see them
+                    stage = "validate"
+                    with METRICS.time_stage("validate", drive_folder):
+                        validate_mp4(local_file)
+
+                    # Strip metadata fingerprints before upload
+                    stage = "strip"
+                    with METRICS.time_stage("strip", drive_folder):
+                        local_file = strip_metadata(local_file)
+
+                    # Upload to R2 with numbering
+                    stage = "upload"
+                    with METRICS.time_stage("upload", drive_folder) as timing:
+                        timing["bytes"] = os.path.getsize(local_file)
+                        drive_link, drive_filename = upload_to_r2(local_file, drive_folder, video_number, username)
+
+                # === SUCCESS CONFIRMED - NOW WRITE CSV ===
+                # Only write CSV after upload + permission success
+                stage = "csv_write"
+                with METRICS.time_stage("csv_write", drive_folder):
+                    write_csv_row(niche_config, post, video_number, username, drive_folder, drive_filename, drive_link)
+                    record_caption(drive_folder, post.shortcode, post.title or post.caption or "")
+
+                    # Mark as processed
+                    mark_processed(niche_config, post.shortcode)
+
+                print(f"[{video_number:03d}] {username}/{drive_filename} -> {drive_link}")
+                return True  # success, exit function
+
+            except Exception as e:
+                last_error = str(e)
+                if stage == "reuse":
+                    existing = None  # Download it like any other post on the next attempt
+                # A file broken at the source would come back the same - don't spend retries on it
+                give_up = attempt == RETRIES - 1 or (isinstance(e, InvalidVideoError) and not e.retryable)
+                METRICS.count_error("failures" if give_up else "retries", drive_folder, stage, e)
+                print(f"[{video_number:03d}] Attempt {attempt+1} failed for {post.shortcode}: {e}")
+                if give_up:
+                    break
+                time.sleep(2)  # small delay before retry
+            finally:
+                # Delete local files (video, cleaned copy, thumbnail) and free the staging budget
+                remove_staging_files(target_folder, post.shortcode)
+                staging.release()
+        
+        # === ALL RETRIES FAILED - LOG TO FAILED FILE ===
+        print(f"[{video_number:03d}] FAILED permanently: {username}/{post.shortcode}")
+        with locked_append(niche_config['failed_file'], encoding="utf-8") as f:
+            f.write(f"{username},{post.shortcode},{last_error}\n")
+        return False
+    finally:
+        METRICS.add_gauge("in_flight", drive_folder, -1)
+
+# --- Prioritization & Budget ---
+def score_post(post, weights, now=None):
+    """Weighted value of a post from recency, views, likes and engagement rate"""
+    age_days = ((now or time.time()) - post.date_utc.replace(tzinfo=timezone.utc).timestamp()) / 86400
+    views = post.video_view_count or 0
+    likes = post.likes or 0
+    components = {
+        "recency": 0.5 ** (max(age_days, 0) / RECENCY_HALF_LIFE_DAYS),
+        "views": math.log10(1 + views) / 7,
+        "likes": math.log10(1 + likes) / 6,
+        "engagement": min((likes + (post.comments or 0)) / views * 10, 1.0) if views else 0.0,
+    }
+    return sum(weight * components.get(name, 0.0) for name, weight in weights.items())
+
+def prioritize_videos(videos, niche_config):
+    """Order [(username, post)] by score, highest first"""
+    weights = niche_config.get("score_weights", SCORE_WEIGHTS)
+    now = time.time()
+    return sorted(videos, key=lambda video: score_post(video[1], weights, now), reverse=True)
+
+def parse_budget(text):
+    """Parse a --budget value into ("videos" | "bytes" | "seconds", amount)"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*(|videos?|kb|mb|gb|m|min|h)", text.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid budget: {text} (use e.g. 50, 500mb, 2gb, 45m or 2h)")
+    amount, unit = float(match.group(1)), match.group(2)
+    if unit in ("", "video", "videos"):
+        return "videos", int(amount)
+    if unit in ("kb", "mb", "gb"):
+        return "bytes", int(amount * {"kb": 1024, "mb": 1024 ** 2, "gb": 1024 ** 3}[unit])
+    return "seconds", amount * (3600 if unit == "h" else 60)
+
+def apply_budget(videos, budget):
+    """Trim prioritized videos to a budget; returns (videos, deadline or None).
+
+    A byte budget skips videos that don't fit and keeps going with smaller
+    ones; a time budget keeps every video and stops dispatching at the deadline.
+    """
+    if budget is None:
+        return videos, None
+    kind, amount = budget
+    if kind == "videos":
+        return videos[:amount], None
+    if kind == "seconds":
+        return videos, time.time() + amount
+    selected = []
+    remaining = amount
+    for video in videos:
+        size = estimate_video_bytes(video[1])
+        if size <= remaining:
+            selected.append(video)
+            remaining -= size
+    return selected, None
+
+def load_processed_posts(niche_config):
+    """Return the set of shortcodes in the niche's processed file"""
+    if not os.path.exists(niche_config['processed_file']):
+        return set()
+    with open(niche_config['processed_file'], "r") as f:
+        return set(line.strip() for line in f if line.strip())
+
+def prepare_niche(niche_config):
+    """Create the niche's tracking files and CSV header, sweep orphaned staging
+    files and return the set of processed shortcodes"""
     # Ensure tracking files exist
     if not os.path.exists(niche_config['processed_file']):
         open(niche_config['processed_file'], "w").close()
     if not os.path.exists(niche_config['failed_file']):
         open(niche_config['failed_file'], "w").close()
     
-    # Load processed posts for this niche
-    with open(niche_config['processed_file'], "r") as f:
-        processed_posts = set(line.strip() for line in f if line.strip())
+    # Reclaim staging files left behind by a crashed run
+    freed = sweep_staging_folder(f"{niche_config['drive_folder']}_local")
+    if freed:
+        print(f"Reclaimed {freed / (1024 * 1024):.1f} MB of orphaned staging files")
+    
+    processed_posts = load_processed_posts(niche_config)
     
     # Initialize CSV with headers if it doesn't exist
     if not os.path.exists(niche_config['output_csv']):
         with open(niche_config['output_csv'], "w", newline="", encoding="utf-8") as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerow([
-                "No.", "Username", "Video Title", "Drive Folder", "Filename", "Drive Link",
-                "title", "description", "link", "board", "media_url"
-            ])
+            writer.writerow(CSV_HEADER)
+        if os.path.exists(niche_config['output_csv'] + CSV_INDEX_SUFFIX):
+            os.remove(niche_config['output_csv'] + CSV_INDEX_SUFFIX)  # Left over from a deleted CSV
+    return processed_posts
+
+def load_r2_index(niche_config):
+    """Return (r2_index, csv_filenames) for a niche, both empty if disabled or unavailable"""
+    r2_index = {}
+    csv_filenames = set()
+    if R2_INDEX_ON_STARTUP:
+        try:
+            # One listing call per 1000 keys
+            r2_index = build_r2_index(niche_config['drive_folder'])
+            csv_filenames = load_csv_filenames(niche_config['output_csv'])
+            print(f"R2 index: {len(r2_index)} objects under {niche_config['drive_folder']}/")
+        except Exception as e:
+            print(f"WARNING: Could not list R2 prefix, continuing without index: {e}")
+    return r2_index, csv_filenames
+
+def seed_niche_numbers(niche_config, r2_index):
+    """Continue numbering after anything already written or uploaded"""
+    highest_r2_number = max(
+        (parse_r2_filename(os.path.basename(key))[0] or 0 for key in r2_index.values()),
+        default=0
+    )
+    seed_video_numbers(niche_config['drive_folder'],
+                       max(highest_csv_video_number(niche_config['output_csv']), highest_r2_number))
+
+def crawl_profile(session, niche_config, username, processed_posts, r2_index, csv_filenames, since=None,
+                  recover=True):
+    """Walk one profile's posts newest first; returns (new_videos, post_times, in_r2).
+
+    post_times are the UTC timestamps of the non-pinned posts seen. With
+    `since` (a timestamp) the walk stops at the first non-pinned post that
+    is not newer, so a poll only pays for what was posted since the last one.
+    Posts already in R2 are recovered unless `recover` is False (dry runs).
+    Videos rejected by the niche's "filters" are skipped without downloading.
+    """
+    new_videos = []
+    post_times = []
+    in_r2 = 0
+    filters = niche_config.get("filters", {})
+    filtered = {}  # reason -> count
+    oldest_allowed = time.time() - filters["max_age_days"] * 86400 if "max_age_days" in filters else None
+    profile = instaloader.Profile.from_username(session.loader.context, username)
+    for post in profile.get_posts():
+        if not post.is_pinned:
+            posted_at = post.date_utc.replace(tzinfo=timezone.utc).timestamp()
+            post_times.append(posted_at)
+            if since is not None and posted_at <= since:
+                break
+            if oldest_allowed is not None and posted_at < oldest_allowed:
+                break  # Everything further down the feed is older still
+        if post.is_video and post.shortcode not in processed_posts:
+            reason = post_filter_reason(post, filters)
+            if reason:
+                filtered[reason] = filtered.get(reason, 0) + 1
+                continue
+            r2_key = r2_index.get(f"{username}_{post.shortcode}")
+            if r2_key:
+                if recover:
+                    recover_from_r2(niche_config, username, post, r2_key, csv_filenames)
+                    processed_posts.add(post.shortcode)
+                in_r2 += 1
+            else:
+                new_videos.append((username, post))
+    if filtered:
+        print(f"  @{username}: filtered out {sum(filtered.values())} videos "
+              f"({', '.join(f'{reason}: {count}' for reason, count in sorted(filtered.items()))})")
+    return new_videos, post_times, in_r2
+
+def collect_new_videos(niche_config, processed_posts, links, dry_run=False):
+    """Crawl every profile in `links` and return [(username, post)] still to process.
+
+    Posts already in R2 are recovered on the spot, and numbering is seeded
+    past anything already written or uploaded before the crawl starts, so
+    no worker can be handed a number an existing upload already uses. A dry
+    run changes nothing.
+    """
+    r2_index, csv_filenames = load_r2_index(niche_config)
+    if not dry_run:
+        seed_niche_numbers(niche_config, r2_index)
+    
+    def crawl_link(link):
+        username = link.rstrip("/").split("/")[-1]
+        for attempt in range(RETRIES):
+            session = SESSION_POOL.acquire()
+            try:
+                print(f"Fetching posts from @{username}...")
+                with METRICS.time_stage("profile_fetch", niche_config['drive_folder']):
+                    new_videos, _, profile_recovered = crawl_profile(
+                        session, niche_config, username, processed_posts, r2_index, csv_filenames,
+                        recover=not dry_run)
+                return new_videos, profile_recovered
+            except Exception as e:
+                SESSION_POOL.report_error(session, e)
+                # A rate-limited or challenged session is cooling down now: move the profile to another one
+                give_up = attempt == RETRIES - 1 or classify_session_error(e) is None
+                METRICS.count_error("failures" if give_up else "retries", niche_config['drive_folder'],
+                                    "profile_fetch", e)
+                print(f"Error fetching profile {link}: {e}")
+                if give_up:
+                    return [], 0
+    
+    # Crawl up to PROFILE_CONCURRENCY profiles at once (paced by CRAWL_RATE_LIMITER),
+    # merging in links-file order; a collab post listed by two profiles is kept once
+    all_videos = []
+    seen = set()
+    recovered = 0
+    with ThreadPoolExecutor(max_workers=PROFILE_CONCURRENCY) as executor:
+        for new_videos, profile_recovered in executor.map(lambda link: profiled(crawl_link, link), links):
+            for username, post in new_videos:
+                if post.shortcode not in seen:
+                    seen.add(post.shortcode)
+                    all_videos.append((username, post))
+            recovered += profile_recovered
     
-    # Read profile links for this niche
+    if dry_run:
+        if recovered:
+            print(f"{recovered} videos are already in R2 and would be recovered without downloading.")
+        return all_videos
+    
+    if recovered:
+        print(f"Recovered {recovered} already-uploaded videos from R2 without downloading.")
+    return all_videos
+
+def read_links(niche_config):
+    """Return the profile links for a niche, or None if its links file is missing"""
+    if not os.path.exists(niche_config['links_file']):
+        print(f"WARNING: {niche_config['links_file']} not found. Skipping niche.")
+        return None
     with open(niche_config['links_file'], "r") as f:
         links = [line.strip() for line in f if line.strip()]
-    
     if not links:
         print(f"No links found in {niche_config['links_file']}. Skipping.")
+    return links
+
+def process_niche(niche_name, niche_config):
+    """Process all videos for a single niche"""
+    print("\n" + "=" * 60)
+    print(f"PROCESSING NICHE: {niche_name}")
+    print(f"Links file: {niche_config['links_file']}")
+    print(f"Drive folder: {niche_config['drive_folder']}")
+    print(f"Output CSV: {niche_config['output_csv']}")
+    print("=" * 60)
+    
+    links = read_links(niche_config)
+    if not links:
         return 0
     
-    # Collect all video posts for this niche
-    all_videos = []
-    for link in links:
-        try:
-            username = link.rstrip("/").split("/")[-1]
-            print(f"Fetching posts from @{username}...")
-            profile = instaloader.Profile.from_username(L.context, username)
-            for post in profile.get_posts():
-                if post.is_video and post.shortcode not in processed_posts:
-                    all_videos.append((username, post))
-        except Exception as e:
-            print(f"Error fetching profile {link}: {e}")
+    processed_posts = prepare_niche(niche_config)
+    all_videos = collect_new_videos(niche_config, processed_posts, links)
     
     if not all_videos:
         print(f"No new videos to process for {niche_name}.")
+        export_metrics()
         return 0
     
-    # Process videos sequentially
+    found = len(all_videos)
+    all_videos, deadline = apply_budget(prioritize_videos(all_videos, niche_config), RUN_BUDGET)
+    if len(all_videos) < found:
+        print(f"Budget: {len(all_videos)} of {found} videos fit, highest score first")
+    
     print(f"\nProcessing {len(all_videos)} videos for {niche_name}...")
-    for i, video_args in enumerate(all_videos, 1):
-        print(f"\n[{i}/{len(all_videos)}] Processing {video_args[0]}/{video_args[1].shortcode}")
-        process_post(video_args, niche_config, processed_posts)
+    process_videos(niche_config, processed_posts, all_videos, deadline)
     
+    export_metrics()
     return len(all_videos)
 
+def process_videos(niche_config, processed_posts, videos, deadline=None):
+    """Run process_post over [(username, post)], on THREADS workers if configured.
+
+    Videos not started by `deadline` are skipped (None) and left for the next run.
+    """
+    METRICS.set_gauge("pending", niche_config['drive_folder'], len(videos))
+    
+    def handle(video_args):
+        if deadline is not None and time.time() >= deadline:
+            return None
+        return profiled(process_post, video_args, niche_config, processed_posts)
+    
+    if THREADS > 1:
+        # Parallel workers - numbering and file appends are safe to share
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            results = list(executor.map(handle, videos))
+    else:
+        # Process videos sequentially
+        results = []
+        for i, video_args in enumerate(videos, 1):
+            print(f"\n[{i}/{len(videos)}] Processing {video_args[0]}/{video_args[1].shortcode}")
+            results.append(handle(video_args))
+    skipped = results.count(None)
+    if skipped:
+        print(f"Time budget used up: {skipped} videos left for the next run")
+    return results
+
 
 def run_all_niches(with_delay=True):
     """Run all niches with optional 1-hour delay between each"""
@@ -490,24 +2440,886 @@ def run_all_niches(with_delay=True):
     print("#" * 60)
 
 
+# --- Daemon Mode ---
+def next_poll_interval(avg_gap, last_post_at, failures, now):
+    """Seconds until a profile should be polled again.
+
+    Active profiles are polled at DAEMON_POLL_FRACTION of their average gap
+    between posts; a profile that has been silent for longer than that gap
+    is polled based on the silence instead, so dormant accounts drift
+    towards DAEMON_MAX_POLL_SECONDS. Errors double the interval.
+    """
+    if avg_gap is None or last_post_at is None:
+        interval = DAEMON_DEFAULT_POLL_SECONDS
+    else:
+        interval = max(avg_gap, now - last_post_at) * DAEMON_POLL_FRACTION
+    interval *= 2 ** failures
+    return min(max(interval, DAEMON_MIN_POLL_SECONDS), DAEMON_MAX_POLL_SECONDS)
+
+def update_posting_rhythm(avg_gap, last_post_at, post_times):
+    """Fold the post timestamps seen in one poll into (avg_gap, last_post_at)"""
+    times = sorted(set(post_times))
+    if last_post_at is not None:
+        times = sorted(set(times) | {last_post_at})
+    for earlier, later in zip(times, times[1:]):
+        gap = later - earlier
+        avg_gap = gap if avg_gap is None else (1 - DAEMON_GAP_SMOOTHING) * avg_gap + DAEMON_GAP_SMOOTHING * gap
+    return avg_gap, (times[-1] if times else last_post_at)
+
+def load_poll_schedule():
+    """Return {(niche, username): poll state} saved by earlier daemon runs"""
+    conn = get_state_db()
+    try:
+        rows = conn.execute(
+            "SELECT niche, username, next_poll, interval, avg_gap, last_post_at, failures FROM profile_polls"
+        ).fetchall()
+    finally:
+        conn.close()
+    return {
+        (niche, username): {"next_poll": next_poll, "interval": interval, "avg_gap": avg_gap,
+                            "last_post_at": last_post_at, "failures": failures}
+        for niche, username, next_poll, interval, avg_gap, last_post_at, failures in rows
+    }
+
+def save_poll_state(niche_name, username, state):
+    """Persist one profile's poll state so a restarted daemon keeps its schedule"""
+    conn = get_state_db()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO profile_polls "
+            "(niche, username, next_poll, interval, avg_gap, last_post_at, failures) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (niche_name, username, state["next_poll"], state["interval"], state["avg_gap"],
+             state["last_post_at"], state["failures"])
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def poll_profile(niche_name, niche_state, username, state):
+    """Fetch a profile's new posts, process them and reschedule the profile"""
+    niche_config = NICHES[niche_name]
+    processed_posts, r2_index, csv_filenames = niche_state
+    now = time.time()
+    session = SESSION_POOL.acquire()
+    try:
+        with METRICS.time_stage("profile_fetch", niche_config['drive_folder']):
+            new_videos, post_times, _ = crawl_profile(session, niche_config, username, processed_posts,
+                                                      r2_index, csv_filenames, since=state["last_post_at"])
+        state["avg_gap"], state["last_post_at"] = update_posting_rhythm(
+            state["avg_gap"], state["last_post_at"], post_times)
+        state["failures"] = 0
+    except Exception as e:
+        SESSION_POOL.report_error(session, e)
+        METRICS.count_error("failures", niche_config['drive_folder'], "profile_fetch", e)
+        print(f"Error polling @{username}: {e}")
+        new_videos = []
+        state["failures"] += 1
+    
+    if new_videos:
+        print(f"@{username}: {len(new_videos)} new videos")
+        process_videos(niche_config, processed_posts, prioritize_videos(new_videos, niche_config))
+    
+    state["interval"] = next_poll_interval(state["avg_gap"], state["last_post_at"], state["failures"], time.time())
+    state["next_poll"] = now + state["interval"]
+    save_poll_state(niche_name, username, state)
+    export_metrics()
+    print(f"@{username} ({niche_name}): next poll in {state['interval'] / 60:.0f} min")
+
+def run_daemon():
+    """Poll every profile forever, each on its own adaptive schedule.
+
+    Profiles sit in a heap keyed by next-poll time. Links files are re-read
+    when they change, so profiles can be added or removed without a restart.
+    """
+    schedule = load_poll_schedule()
+    niche_states = {}  # niche -> (processed_posts, r2_index, csv_filenames)
+    links_mtimes = {}
+    active = set()
+    heap = []
+    scheduled = set()  # Keys currently in the heap
+    
+    print("\n" + "#" * 60)
+    print("INSTAGRAM TO DRIVE - DAEMON MODE")
+    print("#" * 60)
+    
+    try:
+        while True:
+            # Pick up added/removed profiles
+            for niche_name, niche_config in NICHES.items():
+                path = niche_config['links_file']
+                mtime = os.path.getmtime(path) if os.path.exists(path) else None
+                if links_mtimes.get(niche_name, 0) == mtime:
+                    continue
+                links_mtimes[niche_name] = mtime
+                active = {key for key in active if key[0] != niche_name}
+                links = read_links(niche_config) or []
+                if links and niche_name not in niche_states:
+                    processed_posts = prepare_niche(niche_config)
+                    r2_index, csv_filenames = load_r2_index(niche_config)
+                    seed_niche_numbers(niche_config, r2_index)
+                    niche_states[niche_name] = (processed_posts, r2_index, csv_filenames)
+                for link in links:
+                    key = (niche_name, link.rstrip("/").split("/")[-1])
+                    active.add(key)
+                    state = schedule.setdefault(key, {"next_poll": time.time(), "interval": DAEMON_DEFAULT_POLL_SECONDS,
+                                                      "avg_gap": None, "last_post_at": None, "failures": 0})
+                    if key not in scheduled:
+                        heapq.heappush(heap, (state["next_poll"], key))
+                        scheduled.add(key)
+            
+            # Poll everything that is due, then sleep until the next profile (or links check)
+            reload_at = time.time() + DAEMON_RELOAD_SECONDS
+            while heap and heap[0][0] <= time.time() < reload_at:
+                _, key = heapq.heappop(heap)
+                scheduled.discard(key)
+                if key not in active:
+                    continue  # Removed from its links file
+                state = schedule[key]
+                poll_profile(key[0], niche_states[key[0]], key[1], state)
+                heapq.heappush(heap, (state["next_poll"], key))
+                scheduled.add(key)
+            
+            wake_at = min(heap[0][0], reload_at) if heap else reload_at
+            time.sleep(max(0, wake_at - time.time()))
+    except KeyboardInterrupt:
+        print("\nDaemon stopped.")
+        export_metrics()
+
+
+# --- Retry Failed ---
+def read_failed_log(failed_file):
+    """Return {shortcode: (username, error)} from a failed log, latest entry winning"""
+    entries = {}
+    if not os.path.exists(failed_file):
+        return entries
+    with open(failed_file, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split(",", 2)
+            if len(parts) < 2 or not parts[0] or not parts[1]:
+                continue  # Blank line or the tail of a multi-line error message
+            entries.pop(parts[1], None)  # Re-insert so the order follows the latest failure
+            entries[parts[1]] = (parts[0], parts[2] if len(parts) > 2 else "")
+    return entries
+
+def compact_failed_log(niche_config, processed_posts):
+    """Rewrite the failed log without posts that have since succeeded, one line per post"""
+    path = niche_config['failed_file']
+    with locked_append(path, encoding="utf-8"):  # Hold the lock so no failure is appended meanwhile
+        entries = read_failed_log(path)
+        remaining = {shortcode: entry for shortcode, entry in entries.items() if shortcode not in processed_posts}
+        write_atomic(path, "".join(f"{username},{shortcode},{error}\n"
+                                   for shortcode, (username, error) in remaining.items()))
+    return len(remaining)
+
+def resolve_post(shortcode):
+    """Fetch a post by shortcode, backing off between attempts"""
+    for attempt in range(RETRIES):
+        session = SESSION_POOL.acquire()
+        try:
+            return instaloader.Post.from_shortcode(session.loader.context, shortcode)
+        except Exception as e:
+            SESSION_POOL.report_error(session, e)
+            if attempt == RETRIES - 1:
+                raise
+            delay = RETRY_FAILED_BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5)
+            print(f"  Could not resolve {shortcode} ({e}), retrying in {delay:.0f}s")
+            time.sleep(delay)
+
+def retry_failed_post(niche_config, processed_posts, username, shortcode):
+    """Resolve and reprocess one failed post; returns True on success"""
+    try:
+        with METRICS.time_stage("resolve", niche_config['drive_folder']):
+            post = resolve_post(shortcode)
+    except Exception as e:
+        METRICS.count_error("failures", niche_config['drive_folder'], "resolve", e)
+        print(f"FAILED to resolve {username}/{shortcode}: {e}")
+        with locked_append(niche_config['failed_file'], encoding="utf-8") as f:
+            f.write(f"{username},{shortcode},{e}\n")
+        return False
+    if not process_post((username, post), niche_config, processed_posts):
+        return False
+    processed_posts.add(shortcode)  # So compact_failed_log drops it from the log
+    return True
+
+def run_retry_failed(niche_names):
+    """Reprocess the posts in each niche's failed log and compact the log"""
+    total = recovered = 0
+    for niche_name in niche_names:
+        niche_config = NICHES[niche_name]
+        processed_posts = prepare_niche(niche_config)
+        seed_niche_numbers(niche_config, load_r2_index(niche_config)[0])
+        pending = [(username, shortcode) for shortcode, (username, _) in
+                   read_failed_log(niche_config['failed_file']).items() if shortcode not in processed_posts]
+        if not pending:
+            compact_failed_log(niche_config, processed_posts)
+            print(f"No failed posts to retry for {niche_name}.")
+            continue
+        
+        print(f"\nRetrying {len(pending)} failed posts for {niche_name}...")
+        METRICS.set_gauge("pending", niche_config['drive_folder'], len(pending))
+        with ThreadPoolExecutor(max_workers=RETRY_FAILED_CONCURRENCY) as executor:
+            results = list(executor.map(
+                lambda entry: profiled(retry_failed_post, niche_config, processed_posts, *entry), pending))
+        
+        remaining = compact_failed_log(niche_config, processed_posts)
+        total += len(pending)
+        recovered += sum(results)
+        print(f"✓ {niche_name}: {sum(results)}/{len(pending)} recovered, {remaining} left in {niche_config['failed_file']}")
+    export_metrics()
+    print(f"\nRetried {total} failed posts, {recovered} recovered.")
+    return recovered
+
+
+# --- Pinterest Export ---
+class ExportShards:
+    """Writes rows into numbered CSV shards of EXPORT_SHARD_ROWS rows each.
+
+    A shard is written to a temp file and renamed once it is closed, so a
+    half-written shard is never mistaken for a finished one.
+    """
+
+    def __init__(self, niche_name, first_shard):
+        self.niche_name = niche_name
+        self.folder = os.path.join(EXPORT_DIR, niche_name)
+        self.next_shard = first_shard
+        self.file = None
+        self.path = None
+        self.rows = 0
+        self.paths = []
+
+    def write(self, row):
+        if self.file is None or self.rows >= EXPORT_SHARD_ROWS:
+            self.close()
+            os.makedirs(self.folder, exist_ok=True)
+            self.path = os.path.join(self.folder, f"pins_{self.niche_name}_{self.next_shard:04d}.csv")
+            self.file = open(self.path + ".tmp", "w", newline="", encoding="utf-8")
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(["title", "description", "link", "board", "media_url"])
+            self.next_shard += 1
+            self.rows = 0
+        self.writer.writerow(row)
+        self.rows += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            os.replace(self.path + ".tmp", self.path)
+            self.paths.append(self.path)
+            self.file = None
+
+def export_niche(niche_name, niche_config, now=None):
+    """Export a niche's uploads added since its cursor; returns the shard paths written.
+
+    Rows are streamed from the uploads table in id order. The cursor stops
+    in front of an upload whose CSV row is still pending (younger than
+    EXPORT_SETTLE_SECONDS), so it is picked up by the next export instead
+    of being skipped. Older pending uploads never completed and are skipped.
+    """
+    now = now or time.time()
+    board = niche_config.get("board", "")
+    conn = get_state_db()
+    try:
+        row = conn.execute("SELECT last_id, next_shard FROM export_cursors WHERE niche = ?", (niche_name,)).fetchone()
+        last_id, next_shard = row if row else (0, 1)
+        shards = ExportShards(niche_name, next_shard)
+        try:
+            for upload_id, r2_key, caption, uploaded_at in conn.execute(
+                    "SELECT id, r2_key, caption, uploaded_at FROM uploads WHERE prefix = ? AND id > ? ORDER BY id",
+                    (niche_config['drive_folder'], last_id)):
+                if caption is None:
+                    if now - uploaded_at < EXPORT_SETTLE_SECONDS:
+                        break  # Still in flight
+                    last_id = upload_id
+                    continue
+                media_url = f"{R2_PUBLIC_DOMAIN}/{r2_key}"
+                pin_title, pin_description = format_for_pinterest(caption, media_url)
+                shards.write([pin_title, pin_description, "", board, media_url])
+                last_id = upload_id
+        finally:
+            shards.close()
+        conn.execute(
+            "INSERT OR REPLACE INTO export_cursors (niche, last_id, next_shard) VALUES (?, ?, ?)",
+            (niche_name, last_id, shards.next_shard)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return shards.paths
+
+def run_export(niche_names):
+    """--export: write new Pinterest bulk CSV shards for each niche"""
+    total = 0
+    for niche_name in niche_names:
+        paths = export_niche(niche_name, NICHES[niche_name])
+        if not paths:
+            print(f"{niche_name}: nothing new to export")
+            continue
+        total += len(paths)
+        for path in paths:
+            print(f"✓ {niche_name}: {path}")
+    print(f"\nWrote {total} export files to {EXPORT_DIR}/")
+    return total
+
+
+# --- Run Planner ---
+# Stages whose time scales with bytes moved; the others are charged per video
+PLAN_BYTE_STAGES = ("download", "upload")
+PLAN_VIDEO_STAGES = ("staging_wait", "validate", "strip", "csv_write")
+
+def load_run_history(limit=None):
+    """Sum stage totals over the most recent run summaries in METRICS_DIR"""
+    totals = {}  # stage -> {"count", "seconds", "bytes", "media_seconds"}
+    paths = sorted(glob.glob(os.path.join(METRICS_DIR, "run_*.json")))[-(limit or PLAN_HISTORY_RUNS):]
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for stages in summary.get("stages", {}).values():
+            for stage, entry in stages.items():
+                total = totals.setdefault(stage, {"count": 0, "seconds": 0.0, "bytes": 0, "media_seconds": 0.0})
+                for key in total:
+                    total[key] += entry.get(key, 0)
+    return totals
+
+def plan_estimate(videos, history):
+    """Estimate (bytes, wall_seconds) for [(username, post)] from run history.
+
+    Bytes come from each video's duration times the bytes per video-second
+    seen in past downloads (ESTIMATED_BYTES_PER_SECOND without history).
+    Wall time is None until both download and upload throughput are known.
+    """
+    download = history.get("download", {})
+    if download.get("media_seconds") and download.get("bytes"):
+        bytes_per_media_second = download["bytes"] / download["media_seconds"]
+    else:
+        bytes_per_media_second = ESTIMATED_BYTES_PER_SECOND
+    total_bytes = sum(int(post.video_duration * bytes_per_media_second) if post.video_duration
+                      else DEFAULT_VIDEO_ESTIMATE_BYTES for _, post in videos)
+    
+    seconds = 0.0
+    for stage in PLAN_BYTE_STAGES:
+        entry = history.get(stage, {})
+        if not entry.get("bytes") or not entry.get("seconds"):
+            return total_bytes, None
+        seconds += total_bytes / (entry["bytes"] / entry["seconds"])
+    for stage in PLAN_VIDEO_STAGES:
+        entry = history.get(stage, {})
+        if entry.get("count"):
+            seconds += len(videos) * entry["seconds"] / entry["count"]
+    return total_bytes, seconds / THREADS
+
+def format_duration(seconds):
+    """Render seconds as H:MM:SS"""
+    return str(timedelta(seconds=round(seconds)))
+
+def run_plan(niche_names):
+    """Crawl metadata only and print new videos, bytes and time per niche and profile"""
+    history = load_run_history()
+    plan = {"run_id": RUN_ID, "threads": THREADS, "niches": {}}
+    all_videos = []
+    
+    for niche_name in niche_names:
+        niche_config = NICHES[niche_name]
+        print(f"\nPlanning {niche_name}...")
+        links = read_links(niche_config)
+        if not links:
+            continue
+        videos = collect_new_videos(niche_config, load_processed_posts(niche_config), links, dry_run=True)
+        all_videos.extend(videos)
+        
+        by_profile = {}
+        for username, post in videos:
+            by_profile.setdefault(username, []).append((username, post))
+        niche_bytes, niche_seconds = plan_estimate(videos, history)
+        plan["niches"][niche_name] = {
+            "videos": len(videos), "bytes": niche_bytes, "seconds": niche_seconds,
+            "profiles": {username: {"videos": len(profile_videos),
+                                    "video_seconds": round(sum(post.video_duration or 0 for _, post in profile_videos), 1),
+                                    "bytes": plan_estimate(profile_videos, history)[0]}
+                         for username, profile_videos in by_profile.items()},
+        }
+        
+        print(f"{'Profile':<32}{'Videos':>8}{'Duration':>12}{'Est. MB':>10}")
+        for username, entry in sorted(plan["niches"][niche_name]["profiles"].items()):
+            print(f"@{username:<31}{entry['videos']:>8}{format_duration(entry['video_seconds']):>12}"
+                  f"{entry['bytes'] / (1024 * 1024):>10.1f}")
+        print(f"{niche_name + ' total':<32}{len(videos):>8}{'':>12}{niche_bytes / (1024 * 1024):>10.1f}")
+    
+    total_bytes, total_seconds = plan_estimate(all_videos, history)
+    plan.update({"videos": len(all_videos), "bytes": total_bytes, "seconds": total_seconds})
+    
+    print("\n" + "=" * 60)
+    print(f"PLAN: {len(all_videos)} new videos, ~{total_bytes / (1024 * 1024):.1f} MB")
+    if total_seconds is None:
+        print("Estimated time: unknown (no run history in metrics/ yet)")
+    else:
+        print(f"Estimated time: ~{format_duration(total_seconds)} at {THREADS} thread(s)")
+    print("=" * 60)
+    
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    plan_path = os.path.join(METRICS_DIR, f"plan_{RUN_ID}.json")
+    write_atomic(plan_path, json.dumps(plan, indent=2))
+    print(f"Plan written to {plan_path}")
+    return plan
+
+
+# --- Work Queue ---
+class WorkQueue(ABC):
+    """Shared queue of (niche, username, shortcode) items for --crawl / --worker.
+
+    claim() leases one item to a worker. The worker renews the lease with
+    heartbeat() while it works and finishes with ack() or fail(); an item
+    whose lease runs out goes back to the queue for another worker.
+    """
+    
+    @abstractmethod
+    def enqueue(self, items):
+        """Add (niche, username, shortcode) items; returns how many were new"""
+    
+    @abstractmethod
+    def claim(self, worker_id, lease_seconds=None):
+        """Lease the oldest queued item to worker_id; returns an item dict or None"""
+    
+    @abstractmethod
+    def heartbeat(self, item_id, worker_id, lease_seconds=None):
+        """Extend a lease; returns False if the worker no longer holds it"""
+    
+    @abstractmethod
+    def ack(self, item_id, worker_id):
+        """Mark a leased item as done"""
+    
+    @abstractmethod
+    def fail(self, item_id, worker_id, error):
+        """Give up on a leased item for good"""
+    
+    @abstractmethod
+    def release(self, item_id, worker_id, error):
+        """Hand a leased item back to the queue (failed once it used up its attempts)"""
+    
+    @abstractmethod
+    def counts(self, niche=None):
+        """Return {state: count} for the whole queue or one niche"""
+
+class SQLiteWorkQueue(WorkQueue):
+    """WorkQueue backed by a SQLite file, local or on shared storage.
+
+    Every state change runs in a BEGIN IMMEDIATE transaction, so claims from
+    different processes never hand out the same item. The default rollback
+    journal is kept on purpose: WAL mode does not work on network filesystems.
+    """
+    
+    def __init__(self, path=None):
+        self.path = path or WORK_QUEUE_DB
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS work_items ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "niche TEXT NOT NULL, username TEXT NOT NULL, shortcode TEXT NOT NULL, "
+                "state TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0, "
+                "lease_owner TEXT, lease_expires REAL, last_error TEXT, updated_at REAL, "
+                "UNIQUE (niche, shortcode))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS work_items_state ON work_items (state, lease_expires)")
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+    
+    def _update(self, sql, params):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            changed = conn.execute(sql, params).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        return changed == 1
+    
+    def enqueue(self, items):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO work_items (niche, username, shortcode, updated_at) VALUES (?, ?, ?, ?)",
+                [(niche, username, shortcode, time.time()) for niche, username, shortcode in items]
+            )
+            added = conn.total_changes - before
+            conn.commit()
+        finally:
+            conn.close()
+        return added
+    
+    def claim(self, worker_id, lease_seconds=None):
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            # Re-queue expired leases; an item that keeps losing its lease (crashing its worker) is given up
+            conn.execute(
+                "UPDATE work_items SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                "last_error = 'lease expired', lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE state = 'leased' AND lease_expires < ?",
+                (WORK_QUEUE_MAX_ATTEMPTS, now, now)
+            )
+            row = conn.execute(
+                "SELECT id, niche, username, shortcode, attempts FROM work_items "
+                "WHERE state = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE work_items SET state = 'leased', lease_owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (worker_id, now + (lease_seconds or WORK_QUEUE_LEASE_SECONDS), now, row[0])
+                )
+            conn.commit()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return {"id": row[0], "niche": row[1], "username": row[2], "shortcode": row[3], "attempts": row[4] + 1}
+    
+    def heartbeat(self, item_id, worker_id, lease_seconds=None):
+        return self._update(
+            "UPDATE work_items SET lease_expires = ?, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+            (time.time() + (lease_seconds or WORK_QUEUE_LEASE_SECONDS), time.time(), item_id, worker_id)
+        )
+    
+    def ack(self, item_id, worker_id):
+        return self._update(
+            "UPDATE work_items SET state = 'done', lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ?",
+            (time.time(), item_id, worker_id)
+        )
+    
+    def fail(self, item_id, worker_id, error):
+        return self._update(
+            "UPDATE work_items SET state = 'failed', last_error = ?, lease_owner = NULL, lease_expires = NULL, "
+            "updated_at = ? WHERE id = ? AND lease_owner = ?",
+            (str(error), time.time(), item_id, worker_id)
+        )
+    
+    def release(self, item_id, worker_id, error):
+        return self._update(
+            "UPDATE work_items SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+            "last_error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ?",
+            (WORK_QUEUE_MAX_ATTEMPTS, str(error), time.time(), item_id, worker_id)
+        )
+    
+    def counts(self, niche=None):
+        conn = self._connect()
+        try:
+            if niche is None:
+                rows = conn.execute("SELECT state, COUNT(*) FROM work_items GROUP BY state").fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT state, COUNT(*) FROM work_items WHERE niche = ? GROUP BY state", (niche,)
+                ).fetchall()
+        finally:
+            conn.close()
+        return dict(rows)
+
+# Register other backends (e.g. a Redis or Postgres queue) here
+WORK_QUEUE_BACKENDS = {
+    "sqlite": SQLiteWorkQueue,
+}
+
+def open_work_queue():
+    """Return the configured WorkQueue backend"""
+    return WORK_QUEUE_BACKENDS[WORK_QUEUE_BACKEND]()
+
+def run_crawl(niche_names):
+    """Crawl the given niches and enqueue every new video for --worker processes"""
+    queue = open_work_queue()
+    total = 0
+    for niche_name in niche_names:
+        niche_config = NICHES[niche_name]
+        print(f"\nCrawling {niche_name}...")
+        links = read_links(niche_config)
+        if not links:
+            continue
+        processed_posts = prepare_niche(niche_config)
+        all_videos = collect_new_videos(niche_config, processed_posts, links)
+        # Workers claim in queue order, so enqueue the most valuable videos first
+        all_videos = prioritize_videos(all_videos, niche_config)
+        added = queue.enqueue([(niche_name, username, post.shortcode) for username, post in all_videos])
+        total += added
+        print(f"✓ Queued {added} new videos for {niche_name} ({len(all_videos) - added} already queued)")
+    print(f"\nQueue: {queue.counts()}")
+    export_metrics()
+    return total
+
+@contextmanager
+def keep_lease(queue, item, worker_id):
+    """Renew the item's lease from a background thread while the body runs"""
+    stop = threading.Event()
+    
+    def beat():
+        while not stop.wait(WORK_QUEUE_HEARTBEAT_SECONDS):
+            if not queue.heartbeat(item["id"], worker_id):
+                print(f"⚠ Lost lease on {item['niche']}/{item['shortcode']}")
+                return
+    
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+def work_loop(queue, worker_id, niche_posts):
+    """Claim, process and ack items until the queue stays empty; returns items handled"""
+    handled = 0
+    idle_since = time.monotonic()
+    while True:
+        item = queue.claim(worker_id)
+        if item is None:
+            if WORK_QUEUE_IDLE_EXIT_SECONDS and time.monotonic() - idle_since >= WORK_QUEUE_IDLE_EXIT_SECONDS:
+                return handled
+            time.sleep(WORK_QUEUE_POLL_SECONDS)
+            continue
+        
+        idle_since = time.monotonic()
+        handled += 1
+        niche_config = NICHES.get(item["niche"])
+        if niche_config is None:
+            queue.fail(item["id"], worker_id, f"Unknown niche: {item['niche']}")
+            continue
+        
+        with keep_lease(queue, item, worker_id):
+            session = SESSION_POOL.acquire()
+            try:
+                post = instaloader.Post.from_shortcode(session.loader.context, item["shortcode"])
+            except Exception as e:
+                SESSION_POOL.report_error(session, e)
+                print(f"Error fetching post {item['shortcode']}: {e}")
+                queue.release(item["id"], worker_id, e)
+                continue
+            
+            # process_post counts the item down from the niche's queue depth
+            METRICS.set_gauge("pending", niche_config['drive_folder'], queue.counts(item["niche"]).get("queued", 0) + 1)
+            ok = process_post((item["username"], post), niche_config, niche_posts(item["niche"]))
+        
+        if ok:
+            queue.ack(item["id"], worker_id)
+        else:
+            queue.fail(item["id"], worker_id, f"Failed after {RETRIES} attempts (see {niche_config['failed_file']})")
+        export_metrics()
+
+def run_worker():
+    """Process queued items with THREADS claim loops until the queue is drained"""
+    queue = open_work_queue()
+    node_id = f"{socket.gethostname()}:{os.getpid()}"
+    processed = {}
+    processed_lock = threading.Lock()
+    
+    def niche_posts(niche_name):
+        # Tracking files are prepared and numbering seeded once per niche per process
+        with processed_lock:
+            if niche_name not in processed:
+                niche_config = NICHES[niche_name]
+                processed[niche_name] = prepare_niche(niche_config)
+                seed_niche_numbers(niche_config, load_r2_index(niche_config)[0])
+            return processed[niche_name]
+    
+    print(f"Worker {node_id} started ({THREADS} thread(s)), queue: {queue.counts()}")
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        handled = sum(executor.map(
+            lambda i: profiled(work_loop, queue, f"{node_id}:{i}", niche_posts), range(THREADS)))
+    print(f"\nWorker {node_id} finished: {handled} items, queue: {queue.counts()}")
+    export_metrics()
+    return handled
+
+
+# --- Profiling ---
+PROFILE_DIR = "profiles"
+PROFILE_TOP_N = 25
+
+# Entry function of each stage, used to split the profile by stage
+PROFILE_STAGE_FUNCTIONS = {
+    "profile_fetch": "get_posts",
+    "resolve": "resolve_post",
+    "download": "iter_media",
+    "validate": "validate_mp4",
+    "strip": "strip_metadata",
+    "reuse": "reuse_upload",
+    "upload": "upload_to_r2",
+    "csv_write": "write_csv_row",
+}
+
+PROFILING = False
+_profilers = []  # One cProfile.Profile per profiled thread
+_profilers_lock = threading.Lock()
+_profiling_thread = threading.local()  # .active is set while this thread's profiler runs
+
+def profiled(func, *args):
+    """Run func under its own profiler when --profile is active (cProfile is per-thread).
+
+    Calls nested on a thread that is already profiled (e.g. process_post
+    with THREADS = 1) run as they are: only one profiler can be active per
+    thread, and the outer one already records them.
+    """
+    if not PROFILING or getattr(_profiling_thread, "active", False):
+        return func(*args)
+    profiler = cProfile.Profile()
+    with _profilers_lock:
+        _profilers.append(profiler)
+    _profiling_thread.active = True
+    profiler.enable()
+    try:
+        return func(*args)
+    finally:
+        profiler.disable()
+        _profiling_thread.active = False
+
+def write_profile_report(name):
+    """Dump the merged profile and a top-N summary split by stage"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    dump_path = os.path.join(PROFILE_DIR, f"{name}_{RUN_ID}.prof")
+    summary_path = os.path.join(PROFILE_DIR, f"{name}_{RUN_ID}_summary.txt")
+    
+    with _profilers_lock:
+        stats = pstats.Stats(_profilers[0])
+        for profiler in _profilers[1:]:
+            stats.add(profiler)
+    stats.dump_stats(dump_path)
+    
+    out = io.StringIO()
+    out.write(f"PROFILE SUMMARY: {name} (run {RUN_ID})\n\n")
+    
+    # Wall vs CPU per stage from the metrics collector (wait = network/ffmpeg)
+    out.write(f"{'Stage':<24}{'Calls':>8}{'Wall s':>12}{'CPU s':>12}{'Wait s':>12}\n")
+    for folder, stages in sorted(METRICS.summary()["stages"].items()):
+        for stage, entry in sorted(stages.items()):
+            out.write(f"{folder + '/' + stage:<24}{entry['count']:>8}{entry['seconds']:>12.3f}"
+                      f"{entry['cpu_seconds']:>12.3f}{entry['wait_seconds']:>12.3f}\n")
+    
+    out.write(f"\n=== Top {PROFILE_TOP_N} functions by own time ===\n")
+    stats.stream = out
+    stats.sort_stats("tottime").print_stats(PROFILE_TOP_N)
+    out.write(f"\n=== Top {PROFILE_TOP_N} functions by cumulative time ===\n")
+    stats.sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+    for stage, function_name in PROFILE_STAGE_FUNCTIONS.items():
+        out.write(f"\n=== Stage {stage}: callees of {function_name} ===\n")
+        stats.print_callees(rf"\({function_name}\)")
+    
+    write_atomic(summary_path, out.getvalue())
+    print(f"\nProfile written to {dump_path}")
+    print(f"Hot-function summary written to {summary_path}")
+
+def run_profiled(name, func, *args):
+    """Run func with profiling enabled in this thread and all worker threads"""
+    global PROFILING
+    PROFILING = True
+    try:
+        return profiled(func, *args)
+    finally:
+        PROFILING = False
+        write_profile_report(name)
+
+
 # --- Main Entry Point ---
 if __name__ == "__main__":
     import sys
     
+    args = [arg.lower() for arg in sys.argv[1:]]
+    
+    # --profile can be combined with any run mode
+    profile = "--profile" in args
+    if profile:
+        args.remove("--profile")
+    
+    # --budget=N|500mb|45m caps each niche of this run
+    for arg in list(args):
+        if arg.startswith("--budget="):
+            args.remove(arg)
+            try:
+                RUN_BUDGET = parse_budget(arg.split("=", 1)[1])
+            except ValueError as e:
+                print(e)
+                sys.exit(1)
+    
+    def run(name, func, *func_args):
+        return run_profiled(name, func, *func_args) if profile else func(*func_args)
+    
+    if not args or not (args[0] == "--help" or args[0].startswith(("--export", "--compact-csv"))):
+        instagram_login()
+    
     # Check for command line arguments
-    if len(sys.argv) > 1:
-        arg = sys.argv[1].lower()
+    if args:
+        arg = args[0]
         
         if arg == "--no-delay":
             # Process all niches without delay (for testing)
             print("Running without delay between niches...")
-            run_all_niches(with_delay=False)
+            run("all_niches", run_all_niches, False)
         
         elif arg.startswith("--niche="):
             # Process single niche: python main.py --niche=niche1
             niche_name = arg.split("=")[1]
             if niche_name in NICHES:
-                process_niche(niche_name, NICHES[niche_name])
+                run(niche_name, process_niche, niche_name, NICHES[niche_name])
+            else:
+                print(f"Unknown niche: {niche_name}")
+                print(f"Available niches: {', '.join(NICHES.keys())}")
+        
+        elif arg == "--daemon":
+            # Keep polling every profile on its own adaptive schedule
+            run("daemon", run_daemon)
+        
+        elif arg == "--plan" or arg.startswith("--plan="):
+            # Dry run: list and size new videos without downloading
+            niche_name = arg.split("=")[1] if "=" in arg else None
+            if niche_name is None or niche_name in NICHES:
+                run("plan", run_plan, [niche_name] if niche_name else list(NICHES))
+            else:
+                print(f"Unknown niche: {niche_name}")
+                print(f"Available niches: {', '.join(NICHES.keys())}")
+        
+        elif arg == "--retry-failed" or arg.startswith("--retry-failed="):
+            # Reprocess failed posts by shortcode: python main.py --retry-failed[=niche1]
+            niche_name = arg.split("=")[1] if "=" in arg else None
+            if niche_name is None or niche_name in NICHES:
+                run("retry_failed", run_retry_failed, [niche_name] if niche_name else list(NICHES))
+            else:
+                print(f"Unknown niche: {niche_name}")
+                print(f"Available niches: {', '.join(NICHES.keys())}")
+        
+        elif arg == "--crawl" or arg.startswith("--crawl="):
+            # Enqueue new videos for workers: python main.py --crawl[=niche1]
+            niche_name = arg.split("=")[1] if "=" in arg else None
+            if niche_name is None or niche_name in NICHES:
+                run("crawl", run_crawl, [niche_name] if niche_name else list(NICHES))
+            else:
+                print(f"Unknown niche: {niche_name}")
+                print(f"Available niches: {', '.join(NICHES.keys())}")
+        
+        elif arg == "--worker":
+            # Claim and process queued videos (run on as many machines as you like)
+            run("worker", run_worker)
+        
+        elif arg == "--export" or arg.startswith("--export="):
+            # Pinterest bulk CSVs from the state DB: python main.py --export[=niche1]
+            niche_name = arg.split("=")[1] if "=" in arg else None
+            if niche_name is None or niche_name in NICHES:
+                run("export", run_export, [niche_name] if niche_name else list(NICHES))
+            else:
+                print(f"Unknown niche: {niche_name}")
+                print(f"Available niches: {', '.join(NICHES.keys())}")
+        
+        elif arg == "--compact-csv" or arg.startswith("--compact-csv="):
+            # Drop replaced/deleted rows from the niche CSVs: python main.py --compact-csv[=niche1]
+            niche_name = arg.split("=")[1] if "=" in arg else None
+            if niche_name is None or niche_name in NICHES:
+                run("compact_csv", run_compact_csv, [niche_name] if niche_name else list(NICHES))
             else:
                 print(f"Unknown niche: {niche_name}")
                 print(f"Available niches: {', '.join(NICHES.keys())}")
@@ -517,6 +3329,15 @@ if __name__ == "__main__":
             print("  python main.py              - Process all niches with 1-hour delay")
             print("  python main.py --no-delay   - Process all niches without delay")
             print("  python main.py --niche=X    - Process single niche (niche1-niche5)")
+            print("  python main.py --daemon     - Keep running, polling each profile as often as it posts")
+            print("  python main.py --plan       - Dry run: new videos, size and time per niche (--plan=X for one)")
+            print("  python main.py --retry-failed - Retry the posts in the failed logs (--retry-failed=X for one)")
+            print("  python main.py --crawl      - Crawl all niches and queue new videos (--crawl=X for one)")
+            print("  python main.py --worker     - Claim and process queued videos until the queue is empty")
+            print("  python main.py --export     - Write Pinterest bulk CSVs of uploads since the last export (--export=X for one)")
+            print("  python main.py --compact-csv - Remove replaced/deleted rows from the niche CSVs (--compact-csv=X for one)")
+            print("  python main.py --budget=N   - Add to a run: cap each niche at N videos, 500mb/2gb or 45m/2h")
+            print("  python main.py --profile    - Add to any mode to write a profile to profiles/")
             print("  python main.py --help       - Show this help")
         
         else:
@@ -525,4 +3346,4 @@ if __name__ == "__main__":
     
     else:
         # Default: process all niches with delay
-        run_all_niches(with_delay=True)
+        run("all_niches", run_all_niches, True)
@@ -7,12 +7,15 @@ import unittest
 from unittest.mock import Mock, patch, MagicMock, mock_open
 import os
 import csv
+import io
 import tempfile
 import shutil
 import glob
 import re
 import unicodedata
 
+import main
+
 
 class TestUploadToR2(unittest.TestCase):
     """Tests for upload_to_r2 function logic (Cloudflare R2 via boto3)"""
@@ -1141,25 +1144,20 @@ class TestNicheScheduling(unittest.TestCase):
         self.assertEqual(niche_list, expected_order)
         print("✓ Test niche_order_preserved passed")
 
-    def test_video_counter_reset_per_niche(self):
-        """Test that video counter resets for each niche"""
-        video_counter = 0
+    def test_video_counter_independent_per_niche(self):
+        """Test that each niche (R2 prefix) has its own numbering sequence"""
+        counters = {}
         
-        # Simulate niche 1
-        video_counter = 0  # Reset
-        for _ in range(3):
-            video_counter += 1
-        niche1_final = video_counter
+        def get_next_video_number(prefix):
+            counters[prefix] = counters.get(prefix, 0) + 1
+            return counters[prefix]
         
-        # Simulate niche 2 (counter resets)
-        video_counter = 0  # Reset
-        for _ in range(2):
-            video_counter += 1
-        niche2_final = video_counter
+        niche1 = [get_next_video_number("niche1_reels") for _ in range(3)]
+        niche2 = [get_next_video_number("niche2_reels") for _ in range(2)]
         
-        self.assertEqual(niche1_final, 3)
-        self.assertEqual(niche2_final, 2)
-        print("✓ Test video_counter_reset_per_niche passed")
+        self.assertEqual(niche1, [1, 2, 3])
+        self.assertEqual(niche2, [1, 2])
+        print("✓ Test video_counter_independent_per_niche passed")
 
 
 class TestNicheR2Folders(unittest.TestCase):
@@ -1207,6 +1205,1921 @@ class TestNicheR2Folders(unittest.TestCase):
         print("✓ Test r2_full_key_path passed")
 
 
+class TestR2ExistenceIndex(unittest.TestCase):
+    """Tests for the startup R2 listing used for crash recovery"""
+
+    def test_index_built_from_paginated_listing(self):
+        """Test that every page of ListObjectsV2 is folded into one index"""
+        pages = [
+            {"Contents": [{"Key": "niche1_reels/001_user_one_ABC123.mp4"},
+                          {"Key": "niche1_reels/002_user_one_DEF456.mp4"}]},
+            {"Contents": [{"Key": "niche1_reels/003_other.user_G_H-I.mp4"},
+                          {"Key": "niche1_reels/notes.txt"}]},
+            {},  # Empty page (no Contents key)
+        ]
+        client = MagicMock()
+        client.get_paginator.return_value.paginate.return_value = pages
+        
+        with patch.object(main, "get_r2_client", return_value=client):
+            index = main.build_r2_index("niche1_reels")
+        
+        client.get_paginator.return_value.paginate.assert_called_once_with(
+            Bucket=main.R2_BUCKET_NAME, Prefix="niche1_reels/")
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index["user_one_ABC123"], "niche1_reels/001_user_one_ABC123.mp4")
+        self.assertEqual(index["other.user_G_H-I"], "niche1_reels/003_other.user_G_H-I.mp4")
+        print("✓ Test index_built_from_paginated_listing passed")
+
+    def test_lookup_uses_username_and_shortcode(self):
+        """Test that the index key is username + shortcode, not a bare shortcode"""
+        self.assertEqual(main.parse_r2_filename("001_user_one_ABC123.mp4"), (1, "user_one_ABC123"))
+        print("✓ Test lookup_uses_username_and_shortcode passed")
+
+    def test_recovered_video_number_from_key(self):
+        """Test that the original video number is recovered from the R2 filename"""
+        filename = os.path.basename("niche2_reels/042_cooluser_XYZ789.mp4")
+        
+        self.assertEqual(main.parse_r2_filename(filename)[0], 42)
+        self.assertIsNone(main.parse_r2_filename("notes.txt"))
+        print("✓ Test recovered_video_number_from_key passed")
+
+
+class TestPersistentVideoNumbers(unittest.TestCase):
+    """Tests for the block-based video number allocator backed by SQLite"""
+
+    def setUp(self):
+        """Set up a temporary state DB and an empty block cache"""
+        self.test_dir = tempfile.mkdtemp()
+        self.patches = [
+            patch.object(main, "STATE_DB", os.path.join(self.test_dir, "pipeline_state.db")),
+            patch.object(main, "_number_blocks", {}),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        """Clean up test fixtures"""
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_numbers_continue_across_restarts(self):
+        """Test that a new run continues after the previous run's block"""
+        first_run = main.reserve_video_numbers("niche1_reels", 10)
+        second_run = main.reserve_video_numbers("niche1_reels", 10)
+        
+        self.assertEqual(first_run, (1, 11))
+        self.assertEqual(second_run, (11, 21))
+        print("✓ Test numbers_continue_across_restarts passed")
+
+    def test_floor_skips_existing_numbers(self):
+        """Test that seeding from existing CSV/R2 numbers avoids reusing prefixes"""
+        main.seed_video_numbers("niche2_reels", 42)
+        start, _ = main.reserve_video_numbers("niche2_reels", 10)
+        
+        self.assertEqual(start, 43)
+        print("✓ Test floor_skips_existing_numbers passed")
+
+    def test_seeding_drops_stale_cached_block(self):
+        """Test that a block reserved before existing uploads were seen is not used"""
+        self.assertEqual(main.get_next_video_number("niche1_reels"), 1)
+        
+        main.seed_video_numbers("niche1_reels", 30)
+        
+        self.assertEqual(main.get_next_video_number("niche1_reels"), 31)
+        print("✓ Test seeding_drops_stale_cached_block passed")
+
+    def test_seeding_keeps_block_above_floor(self):
+        """Test that a cached block already past the floor keeps being used"""
+        main.seed_video_numbers("niche1_reels", 30)
+        self.assertEqual(main.get_next_video_number("niche1_reels"), 31)
+        
+        main.seed_video_numbers("niche1_reels", 10)
+        
+        self.assertEqual(main.get_next_video_number("niche1_reels"), 32)
+        print("✓ Test seeding_keeps_block_above_floor passed")
+
+    def test_collect_new_videos_seeds_before_crawl(self):
+        """Test that numbering is seeded from R2 before any profile is crawled"""
+        niche_config = {
+            "output_csv": os.path.join(self.test_dir, "reels_niche1.csv"),
+            "drive_folder": "niche1_reels",
+        }
+        r2_index = {"user1_ABC123": "niche1_reels/0007_user1_ABC123.mp4"}
+        numbers_during_crawl = []
+        
+        def fake_crawl(*args, **kwargs):
+            numbers_during_crawl.append(main.get_next_video_number("niche1_reels"))
+            return [], [], 0
+        
+        with patch.object(main, "load_r2_index", return_value=(r2_index, set())), \
+             patch.object(main, "crawl_profile", side_effect=fake_crawl), \
+             patch.object(main, "SESSION_POOL"):
+            main.collect_new_videos(niche_config, set(), ["https://instagram.com/user1/"])
+        
+        self.assertEqual(numbers_during_crawl, [8])
+        print("✓ Test collect_new_videos_seeds_before_crawl passed")
+
+    def test_schema_created_once_per_db(self):
+        """Test that tables are created on the first connection only, per STATE_DB path"""
+        with patch.object(main, "create_state_tables", wraps=main.create_state_tables) as create:
+            main.get_state_db().close()
+            main.get_state_db().close()
+            self.assertEqual(create.call_count, 1)
+            
+            with patch.object(main, "STATE_DB", os.path.join(self.test_dir, "other_state.db")):
+                main.reserve_video_numbers("niche1_reels", 1)
+            self.assertEqual(create.call_count, 2)
+        print("✓ Test schema_created_once_per_db passed")
+
+    def test_parallel_workers_get_unique_numbers(self):
+        """Test that concurrent block reservations never overlap"""
+        import threading
+        main.reserve_video_numbers("niche1_reels", 0)  # Create the table before workers start
+        numbers = []
+        numbers_lock = threading.Lock()
+        
+        def worker():
+            for _ in range(5):
+                start, end = main.reserve_video_numbers("niche1_reels", 10)
+                with numbers_lock:
+                    numbers.extend(range(start, end))
+        
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        self.assertEqual(len(numbers), 200)
+        self.assertEqual(len(set(numbers)), 200)
+        print("✓ Test parallel_workers_get_unique_numbers passed")
+
+
+class TestStageMetrics(unittest.TestCase):
+    """Tests for per-stage metrics and their Prometheus/JSON export"""
+
+    def setUp(self):
+        """Set up a fresh metrics collector"""
+        self.metrics = main.RunMetrics()
+
+    def test_histogram_bucket_counts(self):
+        """Test that an observation lands in every bucket whose bound it fits"""
+        with patch.object(main, "STAGE_BUCKETS", (0.1, 0.5, 1, 2.5, 5)):
+            for seconds in (0.05, 0.7, 3.0):
+                self.metrics.observe("download", "niche1_reels", seconds)
+        
+        # Cumulative buckets, as Prometheus expects
+        self.assertEqual(self.metrics.stages[("niche1_reels", "download")]["buckets"], [1, 1, 2, 2, 3])
+        print("✓ Test histogram_bucket_counts passed")
+
+    def test_error_counter_labels_use_error_class(self):
+        """Test that retry/failure counters are keyed by the exception class name"""
+        for error in (TimeoutError("slow"), TimeoutError("slower"), FileNotFoundError("gone")):
+            self.metrics.count_error("retries", "niche1_reels", "download", error)
+        
+        retries = self.metrics.summary()["retries"]["niche1_reels"]
+        self.assertEqual(retries, {"download:TimeoutError": 2, "download:FileNotFoundError": 1})
+        print("✓ Test error_counter_labels_use_error_class passed")
+
+    def test_prometheus_line_format(self):
+        """Test the Prometheus exposition line for a stage byte counter"""
+        self.metrics.observe("upload", "niche1_reels", 1.0, nbytes=1048576)
+        self.metrics.set_gauge("pending", "niche1_reels", 3)
+        
+        lines = self.metrics.prometheus_text().splitlines()
+        self.assertIn('instatodrive_stage_bytes_total{folder="niche1_reels",stage="upload"} 1048576', lines)
+        self.assertIn('instatodrive_stage_seconds_count{folder="niche1_reels",stage="upload"} 1', lines)
+        self.assertIn('instatodrive_queue_depth{folder="niche1_reels",queue="pending"} 3', lines)
+        print("✓ Test prometheus_line_format passed")
+
+    def test_bytes_per_second_summary(self):
+        """Test throughput calculation in the JSON summary"""
+        self.metrics.observe("download", "niche1_reels", 4.0, nbytes=8_000_000)
+        
+        entry = self.metrics.summary()["stages"]["niche1_reels"]["download"]
+        self.assertEqual(entry["bytes_per_second"], 2_000_000)
+        print("✓ Test bytes_per_second_summary passed")
+
+
+class TestProfilingMode(unittest.TestCase):
+    """Tests for the --profile run mode"""
+
+    def test_wait_time_separated_from_cpu(self):
+        """Test that stage wait time is wall time minus CPU time, never negative"""
+        metrics = main.RunMetrics()
+        metrics.observe("download", "niche1_reels", 2.0, cpu_seconds=0.5)
+        metrics.observe("strip", "niche1_reels", 0.1, cpu_seconds=0.2)
+        
+        stages = metrics.summary()["stages"]["niche1_reels"]
+        self.assertEqual(stages["download"]["wait_seconds"], 1.5)
+        self.assertEqual(stages["strip"]["wait_seconds"], 0.0)
+        print("✓ Test wait_time_separated_from_cpu passed")
+
+    def test_profiled_is_passthrough_when_off(self):
+        """Test that nothing is profiled outside --profile"""
+        with patch.object(main, "_profilers", []) as profilers:
+            self.assertEqual(main.profiled(sorted, [3, 1, 2]), [1, 2, 3])
+            self.assertEqual(profilers, [])
+        print("✓ Test profiled_is_passthrough_when_off passed")
+
+    def test_sequential_videos_keep_one_profiler(self):
+        """Test that process_post nested in a profiled niche on the same thread is still recorded"""
+        import pstats
+        test_dir = tempfile.mkdtemp()
+        videos = [("user", Mock(shortcode=f"SC{i}")) for i in range(3)]
+        
+        def fake_process_post(video_args, niche_config, processed_posts):
+            sorted(range(100))
+            return True
+        
+        try:
+            with patch.object(main, "_profilers", []) as profilers, \
+                 patch.object(main, "PROFILE_DIR", test_dir), \
+                 patch.object(main, "METRICS", main.RunMetrics()), \
+                 patch.object(main, "THREADS", 1), \
+                 patch.object(main, "process_post", side_effect=fake_process_post):
+                results = main.run_profiled("niche1", main.process_videos,
+                                            {"drive_folder": "niche1_reels"}, set(), videos)
+                stats = pstats.Stats(profilers[0])
+        finally:
+            shutil.rmtree(test_dir, ignore_errors=True)
+        
+        self.assertEqual(results, [True, True, True])
+        self.assertEqual(len(profilers), 1)
+        sorted_calls = [v[1] for k, v in stats.stats.items() if k[2] == "<built-in method builtins.sorted>"]
+        self.assertEqual(sorted_calls, [3])  # Every video, not just the first
+        print("✓ Test sequential_videos_keep_one_profiler passed")
+
+    def test_profiles_from_threads_are_merged(self):
+        """Test that per-thread profiles merge into one report"""
+        import threading
+        test_dir = tempfile.mkdtemp()
+        try:
+            def crawl():
+                threads = [threading.Thread(target=main.profiled, args=(sorted, range(1000)))
+                           for _ in range(3)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+            
+            with patch.object(main, "_profilers", []) as profilers, \
+                 patch.object(main, "PROFILE_DIR", test_dir), \
+                 patch.object(main, "METRICS", main.RunMetrics()):
+                main.run_profiled("crawl", crawl)
+            
+            self.assertEqual(len(profilers), 4)  # The calling thread plus three workers
+            self.assertFalse(main.PROFILING)
+            summary = os.path.join(test_dir, f"crawl_{main.RUN_ID}_summary.txt")
+            with open(summary, "r") as f:
+                self.assertIn(f"Top {main.PROFILE_TOP_N} functions by own time", f.read())
+            self.assertTrue(os.path.exists(os.path.join(test_dir, f"crawl_{main.RUN_ID}.prof")))
+        finally:
+            shutil.rmtree(test_dir, ignore_errors=True)
+        print("✓ Test profiles_from_threads_are_merged passed")
+
+
+def make_strippable_mp4(mdat_first=False, payload=b"PAYLOAD!" * 10):
+    """ftyp, moov (with a udta box) and mdat, the single chunk offset pointing at the payload"""
+    import struct
+    from bench_pipeline import mp4_box
+    ftyp = mp4_box(b"ftyp", b"isomisom")
+    
+    def moov(offset):
+        stco = mp4_box(b"stco", struct.pack(">III", 0, 1, offset))
+        trak = mp4_box(b"trak", mp4_box(b"mdia", mp4_box(b"minf", mp4_box(b"stbl", stco))))
+        return mp4_box(b"moov", trak + mp4_box(b"udta", b"x" * 100))
+    
+    mdat = mp4_box(b"mdat", payload)
+    if mdat_first:
+        return ftyp + mdat + moov(len(ftyp) + 8)
+    return ftyp + moov(len(ftyp) + len(moov(0)) + 8) + mdat
+
+
+def mp4_chunk_offset(data):
+    """First stco entry of an MP4 built by make_strippable_mp4"""
+    import struct
+    return struct.unpack_from(">I", data, data.index(b"stco") + 12)[0]
+
+
+class TestInMemoryStaging(unittest.TestCase):
+    """Tests for in-memory staging (RAM buffer with spill to disk)"""
+
+    def setUp(self):
+        """Set up a temporary staging folder"""
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Clean up test fixtures"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_spill_when_file_too_large(self):
+        """Test that a download larger than the spill size moves to disk"""
+        spill_path = os.path.join(self.test_dir, "ABC123.mp4")
+        with patch.object(main, "MEMORY_SPILL_BYTES", 10), \
+             patch.object(main, "MEMORY_BUDGET", main.ByteBudget(100)) as budget:
+            staged = main.StagedVideo(spill_path)
+            for chunk in (b"abcd", b"efgh", b"ijkl"):
+                staged.write(chunk)
+            staged.finish()
+            
+            self.assertFalse(staged.in_memory)
+            self.assertEqual(budget.used, 0)  # RAM given back once spilled
+        with open(spill_path, "rb") as f:
+            self.assertEqual(f.read(), b"abcdefghijkl")
+        print("✓ Test spill_when_file_too_large passed")
+
+    def test_global_memory_cap_shared_by_workers(self):
+        """Test that a worker spills once the global cap is taken by others"""
+        with patch.object(main, "MEMORY_SPILL_BYTES", 100), \
+             patch.object(main, "MEMORY_BUDGET", main.ByteBudget(100)) as budget:
+            first = main.StagedVideo(os.path.join(self.test_dir, "FIRST.mp4"))
+            second = main.StagedVideo(os.path.join(self.test_dir, "SECOND.mp4"))
+            first.write(b"x" * 60)
+            second.write(b"y" * 60)  # Worker 2 must spill
+            second.finish()
+            
+            self.assertTrue(first.in_memory)
+            self.assertFalse(second.in_memory)
+            self.assertEqual(budget.used, 60)
+            first.release_memory()
+        print("✓ Test global_memory_cap_shared_by_workers passed")
+
+    def test_chunk_offsets_follow_moved_mdat(self):
+        """Test that stco entries shift by how far mdat moved after removing udta"""
+        data = make_strippable_mp4()
+        
+        stripped = main.strip_metadata_in_memory(data)
+        
+        self.assertNotIn(b"udta", stripped)
+        self.assertEqual(len(stripped), len(data) - 108)
+        offset = mp4_chunk_offset(stripped)
+        self.assertEqual(stripped[offset:offset + 8], b"PAYLOAD!")
+        print("✓ Test chunk_offsets_follow_moved_mdat passed")
+
+    def test_unsupported_input_falls_back(self):
+        """Test that non-MP4 data returns None so FFmpeg handles it on disk"""
+        self.assertIsNone(main.strip_metadata_in_memory(b"<html>not a video</html>"))
+        print("✓ Test unsupported_input_falls_back passed")
+
+    def test_validation_failure_labelled_validate(self):
+        """Test that a buffer failing validation is counted as a validate error, not download"""
+        def staged_html(post, target_folder, drive_folder):
+            staged = main.StagedVideo(os.path.join(target_folder, post.shortcode + ".mp4"))
+            staged.write(b"<html>not a video</html>")
+            staged.finish()
+            return staged
+        niche_config = {
+            "output_csv": os.path.join(self.test_dir, "reels_niche1.csv"),
+            "processed_file": os.path.join(self.test_dir, "processed_niche1.txt"),
+            "failed_file": os.path.join(self.test_dir, "failed_niche1.txt"),
+            "drive_folder": os.path.join(self.test_dir, "niche1_reels"),
+        }
+        metrics = main.RunMetrics()
+
+        with patch.object(main, "STATE_DB", os.path.join(self.test_dir, "pipeline_state.db")), \
+             patch.object(main, "_number_blocks", {}), \
+             patch.object(main, "IN_MEMORY_STAGING", True), \
+             patch.object(main, "CROSS_NICHE_REUSE", None), \
+             patch.object(main, "RETRIES", 1), \
+             patch.object(main, "METRICS", metrics), \
+             patch.object(main, "download_to_staging", side_effect=staged_html):
+            self.assertFalse(main.process_post(("u", Mock(shortcode="SC1", video_duration=0.0)), niche_config, set()))
+
+        failures = metrics.summary()["failures"][niche_config["drive_folder"]]
+        self.assertEqual(failures, {"validate:InvalidVideoError": 1})
+        print("✓ Test validation_failure_labelled_validate passed")
+
+
+class TestStagingBackpressure(unittest.TestCase):
+    """Tests for the staging disk budget and orphan sweep"""
+
+    def setUp(self):
+        """Set up a temporary staging folder"""
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Clean up test fixtures"""
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_download_blocks_until_budget_released(self):
+        """Test that a worker waits for another worker to free staging bytes"""
+        import threading
+        budget = main.ByteBudget(100)
+        self.assertTrue(budget.acquire(80))
+        acquired = []
+        
+        worker = threading.Thread(target=lambda: acquired.append(budget.acquire(50, timeout=5)))
+        worker.start()
+        worker.join(timeout=0.2)
+        self.assertEqual(acquired, [])  # Still blocked
+        
+        budget.release(80)  # First worker finished uploading
+        worker.join(timeout=5)
+        
+        self.assertEqual(acquired, [True])
+        self.assertEqual(budget.used, 50)
+        print("✓ Test download_blocks_until_budget_released passed")
+
+    def test_oversized_request_waits_for_empty_budget(self):
+        """Test that a file larger than the whole budget still gets through alone"""
+        budget = main.ByteBudget(100)
+        
+        self.assertTrue(budget.acquire(500, timeout=0))
+        self.assertFalse(budget.acquire(1, timeout=0))
+        print("✓ Test oversized_request_waits_for_empty_budget passed")
+
+    def test_reservation_returns_bytes(self):
+        """Test that a staging reservation grows, shrinks and releases its share"""
+        with patch.object(main, "STAGING_BUDGET", main.ByteBudget(1000)) as budget, \
+             patch.object(main, "MIN_FREE_DISK_BYTES", 0):
+            staging = main.StagingReservation(self.test_dir)
+            staging.reserve(400)
+            staging.reserve(250, wait=False)  # Actual size known after download
+            self.assertEqual(budget.used, 250)
+            staging.release()
+            self.assertEqual(budget.used, 0)
+        print("✓ Test reservation_returns_bytes passed")
+
+    def test_sweep_removes_only_old_files(self):
+        """Test that the startup sweep reclaims stale files and keeps fresh ones"""
+        import time
+        old_file = os.path.join(self.test_dir, "OLD123.mp4")
+        new_file = os.path.join(self.test_dir, "NEW456.mp4")
+        for path in (old_file, new_file):
+            with open(path, "wb") as f:
+                f.write(b"x" * 1000)
+        two_hours_ago = time.time() - 7200
+        os.utime(old_file, (two_hours_ago, two_hours_ago))
+        
+        with patch.object(main, "STAGING_ORPHAN_AGE_SECONDS", 3600):
+            freed = main.sweep_staging_folder(self.test_dir)
+        
+        self.assertEqual(freed, 1000)
+        self.assertFalse(os.path.exists(old_file))
+        self.assertTrue(os.path.exists(new_file))
+        print("✓ Test sweep_removes_only_old_files passed")
+
+    def test_staging_files_removed_by_shortcode(self):
+        """Test that video, cleaned copy and thumbnail are cleaned up, but not a longer shortcode's files"""
+        for name in ("ABC123.mp4", "ABC123_clean.mp4", "ABC123.jpg", "XYZ789.mp4",
+                     "ABC123X.mp4", "ABC123X_clean.mp4"):
+            open(os.path.join(self.test_dir, name), "w").close()
+        
+        main.remove_staging_files(self.test_dir, "ABC123")
+        
+        self.assertEqual(sorted(os.listdir(self.test_dir)), ["ABC123X.mp4", "ABC123X_clean.mp4", "XYZ789.mp4"])
+        print("✓ Test staging_files_removed_by_shortcode passed")
+
+
+class TestSessionPool(unittest.TestCase):
+    """Tests for the multi-account Instagram session pool"""
+
+    def session(self, username, last_used=0.0, healthy=True, tokens=None):
+        bucket = main.TokenBucket(1, 5)
+        if tokens is not None:
+            bucket.tokens = tokens
+        return Mock(username=username, healthy=healthy, bucket=bucket, last_used=last_used)
+
+    def test_accounts_file_parsing(self):
+        """Test username:password lines, skipping comments and blanks"""
+        test_dir = tempfile.mkdtemp()
+        try:
+            accounts_file = os.path.join(test_dir, "instagram_accounts.txt")
+            with open(accounts_file, "w", encoding="utf-8") as f:
+                f.write("# burner accounts\nalpha:secret1\n\n beta : pa:ss \nbroken_line\n")
+            
+            with patch.object(main, "ACCOUNTS_FILE", accounts_file):
+                accounts = main.load_accounts()
+        finally:
+            shutil.rmtree(test_dir, ignore_errors=True)
+        
+        self.assertEqual(accounts, [("alpha", "secret1"), ("beta", "pa:ss")])
+        print("✓ Test accounts_file_parsing passed")
+
+    def test_token_bucket_paces_requests(self):
+        """Test that a bucket allows its burst and then refills at its rate"""
+        clock = [0.0]
+        with patch.object(main.time, "monotonic", lambda: clock[0]):
+            bucket = main.TokenBucket(0.5, 3)  # 30 requests/minute, burst of 3
+            for _ in range(3):
+                bucket.consume()
+            self.assertEqual(bucket.wait_time(), 2.0)
+            
+            clock[0] = 2.0
+            self.assertEqual(bucket.wait_time(), 0)
+        print("✓ Test token_bucket_paces_requests passed")
+
+    def test_cooling_session_is_skipped(self):
+        """Test that a session cooling down after a 429 gets no work"""
+        pool = main.SessionPool([
+            self.session("alpha", healthy=False),
+            self.session("beta", last_used=10.0),
+            self.session("gamma", last_used=5.0),
+        ])
+        
+        self.assertEqual(pool.acquire().username, "gamma")
+        print("✓ Test cooling_session_is_skipped passed")
+
+    def test_session_with_most_budget_preferred(self):
+        """Test that rate budget left outranks least recently used"""
+        pool = main.SessionPool([
+            self.session("beta", last_used=0.0, tokens=0),
+            self.session("gamma", last_used=10.0),
+        ])
+        
+        self.assertEqual(pool.acquire().username, "gamma")
+        print("✓ Test session_with_most_budget_preferred passed")
+
+    def test_error_classification(self):
+        """Test that 429s and checkpoints are recognised from error text"""
+        self.assertEqual(main.classify_session_error(Exception("HTTP error code 429")), "rate_limited")
+        self.assertEqual(main.classify_session_error(Exception("Redirected to /challenge/ - checkpoint required")),
+                         "checkpoint")
+        self.assertIsNone(main.classify_session_error(Exception("Profile not found")))
+        print("✓ Test error_classification passed")
+
+
+class TestWorkQueue(unittest.TestCase):
+    """Tests for the SQLite work queue's lease/heartbeat/ack semantics"""
+
+    def setUp(self):
+        """Set up a temporary queue DB and a controllable clock"""
+        self.test_dir = tempfile.mkdtemp()
+        self.queue = main.SQLiteWorkQueue(os.path.join(self.test_dir, "work_queue.db"))
+        self.now = 1000.0
+        self.clock = patch.object(main.time, "time", lambda: self.now)
+        self.clock.start()
+
+    def tearDown(self):
+        """Clean up test fixtures"""
+        self.clock.stop()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_enqueue_is_idempotent(self):
+        """Test that re-crawling a niche doesn't queue the same shortcode twice"""
+        self.assertEqual(self.queue.enqueue([("niche1", "user", "ABC"), ("niche1", "user", "DEF")]), 2)
+        self.assertEqual(self.queue.enqueue([("niche1", "user", "ABC"), ("niche2", "user", "ABC")]), 1)
+        self.assertEqual(self.queue.counts(), {"queued": 3})
+        print("✓ Test enqueue_is_idempotent passed")
+
+    def test_claimed_item_is_not_handed_out_twice(self):
+        """Test that a leased item is invisible to other workers until acked"""
+        self.queue.enqueue([("niche1", "user", "ABC")])
+        first = self.queue.claim("node-a:1")
+        self.now += 1
+        second = self.queue.claim("node-b:1")
+        
+        self.assertEqual(first["shortcode"], "ABC")
+        self.assertIsNone(second)
+        self.assertTrue(self.queue.ack(first["id"], "node-a:1"))
+        self.assertIsNone(self.queue.claim("node-b:1"))
+        self.assertEqual(self.queue.counts("niche1"), {"done": 1})
+        print("✓ Test claimed_item_is_not_handed_out_twice passed")
+
+    def test_expired_lease_is_requeued(self):
+        """Test that a crashed worker's item goes to another worker after the lease runs out"""
+        self.queue.enqueue([("niche1", "user", "ABC")])
+        first = self.queue.claim("node-a:1", lease_seconds=60)
+        self.now += 59
+        self.assertIsNone(self.queue.claim("node-b:1"))
+        
+        self.now += 2
+        second = self.queue.claim("node-b:1")
+        self.assertEqual(second["id"], first["id"])
+        self.assertEqual(second["attempts"], 2)
+        # The original worker lost its lease and can no longer renew or ack it
+        self.assertFalse(self.queue.heartbeat(first["id"], "node-a:1"))
+        self.assertFalse(self.queue.ack(first["id"], "node-a:1"))
+        self.assertTrue(self.queue.ack(second["id"], "node-b:1"))
+        print("✓ Test expired_lease_is_requeued passed")
+
+    def test_heartbeat_keeps_lease(self):
+        """Test that a busy worker renewing its lease keeps the item"""
+        self.queue.enqueue([("niche1", "user", "ABC")])
+        item = self.queue.claim("node-a:1", lease_seconds=60)
+        self.now += 50
+        self.assertTrue(self.queue.heartbeat(item["id"], "node-a:1", lease_seconds=60))
+        
+        self.now += 50
+        self.assertIsNone(self.queue.claim("node-b:1"))
+        print("✓ Test heartbeat_keeps_lease passed")
+
+    def test_item_fails_after_max_lease_expiries(self):
+        """Test that an item which keeps killing its worker is eventually given up"""
+        self.queue.enqueue([("niche1", "user", "ABC")])
+        for _ in range(main.WORK_QUEUE_MAX_ATTEMPTS):
+            self.assertIsNotNone(self.queue.claim("node-a:1", lease_seconds=60))
+            self.now += 61
+        
+        self.assertIsNone(self.queue.claim("node-a:1"))
+        self.assertEqual(self.queue.counts(), {"failed": 1})
+        print("✓ Test item_fails_after_max_lease_expiries passed")
+
+    def test_release_requeues_until_attempts_used(self):
+        """Test that a released item is retried, then failed once out of attempts"""
+        self.queue.enqueue([("niche1", "user", "ABC")])
+        with patch.object(main, "WORK_QUEUE_MAX_ATTEMPTS", 2):
+            item = self.queue.claim("node-a:1")
+            self.assertTrue(self.queue.release(item["id"], "node-a:1", "timeout"))
+            self.assertEqual(self.queue.counts(), {"queued": 1})
+            
+            item = self.queue.claim("node-a:1")
+            self.assertTrue(self.queue.release(item["id"], "node-a:1", "timeout"))
+        self.assertEqual(self.queue.counts(), {"failed": 1})
+        print("✓ Test release_requeues_until_attempts_used passed")
+
+    def test_worker_continues_csv_numbering(self):
+        """Test that a worker seeds numbering from the niche CSV before processing"""
+        old_cwd = os.getcwd()
+        os.chdir(self.test_dir)
+        niche_config = {
+            "links_file": "links_niche1.txt",
+            "output_csv": "reels_niche1.csv",
+            "processed_file": "processed_niche1.txt",
+            "failed_file": "failed_niche1.txt",
+            "drive_folder": "niche1_reels",
+        }
+        with open(niche_config["output_csv"], "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(main.CSV_HEADER)
+            writer.writerow([5, "u", "t", "niche1_reels", "005_u_SC5.mp4"])
+        self.queue.enqueue([("niche1", "u", "NEW1")])
+        numbers = []
+        
+        def fake_process_post(args, niche_config, processed_posts):
+            numbers.append(main.get_next_video_number(niche_config["drive_folder"]))
+            return True
+        
+        try:
+            with patch.object(main, "STATE_DB", os.path.join(self.test_dir, "pipeline_state.db")), \
+                 patch.object(main, "_number_blocks", {}), \
+                 patch.object(main, "NICHES", {"niche1": niche_config}), \
+                 patch.object(main, "open_work_queue", return_value=self.queue), \
+                 patch.object(main, "load_r2_index", return_value=({}, set())), \
+                 patch.object(main, "SESSION_POOL"), \
+                 patch.object(main.instaloader.Post, "from_shortcode", lambda context, shortcode: Mock(shortcode=shortcode)), \
+                 patch.object(main, "process_post", side_effect=fake_process_post), \
+                 patch.object(main, "export_metrics"), \
+                 patch.object(main, "THREADS", 1), \
+                 patch.object(main, "WORK_QUEUE_IDLE_EXIT_SECONDS", 0.01), \
+                 patch.object(main, "WORK_QUEUE_POLL_SECONDS", 0.01):
+                self.assertEqual(main.run_worker(), 1)
+        finally:
+            os.chdir(old_cwd)
+        
+        self.assertEqual(numbers, [6])
+        print("✓ Test worker_continues_csv_numbering passed")
+
+    def test_concurrent_claims_are_disjoint(self):
+        """Test that workers claiming in parallel never get the same item"""
+        import threading
+        self.queue.enqueue([("niche1", "user", f"SC{i}") for i in range(40)])
+        claimed = []
+        claimed_lock = threading.Lock()
+        
+        def worker(worker_id):
+            queue = main.SQLiteWorkQueue(self.queue.path)  # Own queue object per worker, like separate nodes
+            while True:
+                item = queue.claim(worker_id)
+                if item is None:
+                    return
+                with claimed_lock:
+                    claimed.append(item["shortcode"])
+        
+        threads = [threading.Thread(target=worker, args=(f"node:{i}",)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        
+        self.assertEqual(len(claimed), 40)
+        self.assertEqual(len(set(claimed)), 40)
+        print("✓ Test concurrent_claims_are_disjoint passed")
+
+
+class TestDaemonScheduling(unittest.TestCase):
+    """Tests for the daemon's adaptive per-profile poll intervals"""
+
+    def test_active_profile_polled_more_often(self):
+        """Test that a profile posting hourly is polled far more often than a weekly one"""
+        now = 1_000_000
+        hourly = main.next_poll_interval(3600, now - 600, 0, now)
+        weekly = main.next_poll_interval(7 * 86400, now - 600, 0, now)
+        
+        self.assertEqual(hourly, 3600 * main.DAEMON_POLL_FRACTION)
+        self.assertEqual(weekly, main.DAEMON_MAX_POLL_SECONDS)
+        print("✓ Test active_profile_polled_more_often passed")
+
+    def test_unknown_rhythm_uses_default(self):
+        """Test that a profile never polled before gets the default interval"""
+        self.assertEqual(main.next_poll_interval(None, None, 0, 1_000_000), main.DAEMON_DEFAULT_POLL_SECONDS)
+        print("✓ Test unknown_rhythm_uses_default passed")
+
+    def test_silence_stretches_interval(self):
+        """Test that a normally active profile gone quiet drifts towards the maximum interval"""
+        now = 1_000_000
+        recent = main.next_poll_interval(3600, now - 3600, 0, now)
+        silent = main.next_poll_interval(3600, now - 10 * 3600, 0, now)
+        
+        self.assertGreater(silent, recent)
+        print("✓ Test silence_stretches_interval passed")
+
+    def test_errors_back_off_exponentially(self):
+        """Test that consecutive errors double the interval up to the maximum"""
+        now = 1_000_000
+        with patch.object(main, "DAEMON_POLL_FRACTION", 0.5):
+            intervals = [main.next_poll_interval(3600, now, failures, now) for failures in range(6)]
+        
+        self.assertEqual(intervals[:3], [1800, 3600, 7200])
+        self.assertEqual(intervals[-1], main.DAEMON_MAX_POLL_SECONDS)
+        print("✓ Test errors_back_off_exponentially passed")
+
+    def test_rhythm_learned_from_post_times(self):
+        """Test that gaps between posts feed the moving average and last post time"""
+        avg_gap, last_post_at = main.update_posting_rhythm(None, None, [3000, 1000, 2000])
+        self.assertEqual((avg_gap, last_post_at), (1000, 3000))
+        
+        # The next poll sees one new post plus the boundary post it stopped at
+        with patch.object(main, "DAEMON_GAP_SMOOTHING", 0.3):
+            avg_gap, last_post_at = main.update_posting_rhythm(avg_gap, last_post_at, [5000, 3000])
+        self.assertAlmostEqual(avg_gap, 0.7 * 1000 + 0.3 * 2000)
+        self.assertEqual(last_post_at, 5000)
+        print("✓ Test rhythm_learned_from_post_times passed")
+
+    def test_poll_schedule_survives_restart(self):
+        """Test that saved poll state is loaded back by a restarted daemon"""
+        test_dir = tempfile.mkdtemp()
+        state = {"next_poll": 5000.0, "interval": 1800.0, "avg_gap": 3600.0, "last_post_at": 4000.0, "failures": 1}
+        try:
+            with patch.object(main, "STATE_DB", os.path.join(test_dir, "pipeline_state.db")):
+                main.save_poll_state("niche1", "user1", state)
+                schedule = main.load_poll_schedule()
+        finally:
+            shutil.rmtree(test_dir, ignore_errors=True)
+        
+        self.assertEqual(schedule, {("niche1", "user1"): state})
+        print("✓ Test poll_schedule_survives_restart passed")
+
+
+class TestRetryFailed(unittest.TestCase):
+    """Tests for reading back and compacting the failed log in --retry-failed"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        self.test_dir = tempfile.mkdtemp()
+        self.old_cwd = os.getcwd()
+        os.chdir(self.test_dir)
+        self.niche_config = {
+            "links_file": "links_niche1.txt",
+            "output_csv": "reels_niche1.csv",
+            "processed_file": "processed_niche1.txt",
+            "failed_file": "failed_niche1.txt",
+            "drive_folder": "niche1_reels",
+        }
+        self.failed_file = self.niche_config["failed_file"]
+        self.patches = [
+            patch.object(main, "STATE_DB", os.path.join(self.test_dir, "pipeline_state.db")),
+            patch.object(main, "_number_blocks", {}),
+            patch.object(main, "NICHES", {"niche1": self.niche_config}),
+            patch.object(main, "load_r2_index", return_value=({}, set())),
+            patch.object(main, "resolve_post", lambda shortcode: Mock(shortcode=shortcode)),
+            patch.object(main, "export_metrics"),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        """Clean up test fixtures"""
+        for p in self.patches:
+            p.stop()
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def write_log(self, text):
+        with open(self.failed_file, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def test_error_with_commas_is_kept_whole(self):
+        """Test that only the first two commas split the line"""
+        self.write_log("user1,ABC123,HTTP error, code 500, retry later\n")
+        
+        self.assertEqual(main.read_failed_log(self.failed_file),
+                         {"ABC123": ("user1", "HTTP error, code 500, retry later")})
+        print("✓ Test error_with_commas_is_kept_whole passed")
+
+    def test_duplicates_keep_latest_error(self):
+        """Test that a post failed in several runs is retried once, with its latest error"""
+        self.write_log("user1,ABC123,timeout\nuser2,DEF456,404\nuser1,ABC123,403 Forbidden\n")
+        
+        entries = main.read_failed_log(self.failed_file)
+        self.assertEqual(list(entries), ["DEF456", "ABC123"])
+        self.assertEqual(entries["ABC123"], ("user1", "403 Forbidden"))
+        print("✓ Test duplicates_keep_latest_error passed")
+
+    def test_malformed_lines_skipped(self):
+        """Test that blank lines and multi-line error tails are ignored"""
+        self.write_log("\nuser1,ABC123,Traceback\n  continued error text\n")
+        
+        self.assertEqual(list(main.read_failed_log(self.failed_file)), ["ABC123"])
+        print("✓ Test malformed_lines_skipped passed")
+
+    def test_compaction_removes_successes(self):
+        """Test that recovered posts are compacted out and failures stay"""
+        self.write_log("user1,ABC123,timeout\nuser2,DEF456,404\nuser1,ABC123,timeout\n")
+        
+        self.assertEqual(main.compact_failed_log(self.niche_config, {"ABC123"}), 1)
+        with open(self.failed_file, "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), "user2,DEF456,404\n")
+        print("✓ Test compaction_removes_successes passed")
+
+    def test_run_retry_failed_drops_recovered_posts(self):
+        """Test the whole --retry-failed pass: a recovered post leaves the log, a failure stays"""
+        self.write_log("user1,ABC123,timeout\nuser2,DEF456,404\n")
+        
+        def fake_process_post(args, niche_config, processed_posts):
+            return args[1].shortcode == "ABC123"
+        
+        with patch.object(main, "process_post", side_effect=fake_process_post):
+            recovered = main.run_retry_failed(["niche1"])
+        
+        self.assertEqual(recovered, 1)
+        with open(self.failed_file, "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), "user2,DEF456,404\n")
+        print("✓ Test run_retry_failed_drops_recovered_posts passed")
+
+    def test_retry_continues_csv_numbering(self):
+        """Test that a retried post gets a number after the CSV's, even with a fresh state DB"""
+        with open(self.niche_config["output_csv"], "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(main.CSV_HEADER)
+            for number in range(1, 6):
+                writer.writerow([number, "u", "t", "niche1_reels", f"{number:03d}_u_SC{number}.mp4"])
+        self.write_log("u,BAD1,timeout\n")
+        numbers = []
+        
+        def fake_process_post(args, niche_config, processed_posts):
+            numbers.append(main.get_next_video_number(niche_config["drive_folder"]))
+            return True
+        
+        with patch.object(main, "process_post", side_effect=fake_process_post):
+            main.run_retry_failed(["niche1"])
+        
+        self.assertEqual(numbers, [6])
+        print("✓ Test retry_continues_csv_numbering passed")
+
+
+def make_listing_post(shortcode="ABC123", duration=30, age_days=1, views=5000, likes=500, comments=0,
+                      now=1_700_000_000):
+    """Mock post carrying the metadata a profile listing provides"""
+    from datetime import datetime, timedelta, timezone
+    post = Mock()
+    post.shortcode = shortcode
+    post.video_duration = duration
+    post.date_utc = (datetime.fromtimestamp(now, timezone.utc) - timedelta(days=age_days)).replace(tzinfo=None)
+    post.video_view_count = views
+    post.likes = likes
+    post.comments = comments
+    return post
+
+
+class TestRunPlanner(unittest.TestCase):
+    """Tests for the --plan byte and wall-time estimates"""
+
+    def videos(self, *durations):
+        return [("user", make_listing_post(f"SC{i}", duration=d)) for i, d in enumerate(durations)]
+
+    def test_bytes_from_duration_without_history(self):
+        """Test that sizes fall back to the configured bitrate and default size"""
+        total_bytes, seconds = main.plan_estimate(self.videos(10, None), {})
+        
+        self.assertEqual(total_bytes, 10 * main.ESTIMATED_BYTES_PER_SECOND + main.DEFAULT_VIDEO_ESTIMATE_BYTES)
+        self.assertIsNone(seconds)
+        print("✓ Test bytes_from_duration_without_history passed")
+
+    def test_bitrate_learned_from_history(self):
+        """Test that past downloads' bytes per video-second replace the default bitrate"""
+        history = {"download": {"count": 5, "seconds": 10.0, "bytes": 1_000_000, "media_seconds": 100.0}}
+        total_bytes, _ = main.plan_estimate(self.videos(30), history)
+        
+        self.assertEqual(total_bytes, 300_000)
+        print("✓ Test bitrate_learned_from_history passed")
+
+    def test_wall_time_from_throughput(self):
+        """Test that time = bytes over download/upload throughput + per-video stage time, split over threads"""
+        history = {
+            "download": {"count": 10, "seconds": 10.0, "bytes": 10_000_000, "media_seconds": 100.0},
+            "upload": {"count": 10, "seconds": 5.0, "bytes": 10_000_000},
+            "strip": {"count": 10, "seconds": 20.0},
+        }
+        # 2 x 50s videos at 100 kB per video-second = 10 MB
+        with patch.object(main, "THREADS", 1):
+            total_bytes, seconds = main.plan_estimate(self.videos(50, 50), history)
+        self.assertEqual(total_bytes, 10_000_000)
+        self.assertAlmostEqual(seconds, 10.0 + 5.0 + 2 * 2.0)
+        
+        with patch.object(main, "THREADS", 2):
+            _, parallel = main.plan_estimate(self.videos(50, 50), history)
+        self.assertAlmostEqual(parallel, seconds / 2)
+        print("✓ Test wall_time_from_throughput passed")
+
+    def test_history_uses_latest_runs(self):
+        """Test that only the most recent run summaries (by RUN_ID file name) are summed"""
+        import json
+        test_dir = tempfile.mkdtemp()
+        try:
+            for run_id, count in (("20250102_000000", 1), ("20241231_235959", 100), ("20250101_120000", 2)):
+                summary = {"stages": {"niche1_reels": {"download": {"count": count, "seconds": 1.0}}}}
+                with open(os.path.join(test_dir, f"run_{run_id}.json"), "w") as f:
+                    json.dump(summary, f)
+            
+            with patch.object(main, "METRICS_DIR", test_dir):
+                history = main.load_run_history(limit=2)
+        finally:
+            shutil.rmtree(test_dir, ignore_errors=True)
+        
+        self.assertEqual(history["download"]["count"], 3)
+        print("✓ Test history_uses_latest_runs passed")
+
+
+class TestPostFilters(unittest.TestCase):
+    """Tests for per-niche pre-download filters on post metadata"""
+
+    NOW = 1_700_000_000
+
+    def filter_reason(self, post, filters):
+        return main.post_filter_reason(post, filters, now=self.NOW)
+
+    def test_no_filters_passes_everything(self):
+        """Test that a niche without filters keeps every video"""
+        post = make_listing_post(duration=600, age_days=900, views=0, likes=0, now=self.NOW)
+        self.assertIsNone(self.filter_reason(post, {}))
+        print("✓ Test no_filters_passes_everything passed")
+
+    def test_duration_bounds(self):
+        """Test min/max duration filters"""
+        filters = {"min_duration": 5, "max_duration": 90}
+        
+        self.assertEqual(self.filter_reason(make_listing_post(duration=3, now=self.NOW), filters), "too short")
+        self.assertEqual(self.filter_reason(make_listing_post(duration=120, now=self.NOW), filters), "too long")
+        self.assertIsNone(self.filter_reason(make_listing_post(duration=90, now=self.NOW), filters))
+        print("✓ Test duration_bounds passed")
+
+    def test_max_age(self):
+        """Test that posts older than max_age_days are skipped"""
+        filters = {"max_age_days": 30}
+        
+        self.assertEqual(self.filter_reason(make_listing_post(age_days=31, now=self.NOW), filters), "too old")
+        self.assertIsNone(self.filter_reason(make_listing_post(age_days=29, now=self.NOW), filters))
+        print("✓ Test max_age passed")
+
+    def test_engagement_minimums_keep_unknown_counts(self):
+        """Test view/like minimums, keeping posts whose counts are unknown"""
+        filters = {"min_views": 10000, "min_likes": 100}
+        
+        self.assertEqual(self.filter_reason(make_listing_post(views=500, now=self.NOW), filters), "too few views")
+        self.assertEqual(self.filter_reason(make_listing_post(views=20000, likes=10, now=self.NOW), filters),
+                         "too few likes")
+        self.assertIsNone(self.filter_reason(make_listing_post(views=None, likes=None, now=self.NOW), filters))
+        print("✓ Test engagement_minimums_keep_unknown_counts passed")
+
+    def test_estimated_size_cap(self):
+        """Test that the size cap uses the duration-based estimate"""
+        filters = {"max_estimated_bytes": 20 * 1024 * 1024}
+        
+        with patch.object(main, "ESTIMATED_BYTES_PER_SECOND", 300 * 1024):
+            self.assertEqual(self.filter_reason(make_listing_post(duration=90, now=self.NOW), filters), "too large")
+            self.assertIsNone(self.filter_reason(make_listing_post(duration=60, now=self.NOW), filters))
+        print("✓ Test estimated_size_cap passed")
+
+
+class TestPriorityBudget(unittest.TestCase):
+    """Tests for score-ordered processing and --budget limits"""
+
+    WEIGHTS = {"recency": 1.0, "views": 1.0, "likes": 0.5, "engagement": 1.0}
+    NOW = 1_700_000_000
+
+    def score(self, age_days, views, likes, comments=0):
+        post = make_listing_post(age_days=age_days, views=views, likes=likes, comments=comments, now=self.NOW)
+        return main.score_post(post, self.WEIGHTS, now=self.NOW)
+
+    def test_popular_recent_post_scores_highest(self):
+        """Test that views, engagement and recency all raise the score"""
+        popular = self.score(age_days=1, views=1_000_000, likes=80_000)
+        unpopular = self.score(age_days=1, views=1_000, likes=5)
+        stale = self.score(age_days=60, views=1_000_000, likes=80_000)
+        
+        self.assertGreater(popular, unpopular)
+        self.assertGreater(popular, stale)
+        print("✓ Test popular_recent_post_scores_highest passed")
+
+    def test_missing_counts_score_zero_not_error(self):
+        """Test that posts without view/like counts still get a (recency) score"""
+        self.assertAlmostEqual(self.score(age_days=0, views=None, likes=None), 1.0)
+        print("✓ Test missing_counts_score_zero_not_error passed")
+
+    def test_prioritize_orders_by_score(self):
+        """Test that a niche's videos are processed highest score first"""
+        low = ("user", make_listing_post("LOW", age_days=30, views=100, likes=1))
+        high = ("user", make_listing_post("HIGH", age_days=0, views=1_000_000, likes=80_000))
+        
+        with patch.object(main.time, "time", return_value=self.NOW):
+            ordered = main.prioritize_videos([low, high], {"score_weights": self.WEIGHTS})
+        
+        self.assertEqual([post.shortcode for _, post in ordered], ["HIGH", "LOW"])
+        print("✓ Test prioritize_orders_by_score passed")
+
+    def test_parse_budget_units(self):
+        """Test video, byte and time budgets"""
+        self.assertEqual(main.parse_budget("50"), ("videos", 50))
+        self.assertEqual(main.parse_budget("500mb"), ("bytes", 500 * 1024 * 1024))
+        self.assertEqual(main.parse_budget("2GB"), ("bytes", 2 * 1024 ** 3))
+        self.assertEqual(main.parse_budget("45m"), ("seconds", 2700))
+        self.assertEqual(main.parse_budget("1.5h"), ("seconds", 5400))
+        with self.assertRaises(ValueError):
+            main.parse_budget("lots")
+        print("✓ Test parse_budget_units passed")
+
+    def test_byte_budget_skips_what_does_not_fit(self):
+        """Test that a byte budget keeps going with smaller videos after a big one doesn't fit"""
+        mb = 1024 * 1024
+        videos = [("user", make_listing_post(f"SC{size}", duration=size)) for size in (8, 15, 2, 1)]
+        
+        with patch.object(main, "ESTIMATED_BYTES_PER_SECOND", mb):
+            selected, deadline = main.apply_budget(videos, ("bytes", 11 * mb))
+        
+        self.assertEqual([post.shortcode for _, post in selected], ["SC8", "SC2", "SC1"])
+        self.assertIsNone(deadline)
+        print("✓ Test byte_budget_skips_what_does_not_fit passed")
+
+    def test_video_and_time_budgets(self):
+        """Test that a count budget truncates and a time budget sets a deadline"""
+        videos = [("user", make_listing_post(f"SC{i}")) for i in range(5)]
+        
+        self.assertEqual(main.apply_budget(videos, ("videos", 2)), (videos[:2], None))
+        with patch.object(main.time, "time", return_value=self.NOW):
+            self.assertEqual(main.apply_budget(videos, ("seconds", 60)), (videos, self.NOW + 60))
+        print("✓ Test video_and_time_budgets passed")
+
+
+class TestParallelProfileCrawl(unittest.TestCase):
+    """Tests for concurrent profile crawling within a niche"""
+
+    def setUp(self):
+        """Set up a niche whose numbering and R2 index stay local"""
+        self.test_dir = tempfile.mkdtemp()
+        self.niche_config = {
+            "output_csv": os.path.join(self.test_dir, "reels_niche1.csv"),
+            "drive_folder": "niche1_reels",
+        }
+        self.patches = [
+            patch.object(main, "STATE_DB", os.path.join(self.test_dir, "pipeline_state.db")),
+            patch.object(main, "load_r2_index", return_value=({}, set())),
+            patch.object(main, "SESSION_POOL"),
+            patch.object(main, "METRICS", main.RunMetrics()),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        """Clean up test fixtures"""
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_concurrent_crawl_tracks_latency_not_sum(self):
+        """Test that bounded concurrency overlaps per-profile round trips"""
+        import time
+        
+        def fake_crawl(session, niche_config, username, *args, **kwargs):
+            time.sleep(0.1)  # One profile's round trips
+            return [(username, make_listing_post(f"SC_{username}"))], [], 0
+        
+        links = [f"https://instagram.com/user{i}" for i in range(8)]
+        start = time.perf_counter()
+        with patch.object(main, "crawl_profile", side_effect=fake_crawl), \
+             patch.object(main, "PROFILE_CONCURRENCY", 4):
+            videos = main.collect_new_videos(self.niche_config, set(), links)
+        elapsed = time.perf_counter() - start
+        
+        self.assertEqual([username for username, _ in videos], [f"user{i}" for i in range(8)])  # Links-file order
+        self.assertLess(elapsed, 0.5)  # ~2 rounds of 0.1s instead of 0.8s
+        print("✓ Test concurrent_crawl_tracks_latency_not_sum passed")
+
+    def test_shared_limiter_caps_total_rate(self):
+        """Test that all crawl threads draw from one bucket, so the total rate is capped"""
+        import threading
+        import time
+        limiter = main.TokenBucket(50.0, 5)  # 50 requests/second overall, burst of 5
+        
+        def worker():
+            for _ in range(10):
+                limiter.consume()
+        
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        
+        # 40 requests, 5 from the burst, 35 at 50/s -> at least 0.7s however many threads
+        self.assertGreaterEqual(elapsed, 0.65)
+        print("✓ Test shared_limiter_caps_total_rate passed")
+
+    def test_rate_limited_profile_moves_to_another_session(self):
+        """Test that a 429 on one session retries the profile on the next one"""
+        sessions = [Mock(name="alpha"), Mock(name="beta")]
+        used = []
+        
+        def fake_crawl(session, niche_config, username, *args, **kwargs):
+            used.append(session)
+            if session is sessions[0]:
+                raise Exception("429 Too Many Requests")
+            return [(username, make_listing_post("ABC"))], [], 0
+        
+        main.SESSION_POOL.acquire.side_effect = sessions
+        with patch.object(main, "crawl_profile", side_effect=fake_crawl):
+            videos = main.collect_new_videos(self.niche_config, set(), ["https://instagram.com/alice"])
+        
+        self.assertEqual(used, sessions)
+        main.SESSION_POOL.report_error.assert_called_once()
+        self.assertEqual([post.shortcode for _, post in videos], ["ABC"])
+        print("✓ Test rate_limited_profile_moves_to_another_session passed")
+
+    def test_other_errors_not_retried(self):
+        """Test that an error unrelated to the session drops the profile without retrying"""
+        with patch.object(main, "crawl_profile", side_effect=Exception("Profile not found")) as crawl:
+            videos = main.collect_new_videos(self.niche_config, set(), ["https://instagram.com/gone"])
+        
+        self.assertEqual(videos, [])
+        self.assertEqual(crawl.call_count, 1)
+        print("✓ Test other_errors_not_retried passed")
+
+    def test_collab_post_merged_once(self):
+        """Test that a post listed by two crawled profiles is processed once"""
+        listings = {
+            "alice": ["ABC", "SHARED"],
+            "bob": ["SHARED", "DEF"],
+        }
+        
+        def fake_crawl(session, niche_config, username, *args, **kwargs):
+            return [(username, make_listing_post(shortcode)) for shortcode in listings[username]], [], 0
+        
+        with patch.object(main, "crawl_profile", side_effect=fake_crawl):
+            videos = main.collect_new_videos(self.niche_config, set(),
+                                             ["https://instagram.com/alice/", "https://instagram.com/bob"])
+        
+        self.assertEqual([(username, post.shortcode) for username, post in videos],
+                         [("alice", "ABC"), ("alice", "SHARED"), ("bob", "DEF")])
+        print("✓ Test collab_post_merged_once passed")
+
+
+class TestMediaTransport(unittest.TestCase):
+    """Tests for the pooled media download transport"""
+
+    def setUp(self):
+        """Start a local keep-alive media server"""
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.test_dir = tempfile.mkdtemp()
+        self.body = os.urandom(3 * 1024 * 1024 + 123)
+        body = self.body
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        """Stop the server and clean up test fixtures"""
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def test_keep_alive_pool_reuses_connection(self):
+        """Test that sequential downloads share one connection and count it once"""
+        transport = main.MediaTransport()
+        for i in range(3):
+            b"".join(transport.iter_media(f"{self.url}/{i}.mp4"))
+        
+        stats = transport.snapshot()
+        self.assertEqual(stats["downloads"], 3)
+        self.assertEqual(stats["new_connections"], 1)
+        self.assertEqual(stats["reused_connections"], 2)
+        self.assertEqual(stats["bytes"], 3 * len(self.body))
+        print("✓ Test keep_alive_pool_reuses_connection passed")
+
+    def test_buffered_chunks_written_whole(self):
+        """Test that large chunks through the write buffer produce the complete file"""
+        path = os.path.join(self.test_dir, "ABC123.mp4")
+        
+        written = main.MediaTransport().download_media(f"{self.url}/ABC123.mp4", path)
+        
+        self.assertEqual(written, len(self.body))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), self.body)
+        print("✓ Test buffered_chunks_written_whole passed")
+
+    def test_pace_sees_every_chunk(self):
+        """Test that the bandwidth callback is charged for every byte downloaded"""
+        paced = []
+        
+        b"".join(main.MediaTransport().iter_media(f"{self.url}/ABC123.mp4", paced.append))
+        
+        self.assertEqual(sum(paced), len(self.body))
+        self.assertLessEqual(max(paced), main.DOWNLOAD_CHUNK_BYTES)
+        print("✓ Test pace_sees_every_chunk passed")
+
+
+class TestBandwidthShaping(unittest.TestCase):
+    """Tests for token-bucket download/upload bandwidth limits"""
+
+    def setUp(self):
+        """Run token buckets on a fake clock that only moves while they sleep"""
+        self.now = 0.0
+        
+        def sleep(seconds):
+            self.now += seconds
+        
+        self.patches = [
+            patch.object(main.time, "monotonic", lambda: self.now),
+            patch.object(main.time, "sleep", sleep),
+            patch.object(main, "_bandwidth_buckets", {}),
+            patch.object(main, "BANDWIDTH_BURST_SECONDS", 1.0),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        """Restore the real clock"""
+        for p in self.patches:
+            p.stop()
+
+    def send(self, pace, chunks):
+        """Return the fake time at which each chunk was let through"""
+        times = []
+        for nbytes in chunks:
+            pace(nbytes)
+            times.append(self.now)
+        return times
+
+    def test_unlimited_returns_no_pacer(self):
+        """Test that no callback is installed when no limit is configured"""
+        with patch.object(main, "DOWNLOAD_BYTES_PER_SECOND", None):
+            self.assertIsNone(main.bandwidth_pacer("download", "niche1_reels"))
+        print("✓ Test unlimited_returns_no_pacer passed")
+
+    def test_average_rate_respected(self):
+        """Test that 10 MB at 1 MB/s with a 1 MB burst takes ~9 seconds"""
+        mb = 1024 * 1024
+        with patch.object(main, "DOWNLOAD_BYTES_PER_SECOND", mb):
+            times = self.send(main.bandwidth_pacer("download", "niche1_reels"), [mb] * 10)
+        
+        self.assertEqual(times[0], 0.0)
+        self.assertAlmostEqual(times[-1], 9.0)
+        print("✓ Test average_rate_respected passed")
+
+    def test_chunks_larger_than_bucket_are_paced(self):
+        """Test that 4 MB chunks through a 1 MB bucket still average the limit"""
+        mb = 1024 * 1024
+        with patch.object(main, "UPLOAD_BYTES_PER_SECOND", mb):
+            times = self.send(main.bandwidth_pacer("upload", "niche1_reels"), [4 * mb] * 3)
+        
+        # Each chunk leaves 3 MB of debt: 4 s until the bucket holds 1 MB again
+        self.assertEqual([round(t, 6) for t in times], [0.0, 4.0, 8.0])
+        print("✓ Test chunks_larger_than_bucket_are_paced passed")
+
+    def test_stricter_of_global_and_niche_limit_wins(self):
+        """Test that bytes must pass both the global and the niche bucket"""
+        mb = 1024 * 1024
+        niches = {"niche1": {"drive_folder": "niche1_reels", "download_bytes_per_second": mb}}
+        with patch.object(main, "DOWNLOAD_BYTES_PER_SECOND", 4 * mb), patch.object(main, "NICHES", niches):
+            times = self.send(main.bandwidth_pacer("download", "niche1_reels"), [mb] * 5)
+        
+        self.assertAlmostEqual(times[-1], 4.0)
+        print("✓ Test stricter_of_global_and_niche_limit_wins passed")
+
+    def test_negative_progress_ignored(self):
+        """Test that boto3's negative progress on a retried part doesn't refund tokens"""
+        with patch.object(main, "UPLOAD_BYTES_PER_SECOND", 16384):
+            pace = main.bandwidth_pacer("upload", "niche1_reels")
+            self.send(pace, [8192, 8192, -16384, 8192])
+        
+        self.assertAlmostEqual(self.now, 0.5)  # 8 KB over the 16 KB burst at 16 KB/s
+        print("✓ Test negative_progress_ignored passed")
+
+
+class TestOutputProfile(unittest.TestCase):
+    """Tests for the faststart / H.264 output profiles"""
+
+    def test_faststart_moves_moov_before_mdat(self):
+        """Test that faststart puts moov ahead of mdat and the digest matches the output"""
+        import hashlib
+        data = make_strippable_mp4(mdat_first=True)
+        digest = hashlib.sha256()
+        
+        stripped = main.strip_metadata_in_memory(data, faststart=True, digest=digest)
+        
+        self.assertLess(stripped.index(b"moov"), stripped.index(b"mdat"))
+        offset = mp4_chunk_offset(stripped)
+        self.assertEqual(stripped[offset:offset + 8], b"PAYLOAD!")
+        self.assertEqual(digest.hexdigest(), hashlib.sha256(stripped).hexdigest())
+        print("✓ Test faststart_moves_moov_before_mdat passed")
+
+    def test_ffmpeg_args_per_profile(self):
+        """Test that only re-encoding profiles drop the stream copy"""
+        self.assertEqual(main.ffmpeg_output_args("copy"), ['-c', 'copy'])
+        self.assertEqual(main.ffmpeg_output_args("faststart"), ['-c', 'copy', '-movflags', '+faststart'])
+        h264 = main.ffmpeg_output_args("h264")
+        self.assertNotIn('copy', h264)
+        self.assertEqual(h264[h264.index('-c:v') + 1], 'libx264')
+        self.assertIn('+faststart', h264)
+        with self.assertRaises(ValueError):
+            main.ffmpeg_output_args("av1")
+        print("✓ Test ffmpeg_args_per_profile passed")
+
+    def test_width_cap_keeps_aspect_ratio(self):
+        """Test that the scale filter caps the width, never upscales and keeps the height even"""
+        with patch.object(main, "H264_MAX_WIDTH", 720):
+            h264 = main.ffmpeg_output_args("h264")
+        
+        self.assertEqual(h264[h264.index('-vf') + 1], "scale='min(720,iw)':-2")
+        print("✓ Test width_cap_keeps_aspect_ratio passed")
+
+    def test_default_profile_from_config(self):
+        """Test that OUTPUT_PROFILE is used when no profile is passed"""
+        with patch.object(main, "OUTPUT_PROFILE", "faststart"):
+            self.assertIn('+faststart', main.ffmpeg_output_args())
+        print("✓ Test default_profile_from_config passed")
+
+
+class TestR2KeyScheme(unittest.TestCase):
+    """Tests for numbered/content object keys and upload headers"""
+
+    def test_both_layouts_parse(self):
+        """Test that old numbered and new content filenames index the same way"""
+        self.assertEqual(main.parse_r2_filename("007_fit_user_ABC123.mp4"), (7, "fit_user_ABC123"))
+        self.assertEqual(main.parse_r2_filename("3f9a0c1d2e4b5a67_fit_user_ABC123.mp4"), (None, "fit_user_ABC123"))
+        self.assertIsNone(main.parse_r2_filename("thumbnail.jpg"))
+        print("✓ Test both_layouts_parse passed")
+
+    def test_all_digit_digest_is_not_a_video_number(self):
+        """Test that a digest made only of digits doesn't seed numbering at 10^15"""
+        self.assertEqual(main.parse_r2_filename("1234567890123456_fit_user_ABC123.mp4"), (None, "fit_user_ABC123"))
+        print("✓ Test all_digit_digest_is_not_a_video_number passed")
+
+    def test_content_key_is_stable(self):
+        """Test that the same bytes always map to the same key"""
+        import hashlib
+        digest = hashlib.sha256(b"video").hexdigest()
+        
+        with patch.object(main, "R2_KEY_SCHEME", "content"):
+            key = main.build_r2_key("niche1_reels", 7, "u", "A1", digest)
+            self.assertEqual(key, main.build_r2_key("niche1_reels", 8, "u", "A1", digest))
+        self.assertEqual(key, f"niche1_reels/{digest[:16]}_u_A1.mp4")
+        with patch.object(main, "R2_KEY_SCHEME", "numbered"):
+            self.assertEqual(main.build_r2_key("niche1_reels", 7, "u", "A1", digest), "niche1_reels/007_u_A1.mp4")
+        print("✓ Test content_key_is_stable passed")
+
+    def test_upload_headers(self):
+        """Test the ExtraArgs built for a content-keyed upload"""
+        filename = "3f9a0c1d2e4b5a67_fit_user_ABC123.mp4"
+        with patch.object(main, "R2_KEY_SCHEME", "content"):
+            extra_args = main.upload_extra_args(filename)
+        
+        self.assertEqual(extra_args['ContentType'], 'video/mp4')
+        self.assertIn("immutable", extra_args['CacheControl'])
+        self.assertTrue(extra_args['ContentDisposition'].endswith(f'"{filename}"'))
+        self.assertEqual(extra_args['ChecksumAlgorithm'], "SHA256")
+        print("✓ Test upload_headers passed")
+
+
+class TestUploadChecksums(unittest.TestCase):
+    """Tests for SHA-256 computed while the upload body is read"""
+
+    def setUp(self):
+        """Set up a temporary state DB, a video file and a stub R2 client"""
+        self.test_dir = tempfile.mkdtemp()
+        self.data = bytes(range(256)) * 100
+        self.local_file = os.path.join(self.test_dir, "ABC123.mp4")
+        with open(self.local_file, "wb") as f:
+            f.write(self.data)
+        self.bodies = []
+        self.client = MagicMock()
+        self.client.upload_fileobj.side_effect = self.fake_upload_fileobj
+        self.patches = [
+            patch.object(main, "STATE_DB", os.path.join(self.test_dir, "pipeline_state.db")),
+            patch.object(main, "get_r2_client", return_value=self.client),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        """Clean up test fixtures"""
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def fake_upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None, Callback=None):
+        """Read the body like a single PUT does"""
+        self.bodies.append(b"".join(iter(lambda: fileobj.read(4096), b"")))
+
+    def recorded_sha256(self):
+        import sqlite3
+        conn = sqlite3.connect(main.STATE_DB)
+        try:
+            return conn.execute("SELECT sha256 FROM uploads WHERE shortcode = 'ABC123'").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_rewind_for_retry_hashes_once(self):
+        """Test that re-reading the body after a retry doesn't change the digest"""
+        import hashlib
+        import io
+        reader = main.HashingReader(io.BytesIO(self.data))
+        
+        reader.read(5000)
+        reader.seek(0)  # s3transfer rewinds to retry the request
+        while reader.read(4096):
+            pass
+        
+        self.assertEqual(reader.hexdigest(len(self.data)), hashlib.sha256(self.data).hexdigest())
+        print("✓ Test rewind_for_retry_hashes_once passed")
+
+    def test_skipped_bytes_invalidate_digest(self):
+        """Test that a read past unhashed bytes yields no digest"""
+        import io
+        reader = main.HashingReader(io.BytesIO(b"x" * 100))
+        reader.seek(50)
+        reader.read()
+        
+        self.assertIsNone(reader.hexdigest(100))
+        print("✓ Test skipped_bytes_invalidate_digest passed")
+
+    def test_upload_sends_checksum_of_body(self):
+        """Test that a known digest is sent as ChecksumSHA256 (base64 of the raw digest)"""
+        import base64
+        import hashlib
+        digest = hashlib.sha256(self.data)
+        
+        main.upload_to_r2(self.local_file, "niche1_reels", 1, "user1", sha256=digest.hexdigest())
+        
+        extra_args = self.client.upload_fileobj.call_args.kwargs["ExtraArgs"]
+        self.assertEqual(extra_args["ChecksumSHA256"], base64.b64encode(digest.digest()).decode())
+        self.assertNotIn("ChecksumAlgorithm", extra_args)
+        self.assertEqual(self.bodies, [self.data])
+        self.assertEqual(self.recorded_sha256(), digest.hexdigest())
+        print("✓ Test upload_sends_checksum_of_body passed")
+
+    def test_digest_computed_while_uploading(self):
+        """Test that without a known digest the body is hashed as boto3 reads it"""
+        import hashlib
+        
+        with patch.object(main, "sha256_hex", wraps=main.sha256_hex) as rehash:
+            main.upload_to_r2(self.local_file, "niche1_reels", 1, "user1", data=self.data)
+        
+        extra_args = self.client.upload_fileobj.call_args.kwargs["ExtraArgs"]
+        self.assertEqual(extra_args["ChecksumAlgorithm"], "SHA256")
+        self.assertFalse(rehash.called)
+        self.assertEqual(self.recorded_sha256(), hashlib.sha256(self.data).hexdigest())
+        print("✓ Test digest_computed_while_uploading passed")
+
+    def test_content_key_hashes_before_upload(self):
+        """Test that content keys carry the digest in the key and send it as the checksum"""
+        import base64
+        import hashlib
+        digest = hashlib.sha256(self.data)
+        
+        with patch.object(main, "R2_KEY_SCHEME", "content"):
+            _, r2_filename = main.upload_to_r2(self.local_file, "niche1_reels", 1, "user1")
+        
+        self.assertTrue(r2_filename.startswith(digest.hexdigest()[:16]))
+        extra_args = self.client.upload_fileobj.call_args.kwargs["ExtraArgs"]
+        self.assertEqual(extra_args["ChecksumSHA256"], base64.b64encode(digest.digest()).decode())
+        print("✓ Test content_key_hashes_before_upload passed")
+
+
+class TestVideoValidation(unittest.TestCase):
+    """Tests for header-only MP4 validation before strip/upload"""
+
+    def setUp(self):
+        """Build a structurally valid reel"""
+        from bench_pipeline import make_synthetic_mp4
+        self.make_mp4 = make_synthetic_mp4
+        self.data = make_synthetic_mp4(20000)
+
+    def assertInvalid(self, data, message, retryable):
+        with self.assertRaises(main.InvalidVideoError) as ctx:
+            main.validate_mp4(data=data)
+        self.assertIn(message, str(ctx.exception))
+        self.assertEqual(ctx.exception.retryable, retryable)
+
+    def test_complete_file_passes(self):
+        """Test that a complete ftyp/moov/mdat file returns its duration"""
+        self.assertEqual(main.validate_mp4(data=self.data), 15.0)
+        print("✓ Test complete_file_passes passed")
+
+    def test_file_on_disk_passes(self):
+        """Test that a staged file is read from disk the same way"""
+        with tempfile.NamedTemporaryFile(suffix=".mp4") as f:
+            f.write(self.data)
+            f.flush()
+            self.assertEqual(main.validate_mp4(f.name), 15.0)
+        print("✓ Test file_on_disk_passes passed")
+
+    def test_truncated_download_is_retryable(self):
+        """Test that a cut-off mdat is reported as retryable"""
+        self.assertInvalid(self.data[:-300], "runs past the end of the file", True)
+        print("✓ Test truncated_download_is_retryable passed")
+
+    def test_error_page_is_not_an_mp4(self):
+        """Test that an HTML body is rejected before FFmpeg sees it"""
+        self.assertInvalid(b"<html><body>429 Too Many Requests</body></html>", "not an MP4", True)
+        print("✓ Test error_page_is_not_an_mp4 passed")
+
+    def test_no_video_track_is_permanent(self):
+        """Test that an audio-only file is not retried"""
+        self.assertInvalid(self.data.replace(b"vide", b"soun", 1), "no video track", False)
+        print("✓ Test no_video_track_is_permanent passed")
+
+    def test_zero_duration_is_permanent(self):
+        """Test that an mvhd with no duration is not retried"""
+        self.assertInvalid(self.make_mp4(20000, duration_seconds=0), "zero duration", False)
+        print("✓ Test zero_duration_is_permanent passed")
+
+    def test_empty_file_is_retryable(self):
+        """Test that an empty download is retried"""
+        self.assertInvalid(b"", "empty file", True)
+        print("✓ Test empty_file_is_retryable passed")
+
+
+class TestPinterestExport(unittest.TestCase):
+    """Tests for --export cursors and sharding"""
+
+    def setUp(self):
+        """Set up a temporary state DB and export folder"""
+        self.test_dir = tempfile.mkdtemp()
+        self.niche_config = {"drive_folder": "niche1_reels", "board": "Fitness"}
+        self.patches = [
+            patch.object(main, "STATE_DB", os.path.join(self.test_dir, "pipeline_state.db")),
+            patch.object(main, "EXPORT_DIR", os.path.join(self.test_dir, "exports")),
+            patch.object(main, "EXPORT_SETTLE_SECONDS", 3600),
+        ]
+        for p in self.patches:
+            p.start()
+        self.count = 0
+
+    def tearDown(self):
+        """Clean up test fixtures"""
+        for p in self.patches:
+            p.stop()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def upload(self, caption, uploaded_at=0):
+        """Record an upload; caption None means its CSV row isn't written yet"""
+        self.count += 1
+        shortcode = f"SC{self.count}"
+        with patch.object(main.time, "time", return_value=uploaded_at):
+            main.record_upload("niche1_reels", shortcode, "u", self.count,
+                               f"niche1_reels/{self.count:03d}_u_{shortcode}.mp4", 10, "ab")
+        if caption is not None:
+            main.record_caption("niche1_reels", shortcode, caption)
+        return shortcode
+
+    def export(self, now):
+        """Run export_niche and return the media URLs it wrote"""
+        urls = []
+        for path in main.export_niche("niche1", self.niche_config, now=now):
+            with open(path, "r", newline="", encoding="utf-8") as f:
+                urls += [row[4].rsplit("_", 1)[1][:-len(".mp4")] for row in list(csv.reader(f))[1:]]
+        return urls
+
+    def test_only_new_rows_exported(self):
+        """Test that a second export only emits rows added after the cursor"""
+        for caption in ("a", "b", "c"):
+            self.upload(caption)
+        self.assertEqual(self.export(now=10), ["SC1", "SC2", "SC3"])
+        
+        self.upload("d", uploaded_at=20)
+        self.assertEqual(self.export(now=30), ["SC4"])
+        self.assertEqual(self.export(now=40), [])
+        print("✓ Test only_new_rows_exported passed")
+
+    def test_in_flight_upload_holds_cursor(self):
+        """Test that an upload without its CSV row yet is exported next time, not skipped"""
+        self.upload("a")
+        pending = self.upload(None, uploaded_at=100)
+        self.upload("c", uploaded_at=100)
+        self.assertEqual(self.export(now=200), ["SC1"])
+        
+        main.record_caption("niche1_reels", pending, "b")
+        self.assertEqual(self.export(now=300), ["SC2", "SC3"])
+        print("✓ Test in_flight_upload_holds_cursor passed")
+
+    def test_abandoned_upload_skipped(self):
+        """Test that an upload whose CSV row never came doesn't block exports forever"""
+        self.upload(None)
+        self.upload("b")
+        self.assertEqual(self.export(now=7200), ["SC2"])
+        print("✓ Test abandoned_upload_skipped passed")
+
+    def recover(self, shortcode, r2_key):
+        """Run crash recovery for a post found in R2, with niche files in the temp folder"""
+        niche_config = dict(self.niche_config,
+                            output_csv=os.path.join(self.test_dir, "reels_niche1.csv"),
+                            processed_file=os.path.join(self.test_dir, "processed_niche1.txt"))
+        post = Mock(shortcode=shortcode, title="Recovered reel", caption=None)
+        main.recover_from_r2(niche_config, "u", post, r2_key, set())
+
+    def test_recovered_upload_is_exported(self):
+        """Test that a post recovered after a crash before its CSV row is exported, not abandoned"""
+        crashed = self.upload(None, uploaded_at=0)  # Uploaded, then the run crashed
+        
+        self.recover(crashed, f"niche1_reels/001_u_{crashed}.mp4")
+        
+        self.assertEqual(self.export(now=7200), [crashed])
+        self.assertIsNotNone(main.find_existing_upload(crashed, "niche2_reels"))
+        print("✓ Test recovered_upload_is_exported passed")
+
+    def test_recovery_records_untracked_upload(self):
+        """Test that an object uploaded before the uploads table existed gets a row"""
+        client = MagicMock()
+        client.head_object.return_value = {"ContentLength": 1234}
+        
+        with patch.object(main, "get_r2_client", return_value=client), \
+             patch.object(main.time, "time", return_value=0):
+            self.recover("OLD1", "niche1_reels/007_u_OLD1.mp4")
+        
+        self.assertEqual(self.export(now=10), ["OLD1"])
+        conn = main.get_state_db()
+        try:
+            row = conn.execute("SELECT video_number, size, sha256 FROM uploads WHERE shortcode = 'OLD1'").fetchone()
+        finally:
+            conn.close()
+        self.assertEqual(row, (7, 1234, None))
+        print("✓ Test recovery_records_untracked_upload passed")
+
+    def test_shard_rotation(self):
+        """Test that rows fill shards of EXPORT_SHARD_ROWS, numbered after the last export"""
+        for i in range(3):
+            self.upload(f"caption {i}")
+        with patch.object(main, "EXPORT_SHARD_ROWS", 2):
+            first = main.export_niche("niche1", self.niche_config, now=10)
+            for i in range(5):
+                self.upload(f"caption {i}")
+            second = main.export_niche("niche1", self.niche_config, now=10)
+        
+        self.assertEqual([os.path.basename(path) for path in first], ["pins_niche1_0001.csv", "pins_niche1_0002.csv"])
+        self.assertEqual([os.path.basename(path) for path in second],
+                         ["pins_niche1_0003.csv", "pins_niche1_0004.csv", "pins_niche1_0005.csv"])
+        with open(second[0], "r", newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ["title", "description", "link", "board", "media_url"])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][3], "Fitness")
+        self.assertFalse(glob.glob(os.path.join(main.EXPORT_DIR, "niche1", "*.tmp")))
+        print("✓ Test shard_rotation passed")
+
+
+class TestCsvRowIndex(unittest.TestCase):
+    """Tests for the shortcode -> byte offset sidecar of the niche CSVs"""
+
+    def setUp(self):
+        """Set up a niche CSV in a temporary folder"""
+        self.test_dir = tempfile.mkdtemp()
+        self.niche_config = {"output_csv": os.path.join(self.test_dir, "reels_niche1.csv")}
+        self.output_csv = self.niche_config["output_csv"]
+        with open(self.output_csv, "wb") as f:
+            f.write(main.csv_line(main.CSV_HEADER))
+        self.index_cache = patch.object(main, "_csv_indexes", {})
+        self.index_cache.start()
+
+    def tearDown(self):
+        """Clean up test fixtures"""
+        self.index_cache.stop()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def write_row(self, number, shortcode, title="multi\nline title", link="https://x/1"):
+        post = Mock(shortcode=shortcode, title=title, caption=None)
+        with patch.object(main, "format_for_pinterest", return_value=(title, "desc")):
+            main.write_csv_row(self.niche_config, post, number, "fit_user", "niche1_reels",
+                               f"{number:03d}_fit_user_{shortcode}.mp4", link)
+
+    def read_rows(self):
+        with open(self.output_csv, "r", newline="", encoding="utf-8") as f:
+            return list(csv.reader(f))[1:]
+
+    def test_offsets_point_at_rows(self):
+        """Test that recorded offsets/lengths slice out exactly the written rows"""
+        for number, shortcode in enumerate(("A1", "B_2", "C3"), 1):
+            self.write_row(number, shortcode)
+        
+        offset, length = main.load_csv_index(self.output_csv)["B_2"]
+        with open(self.output_csv, "rb") as f:
+            f.seek(offset)
+            row = next(csv.reader(io.StringIO(f.read(length).decode("utf-8"), newline="")))
+        self.assertEqual(row[4], "002_fit_user_B_2.mp4")
+        print("✓ Test offsets_point_at_rows passed")
+
+    def test_last_index_line_wins(self):
+        """Test index replay: later entries replace earlier ones, -1 deletes"""
+        with open(self.output_csv + main.CSV_INDEX_SUFFIX, "w") as f:
+            f.write("A1\t10\t50\nB2\t60\t50\nA1\t110\t55\nB2\t-1\t0\nC3\t200")  # Last line half-written
+        
+        self.assertEqual(main.load_csv_index(self.output_csv), {"A1": (110, 55)})
+        print("✓ Test last_index_line_wins passed")
+
+    def test_same_length_rewritten_in_place(self):
+        """Test that an equal-length update leaves the file size unchanged"""
+        self.write_row(3, "A1", link="https://x/3")
+        size = os.path.getsize(self.output_csv)
+        
+        self.assertTrue(main.update_csv_row(self.niche_config, "A1", {"Drive Link": "https://y/3"}))
+        
+        self.assertEqual(os.path.getsize(self.output_csv), size)
+        self.assertEqual(self.read_rows()[0][5], "https://y/3")
+        self.assertFalse(main.update_csv_row(self.niche_config, "MISSING", {"Drive Link": "x"}))
+        print("✓ Test same_length_rewritten_in_place passed")
+
+    def test_shortcode_from_filename(self):
+        """Test recovering the shortcode when username and shortcode both contain underscores"""
+        self.assertEqual(main.row_shortcode(["7", "fit_user", "t", "f", "007_fit_user_AB_c1.mp4"]), "AB_c1")
+        self.assertIsNone(main.row_shortcode(["7", "other", "t", "f", "007_fit_user_AB_c1.mp4"]))
+        print("✓ Test shortcode_from_filename passed")
+
+    def test_index_rebuilt_from_csv(self):
+        """Test that a CSV without a sidecar (older runs) is indexed by scanning it"""
+        self.write_row(1, "A1")
+        self.write_row(2, "B2")
+        os.remove(self.output_csv + main.CSV_INDEX_SUFFIX)
+        main._csv_indexes.clear()
+        
+        self.assertEqual(sorted(main.load_csv_index(self.output_csv)), ["A1", "B2"])
+        print("✓ Test index_rebuilt_from_csv passed")
+
+    def test_compaction_keeps_live_rows_only(self):
+        """Test that compaction drops superseded and deleted rows, keeping file order"""
+        self.write_row(1, "A1")
+        self.write_row(2, "B2")
+        self.write_row(3, "C3")
+        self.assertTrue(main.update_csv_row(self.niche_config, "A1", {"Drive Link": "https://longer/link/1"}))
+        self.assertTrue(main.delete_csv_row(self.niche_config, "B2"))
+        
+        self.assertEqual(main.compact_csv(self.niche_config), (2, 2))
+        
+        rows = self.read_rows()
+        self.assertEqual([row[4] for row in rows], ["003_fit_user_C3.mp4", "001_fit_user_A1.mp4"])
+        self.assertEqual(rows[1][5], "https://longer/link/1")
+        self.assertEqual(sorted(main.load_csv_index(self.output_csv)), ["A1", "C3"])
+        print("✓ Test compaction_keeps_live_rows_only passed")
+
+    def test_hand_edited_csv_reindexed_before_update(self):
+        """Test that an update after a hand edit shifted the rows changes the right row"""
+        self.write_row(1, "A1")
+        self.write_row(2, "B2", title="short")
+        with open(self.output_csv, "r", newline="", encoding="utf-8") as f:
+            text = f.read()
+        with open(self.output_csv, "w", newline="", encoding="utf-8") as f:
+            f.write(text.replace("multi line title", "edited title", 1))  # Rows after A1 move up
+
+        self.assertTrue(main.update_csv_row(self.niche_config, "B2", {"Drive Link": "https://y/2"}))
+
+        rows = self.read_rows()
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][2], "edited title")
+        self.assertEqual(rows[0][5], "https://x/1")
+        self.assertEqual((rows[1][4], rows[1][5]), ("002_fit_user_B2.mp4", "https://y/2"))
+        print("✓ Test hand_edited_csv_reindexed_before_update passed")
+
+    def test_truncated_csv_reindexed_before_update(self):
+        """Test that an index pointing past the end of the CSV is rebuilt, not trusted"""
+        self.write_row(1, "A1")
+        self.write_row(2, "B2")
+        with open(self.output_csv, "rb") as f:
+            data = f.read()
+        offset, length = main.load_csv_index(self.output_csv)["B2"]
+        with open(self.output_csv, "wb") as f:
+            f.write(data[:offset])  # B2's row deleted by hand
+
+        self.assertFalse(main.update_csv_row(self.niche_config, "B2", {"Drive Link": "https://y/2"}))
+        self.assertEqual(sorted(main.load_csv_index(self.output_csv)), ["A1"])
+        self.assertEqual(len(self.read_rows()), 1)
+        print("✓ Test truncated_csv_reindexed_before_update passed")
+
+
+class TestCrossNicheReuse(unittest.TestCase):
+    """Tests for reusing uploads across niches instead of downloading again"""
+
+    def setUp(self):
+        """Set up a temporary state DB, niche files and a stub R2 client"""
+        self.test_dir = tempfile.mkdtemp()
+        self.old_cwd = os.getcwd()
+        os.chdir(self.test_dir)
+        self.niche_config = {
+            "output_csv": "reels_niche2.csv",
+            "processed_file": "processed_niche2.txt",
+            "failed_file": "failed_niche2.txt",
+            "drive_folder": "niche2_reels",
+        }
+        self.client = MagicMock()
+        self.patches = [
+            patch.object(main, "STATE_DB", os.path.join(self.test_dir, "pipeline_state.db")),
+            patch.object(main, "_number_blocks", {}),
+            patch.object(main, "get_r2_client", return_value=self.client),
+            patch.object(main, "CROSS_NICHE_REUSE", "copy"),
+            patch.object(main.time, "sleep"),
+        ]
+        for p in self.patches:
+            p.start()
+        main.seed_video_numbers("niche2_reels", 41)
+
+    def tearDown(self):
+        """Clean up test fixtures"""
+        for p in self.patches:
+            p.stop()
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+    def upload_for_niche1(self, shortcode, caption="cap"):
+        main.record_upload("niche1_reels", shortcode, "u", 1, f"niche1_reels/001_u_{shortcode}.mp4", 10, "ab" * 32)
+        if caption is not None:
+            main.record_caption("niche1_reels", shortcode, caption)
+
+    def test_found_in_other_niche(self):
+        """Test that a post uploaded for niche1 is found when niche2 processes it"""
+        self.upload_for_niche1("SC1")
+        
+        self.assertEqual(main.find_existing_upload("SC1", "niche2_reels"),
+                         ("niche1_reels/001_u_SC1.mp4", 10, "ab" * 32))
+        self.assertIsNone(main.find_existing_upload("SC1", "niche1_reels"))  # Own niche doesn't count
+        print("✓ Test found_in_other_niche passed")
+
+    def test_incomplete_upload_not_reused(self):
+        """Test that an upload whose CSV row never got written isn't reused"""
+        self.upload_for_niche1("SC2", caption=None)
+        
+        self.assertIsNone(main.find_existing_upload("SC2", "niche2_reels"))
+        print("✓ Test incomplete_upload_not_reused passed")
+
+    def test_copy_keeps_target_naming(self):
+        """Test that a copied object gets this niche's number and prefix"""
+        self.upload_for_niche1("SC1")
+        existing = main.find_existing_upload("SC1", "niche2_reels")
+        
+        link, filename = main.reuse_upload(existing, "niche2_reels", 42, "u", "SC1")
+        
+        copy_args = self.client.copy_object.call_args.kwargs
+        self.assertEqual(copy_args["CopySource"], {"Bucket": main.R2_BUCKET_NAME, "Key": "niche1_reels/001_u_SC1.mp4"})
+        self.assertEqual(copy_args["Key"], "niche2_reels/042_u_SC1.mp4")
+        self.assertEqual(copy_args["MetadataDirective"], "REPLACE")
+        self.assertNotIn("ChecksumAlgorithm", copy_args)
+        self.assertEqual(filename, "042_u_SC1.mp4")
+        self.assertEqual(link, f"{main.R2_PUBLIC_DOMAIN}/niche2_reels/042_u_SC1.mp4")
+        print("✓ Test copy_keeps_target_naming passed")
+
+    def test_process_post_reuses_without_download(self):
+        """Test that process_post copies an existing upload and never downloads"""
+        self.upload_for_niche1("SC1")
+        post = Mock(shortcode="SC1", title="Reused reel", caption=None)
+        
+        with patch.object(main, "download_video") as download:
+            self.assertTrue(main.process_post(("u", post), self.niche_config, set()))
+        
+        download.assert_not_called()
+        self.assertEqual(self.client.copy_object.call_args.kwargs["Key"], "niche2_reels/042_u_SC1.mp4")
+        with open("processed_niche2.txt", "r") as f:
+            self.assertEqual(f.read().split(), ["SC1"])
+        print("✓ Test process_post_reuses_without_download passed")
+
+    def test_failed_reuse_falls_back_to_download(self):
+        """Test that a failed copy switches the next attempt to the normal download"""
+        self.upload_for_niche1("SC1")
+        self.client.copy_object.side_effect = Exception("NoSuchKey")
+        post = Mock(shortcode="SC1", title="Reused reel", caption=None)
+        
+        with patch.object(main, "IN_MEMORY_STAGING", True), \
+             patch.object(main, "process_staged_video", return_value=("link", "042_u_SC1.mp4")) as staged:
+            self.assertTrue(main.process_post(("u", post), self.niche_config, set()))
+        
+        self.assertEqual(self.client.copy_object.call_count, 1)
+        self.assertEqual(staged.call_count, 1)
+        print("✓ Test failed_reuse_falls_back_to_download passed")
+
+
 def run_tests():
     """Run all tests and print summary"""
     print("=" * 60)
@@ -1238,6 +3151,29 @@ def run_tests():
     suite.addTests(loader.loadTestsFromTestCase(TestNicheConfiguration))
     suite.addTests(loader.loadTestsFromTestCase(TestNicheScheduling))
     suite.addTests(loader.loadTestsFromTestCase(TestNicheR2Folders))
+    suite.addTests(loader.loadTestsFromTestCase(TestR2ExistenceIndex))
+    suite.addTests(loader.loadTestsFromTestCase(TestPersistentVideoNumbers))
+    suite.addTests(loader.loadTestsFromTestCase(TestStageMetrics))
+    suite.addTests(loader.loadTestsFromTestCase(TestProfilingMode))
+    suite.addTests(loader.loadTestsFromTestCase(TestInMemoryStaging))
+    suite.addTests(loader.loadTestsFromTestCase(TestStagingBackpressure))
+    suite.addTests(loader.loadTestsFromTestCase(TestSessionPool))
+    suite.addTests(loader.loadTestsFromTestCase(TestWorkQueue))
+    suite.addTests(loader.loadTestsFromTestCase(TestDaemonScheduling))
+    suite.addTests(loader.loadTestsFromTestCase(TestRetryFailed))
+    suite.addTests(loader.loadTestsFromTestCase(TestRunPlanner))
+    suite.addTests(loader.loadTestsFromTestCase(TestPostFilters))
+    suite.addTests(loader.loadTestsFromTestCase(TestPriorityBudget))
+    suite.addTests(loader.loadTestsFromTestCase(TestParallelProfileCrawl))
+    suite.addTests(loader.loadTestsFromTestCase(TestMediaTransport))
+    suite.addTests(loader.loadTestsFromTestCase(TestBandwidthShaping))
+    suite.addTests(loader.loadTestsFromTestCase(TestOutputProfile))
+    suite.addTests(loader.loadTestsFromTestCase(TestR2KeyScheme))
+    suite.addTests(loader.loadTestsFromTestCase(TestUploadChecksums))
+    suite.addTests(loader.loadTestsFromTestCase(TestVideoValidation))
+    suite.addTests(loader.loadTestsFromTestCase(TestPinterestExport))
+    suite.addTests(loader.loadTestsFromTestCase(TestCsvRowIndex))
+    suite.addTests(loader.loadTestsFromTestCase(TestCrossNicheReuse))
     
     # Run tests
     runner = unittest.TextTestRunner(verbosity=2)